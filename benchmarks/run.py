@@ -0,0 +1,402 @@
+"""Benchmarks for the hot paths of Flask-Reuploaded.
+
+Run all benchmarks, or only those whose names contain one of the given
+words, and print the time per operation::
+
+    $ python benchmarks/run.py
+    $ python benchmarks/run.py save conflict
+
+Results can be written to a JSON file, e.g. for every release, and later
+runs compared against it. The comparison fails if a benchmark got slower by
+more than the threshold::
+
+    $ python benchmarks/run.py --output baseline.json
+    $ python benchmarks/run.py --compare baseline.json --threshold 1.25
+
+The ``import_`` benchmarks start a new interpreter for every import, so
+they include its startup time, which ``import_python`` measures alone.
+
+Timings are only comparable between runs on the same machine.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess  # nosec B404 - only runs this interpreter
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from importlib.metadata import PackageNotFoundError
+from importlib.metadata import version
+
+from flask import Flask
+from flask_uploads import ALL
+from flask_uploads import DEFAULTS
+from flask_uploads import MemoryConflictIndex
+from flask_uploads import UploadSet
+from flask_uploads import configure_uploads
+from werkzeug.datastructures import FileStorage
+
+#: A benchmark sets up its data in the given folder and returns the
+#: operation to time, and the number of items it processes per call.
+Benchmark = Callable[[str], tuple[Callable[[], None], int]]
+
+BENCHMARKS: dict[str, Benchmark] = {}
+
+
+def benchmark(func: Benchmark) -> Benchmark:
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def make_app(
+    folder: str,
+    config: dict[str, object] | None = None,
+    uset: UploadSet | None = None
+) -> tuple[Flask, UploadSet]:
+    app = Flask(__name__)
+    app.config['UPLOADS_AUTOSERVE'] = True
+    app.config['UPLOADED_FILES_DEST'] = folder
+    for key, value in (config or {}).items():
+        app.config['UPLOADED_FILES_' + key] = value
+    if uset is None:
+        uset = UploadSet('files', ALL)
+    configure_uploads(app, uset)
+    return app, uset
+
+
+def saving(folder: str, size: int, **config: object) -> Callable[[], None]:
+    app, files = make_app(folder, config)
+    data = os.urandom(size)
+
+    def run() -> None:
+        with app.app_context():
+            name = files.save(FileStorage(io.BytesIO(data), 'upload.bin'))
+        # keep the folder small, so every save is alike
+        os.remove(os.path.join(folder, name))
+
+    return run
+
+
+@benchmark
+def save_small(folder: str) -> tuple[Callable[[], None], int]:
+    return saving(folder, 1024), 1
+
+
+@benchmark
+def save_small_atomic(folder: str) -> tuple[Callable[[], None], int]:
+    return saving(folder, 1024, ATOMIC_SAVE=True), 1
+
+
+@benchmark
+def save_large(folder: str) -> tuple[Callable[[], None], int]:
+    return saving(folder, 16 * 1024 * 1024), 1
+
+
+@benchmark
+def save_large_atomic(folder: str) -> tuple[Callable[[], None], int]:
+    return saving(folder, 16 * 1024 * 1024, ATOMIC_SAVE=True), 1
+
+
+def crowded(folder: str, count: int = 10_000) -> None:
+    open(os.path.join(folder, 'photo.jpg'), 'wb').close()
+    for i in range(1, count):
+        open(os.path.join(folder, 'photo_%d.jpg' % i), 'wb').close()
+
+
+@benchmark
+def resolve_conflict_10k(folder: str) -> tuple[Callable[[], None], int]:
+    crowded(folder)
+    files = UploadSet('files', ALL)
+
+    def run() -> None:
+        files.resolve_conflict(folder, 'photo.jpg')
+
+    return run, 1
+
+
+@benchmark
+def resolve_conflict_10k_indexed(
+    folder: str
+) -> tuple[Callable[[], None], int]:
+    crowded(folder)
+    files = UploadSet('files', ALL, conflict_index=MemoryConflictIndex())
+
+    def run() -> None:
+        files.resolve_conflict(folder, 'photo.jpg')
+
+    return run, 1
+
+
+@benchmark
+def save_conflict_10k(folder: str) -> tuple[Callable[[], None], int]:
+    crowded(folder)
+    app, files = make_app(folder)
+
+    def run() -> None:
+        with app.app_context():
+            name = files.save(FileStorage(io.BytesIO(b'photo'), 'photo.jpg'))
+        os.remove(os.path.join(folder, name))
+
+    return run, 1
+
+
+@benchmark
+def save_conflict_10k_indexed(
+    folder: str
+) -> tuple[Callable[[], None], int]:
+    crowded(folder)
+    files = UploadSet('files', ALL, conflict_index=MemoryConflictIndex())
+    app, _ = make_app(folder, uset=files)
+
+    def run() -> None:
+        with app.app_context():
+            name = files.save(FileStorage(io.BytesIO(b'photo'), 'photo.jpg'))
+        os.remove(os.path.join(folder, name))
+
+    return run, 1
+
+
+@benchmark
+def extension_allowed(folder: str) -> tuple[Callable[[], None], int]:
+    app, files = make_app(folder, uset=UploadSet('files', DEFAULTS))
+    exts = ['jpg', 'png', 'exe', 'txt', 'csv', 'php', 'svg', 'json'] * 125
+
+    def run() -> None:
+        with app.app_context():
+            for ext in exts:
+                files.extension_allowed(ext)
+
+    return run, len(exts)
+
+
+@benchmark
+def validate_names_100k(folder: str) -> tuple[Callable[[], None], int]:
+    app, files = make_app(folder, uset=UploadSet('files', DEFAULTS))
+    files = files.bind(app)
+    # archives repeat a few names in many folders, next to unique ones
+    names = []
+    for i in range(20_000):
+        folder = 'dir%d/' % (i % 100)
+        names += [folder + name for name in (
+            'image.jpg', 'blob', 'IMG_%d.JPG' % i, 'notes.txt', 'run.exe')]
+
+    def run() -> None:
+        files.validate_names(names)
+
+    return run, len(names)
+
+
+@benchmark
+def save_many_20(folder: str) -> tuple[Callable[[], None], int]:
+    app, files = make_app(folder)
+    data = os.urandom(4096)
+
+    def run() -> None:
+        with app.app_context():
+            results = files.save_many(
+                FileStorage(io.BytesIO(data), 'file%d.bin' % i)
+                for i in range(20))
+        for result in results:
+            os.remove(os.path.join(folder, str(result.name)))
+
+    return run, 20
+
+
+def serving(
+    folder: str, headers: dict[str, str] | None = None, **config: object
+) -> tuple[Callable[[], None], int]:
+    app, _ = make_app(folder, config)
+    with open(os.path.join(folder, 'photo.jpg'), 'wb') as f:
+        f.write(os.urandom(64 * 1024))
+    client = app.test_client()
+    etag = client.get('/_uploads/files/photo.jpg').get_etag()[0]
+    if headers is not None:
+        headers = {k: v % etag for k, v in headers.items()}
+
+    def run() -> None:
+        response = client.get('/_uploads/files/photo.jpg', headers=headers)
+        response.close()
+
+    return run, 1
+
+
+@benchmark
+def serve(folder: str) -> tuple[Callable[[], None], int]:
+    return serving(folder)
+
+
+@benchmark
+def serve_cached(folder: str) -> tuple[Callable[[], None], int]:
+    return serving(folder, CACHE_MAX_AGE=60, STAT_CACHE_TTL=60)
+
+
+@benchmark
+def serve_not_modified(folder: str) -> tuple[Callable[[], None], int]:
+    return serving(
+        folder, {'If-None-Match': '"%s"'}, CACHE_MAX_AGE=60,
+        STAT_CACHE_TTL=60)
+
+
+def importing(statement: str) -> tuple[Callable[[], None], int]:
+    # a fresh interpreter for every import, with the same module path
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    command = [sys.executable, '-c', statement]
+
+    def run() -> None:
+        # a fixed command without a shell
+        subprocess.run(command, env=env, check=True)  # nosec B603
+
+    return run, 1
+
+
+@benchmark
+def import_python(folder: str) -> tuple[Callable[[], None], int]:
+    # the startup of the interpreter, to compare the imports with
+    return importing('pass')
+
+
+@benchmark
+def import_extensions(folder: str) -> tuple[Callable[[], None], int]:
+    return importing('from flask_uploads import IMAGES')
+
+
+@benchmark
+def import_upload_set(folder: str) -> tuple[Callable[[], None], int]:
+    return importing('from flask_uploads import UploadSet, configure_uploads')
+
+
+def measure(
+    run: Callable[[], None], items: int, repeat: int, min_time: float
+) -> dict[str, float]:
+    """
+    This times `run` like `timeit`: the number of calls per round is
+    doubled until a round takes at least `min_time` seconds, which also
+    warms up caches, then `repeat` rounds are timed. The time per item is
+    returned.
+    """
+    def timed(number: int) -> float:
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        return time.perf_counter() - start
+
+    number = 1
+    while timed(number) < min_time:
+        number *= 2
+    rounds = [timed(number) for _ in range(repeat)]
+    per_item = [t / number / items for t in rounds]
+    return dict(
+        min=min(per_item),
+        median=statistics.median(per_item),
+        ops=1 / statistics.median(per_item),
+    )
+
+
+def run_benchmarks(
+    names: list[str], repeat: int, min_time: float
+) -> dict[str, dict[str, float]]:
+    results = {}
+    for name in names:
+        folder = tempfile.mkdtemp(prefix='flask-uploads-bench-')
+        try:
+            run, items = BENCHMARKS[name](folder)
+            results[name] = measure(run, items, repeat, min_time)
+        finally:
+            shutil.rmtree(folder)
+        print(format_result(name, results[name]), flush=True)
+    return results
+
+
+def format_time(seconds: float) -> str:
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return '%.2f %s' % (seconds / scale, unit)
+    return '%.0f ns' % (seconds / 1e-9)
+
+
+def format_result(name: str, result: dict[str, float]) -> str:
+    return '%-30s %12s %12s %14.0f/s' % (
+        name, format_time(result['median']), format_time(result['min']),
+        result['ops'])
+
+
+def compare(
+    results: dict[str, dict[str, float]],
+    baseline: dict[str, dict[str, float]],
+    threshold: float
+) -> bool:
+    """
+    This prints the ratio of the median times to those of the baseline,
+    and returns whether none got slower than allowed by `threshold`.
+    """
+    ok = True
+    print()
+    print('%-30s %12s %12s %8s' % ('benchmark', 'baseline', 'now', 'ratio'))
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['median'] / baseline[name]['median']
+        slower = ratio > threshold
+        ok = ok and not slower
+        print('%-30s %12s %12s %7.2fx%s' % (
+            name, format_time(baseline[name]['median']),
+            format_time(result['median']), ratio,
+            '  SLOWER' if slower else ''))
+    return ok
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        'filters', nargs='*',
+        help='only run benchmarks whose names contain one of these')
+    parser.add_argument(
+        '--repeat', type=int, default=5,
+        help='the number of timed rounds (default: 5)')
+    parser.add_argument(
+        '--min-time', type=float, default=0.2,
+        help='the minimum seconds per round (default: 0.2)')
+    parser.add_argument('--output', help='write the results to this file')
+    parser.add_argument('--compare', help='compare with this results file')
+    parser.add_argument(
+        '--threshold', type=float, default=1.2,
+        help='the ratio of the median times to the baseline at which a '
+             'benchmark counts as slower (default: 1.2)')
+    args = parser.parse_args(argv)
+
+    names = [
+        name for name in BENCHMARKS
+        if not args.filters or any(f in name for f in args.filters)]
+    print('%-30s %12s %12s %16s' % ('benchmark', 'median', 'min', 'ops'))
+    results = run_benchmarks(names, args.repeat, args.min_time)
+
+    if args.output:
+        try:
+            release = version('Flask-Reuploaded')
+        except PackageNotFoundError:
+            release = 'unknown'
+        with open(args.output, 'w') as f:
+            json.dump(dict(
+                meta=dict(
+                    version=release,
+                    python=platform.python_version(),
+                    platform=platform.platform(),
+                    date=time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                ),
+                results=results,
+            ), f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        if not compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,38 +2,117 @@
 
 isort:skip_file
 """
-# This huge list of imports is kept on purpose,
+# This huge list of names is kept on purpose,
 # as `Flask-Uploads` provided them as public API,
 # and `Flask-Reuploaded` tries to stay compatible.
-from .exceptions import UploadNotAllowed
-
-from .extensions import ALL
-from .extensions import AllExcept
-from .extensions import TEXT
-from .extensions import DOCUMENTS
-from .extensions import IMAGES
-from .extensions import AUDIO
-from .extensions import DATA
-from .extensions import SCRIPTS
-from .extensions import ARCHIVES
-from .extensions import SOURCE
-from .extensions import EXECUTABLES
-from .extensions import DEFAULTS
-from .extensions import extension
-from .extensions import lowercase_ext
-
-
-from .flask_uploads import UploadConfiguration
-from .flask_uploads import UploadSet
-from .flask_uploads import addslash
-from .flask_uploads import configure_uploads
-from .flask_uploads import config_for_set
-from .test_helper import TestingFileStorage
+#
+# The names are imported on first access (PEP 562), so e.g.
+# ``from flask_uploads import IMAGES`` does not import Flask, and the test
+# helpers are not imported by applications which never use them.
+import importlib
+from typing import TYPE_CHECKING
+from typing import Any
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .exceptions import UploadNotAllowed
+
+    from .backends import StorageBackend
+    from .backends import FileSystemBackend
+    from .backends import MemoryBackend
+    from .backends import S3Backend
+
+    from .conflicts import ConflictIndex
+    from .conflicts import MemoryConflictIndex
+    from .conflicts import SidecarConflictIndex
+
+    from .extensions import ALL
+    from .extensions import AllExcept
+    from .extensions import ExtensionPolicy
+    from .extensions import TEXT
+    from .extensions import DOCUMENTS
+    from .extensions import IMAGES
+    from .extensions import AUDIO
+    from .extensions import DATA
+    from .extensions import SCRIPTS
+    from .extensions import ARCHIVES
+    from .extensions import SOURCE
+    from .extensions import EXECUTABLES
+    from .extensions import DEFAULTS
+    from .extensions import extension
+    from .extensions import lowercase_ext
+
+    from .flask_uploads import UploadConfiguration
+    from .flask_uploads import UploadSet
+    from .flask_uploads import SaveResult
+    from .flask_uploads import ValidatedNames
+    from .flask_uploads import addslash
+    from .flask_uploads import configure_uploads
+    from .flask_uploads import config_for_set
+    from .signals import upload_rejected
+    from .signals import upload_saved
+    from .signals import upload_served
+    from .test_helper import TestingFileStorage
+
+_LAZY = {
+    "UploadNotAllowed": "exceptions",
+    "StorageBackend": "backends",
+    "FileSystemBackend": "backends",
+    "MemoryBackend": "backends",
+    "S3Backend": "backends",
+    "ConflictIndex": "conflicts",
+    "MemoryConflictIndex": "conflicts",
+    "SidecarConflictIndex": "conflicts",
+    "ALL": "extensions",
+    "AllExcept": "extensions",
+    "ExtensionPolicy": "extensions",
+    "TEXT": "extensions",
+    "DOCUMENTS": "extensions",
+    "IMAGES": "extensions",
+    "AUDIO": "extensions",
+    "DATA": "extensions",
+    "SCRIPTS": "extensions",
+    "ARCHIVES": "extensions",
+    "SOURCE": "extensions",
+    "EXECUTABLES": "extensions",
+    "DEFAULTS": "extensions",
+    "extension": "extensions",
+    "lowercase_ext": "extensions",
+    "UploadConfiguration": "flask_uploads",
+    "UploadSet": "flask_uploads",
+    "SaveResult": "flask_uploads",
+    "ValidatedNames": "flask_uploads",
+    "addslash": "flask_uploads",
+    "configure_uploads": "flask_uploads",
+    "config_for_set": "flask_uploads",
+    "upload_rejected": "signals",
+    "upload_saved": "signals",
+    "upload_served": "signals",
+    "TestingFileStorage": "test_helper",
+}
+
+
+def __getattr__(name: str) -> Any:
+    try:
+        module = _LAZY[name]
+    except KeyError:
+        raise AttributeError(
+            "module %r has no attribute %r" % (__name__, name)) from None
+    value = getattr(importlib.import_module("." + module, __name__), name)
+    # later accesses do not need to go through here
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(_LAZY))
+
 
 __all__ = [
     "TestingFileStorage",
     "UploadConfiguration",
     "UploadSet",
+    "SaveResult",
+    "ValidatedNames",
     "addslash",
     "configure_uploads",
     "extension",
@@ -41,6 +120,7 @@ __all__ = [
     "config_for_set",
     "ALL",
     "AllExcept",
+    "ExtensionPolicy",
     "TEXT",
     "DOCUMENTS",
     "IMAGES",
@@ -52,4 +132,14 @@ __all__ = [
     "EXECUTABLES",
     "DEFAULTS",
     "UploadNotAllowed",
+    "ConflictIndex",
+    "MemoryConflictIndex",
+    "SidecarConflictIndex",
+    "StorageBackend",
+    "FileSystemBackend",
+    "MemoryBackend",
+    "S3Backend",
+    "upload_saved",
+    "upload_rejected",
+    "upload_served",
 ]
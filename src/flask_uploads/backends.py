@@ -0,0 +1,304 @@
+"""Storage backends for upload sets.
+
+A storage backend stores the files of an upload set under keys, which are
+the names returned by `UploadSet.save`, e.g. ``someguy/photo.jpg``. By
+default, upload sets store their files in their destination folder on the
+local filesystem. A different backend can be configured per set with the
+`UPLOADED_X_BACKEND` setting.
+"""
+import io
+import os
+import posixpath
+import stat
+import threading
+import time
+from collections.abc import Iterator
+from typing import IO
+from typing import Any
+
+from werkzeug.security import safe_join
+
+from .streaming import DEFAULT_BUFFER_SIZE
+from .streaming import MeteredStream
+from .streaming import copy_stream
+from .streaming import open_temporary
+
+
+class StoredFile:
+    """
+    This describes a stored file. The constructor's arguments are also the
+    attributes.
+
+    :param size: The size of the file in bytes.
+    :param mtime: The time of the last modification, as a POSIX timestamp.
+    """
+    def __init__(self, size: int, mtime: float) -> None:
+        self.size = size
+        self.mtime = mtime
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, StoredFile):
+            return NotImplemented
+        return (self.size, self.mtime) == (other.size, other.mtime)
+
+    def __repr__(self) -> str:
+        return '<StoredFile size=%d mtime=%r>' % (self.size, self.mtime)
+
+
+def normalize_key(key: str) -> str:
+    """
+    This returns `key` as a relative POSIX path, and raises `ValueError` if
+    it would point outside of the storage, e.g. for ``../secret``.
+
+    :param key: The key of a stored file.
+    """
+    if key.startswith('/') or '\\' in key or '\x00' in key:
+        raise ValueError("Invalid key %r" % key)
+    normalized = posixpath.normpath(key)
+    if normalized in ('.', '..') or normalized.startswith('../'):
+        raise ValueError("Invalid key %r" % key)
+    return normalized
+
+
+class StorageBackend:
+    """
+    This is the interface for storage backends. Missing files are reported
+    with `FileNotFoundError`.
+    """
+    def save(
+        self,
+        key: str,
+        stream: IO[bytes],
+        buffer_size: int = DEFAULT_BUFFER_SIZE
+    ) -> int:
+        """
+        This stores the remaining content of `stream` under `key`, replacing
+        any existing file, and returns the number of bytes stored. Readers
+        must never see a partially stored file.
+
+        :param key: The key to store the file under.
+        :param stream: The stream to read the content from.
+        :param buffer_size: The size of the chunks to read the stream in.
+        """
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        """This tells whether a file is stored under `key`."""
+        raise NotImplementedError
+
+    def open(self, key: str) -> IO[bytes]:
+        """This opens the file stored under `key` for reading."""
+        raise NotImplementedError
+
+    def stat(self, key: str) -> StoredFile:
+        """This returns the size and modification time of a file."""
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        """This removes the file stored under `key`."""
+        raise NotImplementedError
+
+    def list(self, prefix: str = '') -> Iterator[str]:
+        """
+        This yields the keys of all stored files below the folder `prefix`,
+        or all keys if `prefix` is empty.
+        """
+        raise NotImplementedError
+
+
+class FileSystemBackend(StorageBackend):
+    """
+    This stores files in a folder on the local filesystem. It is what upload
+    sets use by default, with their destination as `root`.
+
+    :param root: The folder to store the files in.
+    """
+    def __init__(self, root: str) -> None:
+        self.root = root
+
+    def path(self, key: str) -> str:
+        """This returns the absolute path of the file stored under `key`."""
+        path = safe_join(self.root, normalize_key(key))
+        if path is None:
+            raise ValueError("Invalid key %r" % key)  # pragma: no cover
+        return path
+
+    def save(
+        self,
+        key: str,
+        stream: IO[bytes],
+        buffer_size: int = DEFAULT_BUFFER_SIZE
+    ) -> int:
+        target = self.path(key)
+        folder, name = os.path.split(target)
+        os.makedirs(folder, exist_ok=True)
+        temp, dst = open_temporary(folder, name)
+        try:
+            with dst:
+                size = copy_stream(stream, dst, buffer_size)
+            os.replace(temp, target)
+        except BaseException:
+            os.remove(temp)
+            raise
+        return size
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self.path(key))
+
+    def open(self, key: str) -> IO[bytes]:
+        return open(self.path(key), 'rb')
+
+    def stat(self, key: str) -> StoredFile:
+        st = os.stat(self.path(key))
+        if not stat.S_ISREG(st.st_mode):
+            raise FileNotFoundError(key)
+        return StoredFile(st.st_size, st.st_mtime)
+
+    def delete(self, key: str) -> None:
+        os.remove(self.path(key))
+
+    def list(self, prefix: str = '') -> Iterator[str]:
+        top = self.path(prefix) if prefix else self.root
+        for folder, _, files in os.walk(top):
+            relative = os.path.relpath(folder, self.root)
+            for name in files:
+                if relative == os.curdir:
+                    yield name
+                else:
+                    yield posixpath.join(*relative.split(os.sep), name)
+
+
+class MemoryBackend(StorageBackend):
+    """
+    This keeps all files in a dictionary in memory. It is meant for tests
+    and benchmarks, where it avoids touching the disk at all.
+    """
+    def __init__(self) -> None:
+        self.files: dict[str, tuple[bytes, float]] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key: str) -> tuple[bytes, float]:
+        try:
+            return self.files[normalize_key(key)]
+        except KeyError:
+            raise FileNotFoundError(key) from None
+
+    def save(
+        self,
+        key: str,
+        stream: IO[bytes],
+        buffer_size: int = DEFAULT_BUFFER_SIZE
+    ) -> int:
+        key = normalize_key(key)
+        buffer = io.BytesIO()
+        size = copy_stream(stream, buffer, buffer_size)
+        with self._lock:
+            self.files[key] = (buffer.getvalue(), time.time())
+        return size
+
+    def exists(self, key: str) -> bool:
+        return normalize_key(key) in self.files
+
+    def open(self, key: str) -> IO[bytes]:
+        return io.BytesIO(self._get(key)[0])
+
+    def stat(self, key: str) -> StoredFile:
+        data, mtime = self._get(key)
+        return StoredFile(len(data), mtime)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._get(key)
+            del self.files[normalize_key(key)]
+
+    def list(self, prefix: str = '') -> Iterator[str]:
+        start = normalize_key(prefix) + '/' if prefix else ''
+        with self._lock:
+            keys = sorted(self.files)
+        return (key for key in keys if key.startswith(start))
+
+
+class S3Backend(StorageBackend):
+    """
+    This stores files in a bucket of an S3-compatible object storage. It
+    takes a client with the interface of ``boto3.client('s3')``, so it works
+    with AWS, MinIO, or a local stand-in, without `Flask-Reuploaded`
+    depending on any of them.
+
+    :param client: The S3 client.
+    :param bucket: The name of the bucket.
+    :param prefix: A prefix for all keys, e.g. ``photos/``.
+    """
+    def __init__(self, client: Any, bucket: str, prefix: str = '') -> None:
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _key(self, key: str) -> str:
+        return self.prefix + normalize_key(key)
+
+    @staticmethod
+    def _is_missing(error: Exception) -> bool:
+        response = getattr(error, 'response', None) or {}
+        code = response.get('Error', {}).get('Code')
+        return code in ('404', 'NoSuchKey', 'NotFound')
+
+    def _head(self, key: str) -> Any:
+        try:
+            return self.client.head_object(
+                Bucket=self.bucket, Key=self._key(key))
+        except Exception as e:
+            if self._is_missing(e):
+                raise FileNotFoundError(key) from None
+            raise
+
+    def save(
+        self,
+        key: str,
+        stream: IO[bytes],
+        buffer_size: int = DEFAULT_BUFFER_SIZE
+    ) -> int:
+        metered = MeteredStream(stream)
+        self.client.upload_fileobj(
+            io.BufferedReader(metered, buffer_size), self.bucket,
+            self._key(key))
+        return metered.count
+
+    def exists(self, key: str) -> bool:
+        try:
+            self._head(key)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def open(self, key: str) -> IO[bytes]:
+        try:
+            response = self.client.get_object(
+                Bucket=self.bucket, Key=self._key(key))
+        except Exception as e:
+            if self._is_missing(e):
+                raise FileNotFoundError(key) from None
+            raise
+        body: IO[bytes] = response['Body']
+        return body
+
+    def stat(self, key: str) -> StoredFile:
+        head = self._head(key)
+        return StoredFile(
+            head['ContentLength'], head['LastModified'].timestamp())
+
+    def delete(self, key: str) -> None:
+        # deleting a missing object is not an error in S3
+        self._head(key)
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def list(self, prefix: str = '') -> Iterator[str]:
+        start = self._key(prefix) + '/' if prefix else self.prefix
+        kwargs = dict(Bucket=self.bucket, Prefix=start)
+        while True:
+            response = self.client.list_objects_v2(**kwargs)
+            for item in response.get('Contents', ()):
+                yield item['Key'][len(self.prefix):]
+            if not response.get('IsTruncated'):
+                return
+            kwargs['ContinuationToken'] = response['NextContinuationToken']
@@ -0,0 +1,81 @@
+"""Small, thread-safe caches used on the hot paths of Flask-Reuploaded."""
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Hashable
+from typing import Generic
+from typing import TypeVar
+
+V = TypeVar('V')
+
+
+class LRUCache(Generic[V]):
+    """
+    A bounded mapping which evicts the least recently used entry once it
+    holds more than `maxsize` items. All operations are guarded by a lock, so
+    a single instance can be shared between threads.
+
+    :param maxsize: The maximum number of entries to keep.
+    :param ttl: If given, entries expire this many seconds after they were
+                set, so changes made elsewhere are picked up eventually.
+    """
+    def __init__(self, maxsize: int = 1024, ttl: float | None = None) -> None:
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        if ttl is not None and ttl <= 0:
+            raise ValueError("ttl must be a positive number")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, V]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, key: Hashable) -> tuple[float, V]:
+        # must be called with the lock held
+        item = self._data[key]
+        if self.ttl is not None and item[0] <= time.monotonic():
+            del self._data[key]
+            raise KeyError(key)
+        return item
+
+    def get(self, key: Hashable, default: V | None = None) -> V | None:
+        with self._lock:
+            try:
+                _, value = self._lookup(key)
+            except KeyError:
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: V) -> None:
+        expires = 0.0
+        if self.ttl is not None:
+            expires = time.monotonic() + self.ttl
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: V | None = None) -> V | None:
+        with self._lock:
+            try:
+                _, value = self._lookup(key)
+            except KeyError:
+                return default
+            del self._data[key]
+            return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            try:
+                self._lookup(key)
+            except KeyError:
+                return False
+            return True
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -0,0 +1,604 @@
+"""Resumable uploads, sent in chunks.
+
+Large files are uploaded in several requests, each carrying a chunk of the
+file and the offset it starts at. The chunks are staged on the server, so an
+interrupted upload is resumed by asking for the offset received so far, and
+chunks may be sent in parallel and in any order. Once all bytes arrived, the
+file is saved into its upload set with `UploadSet.save`, so it passes the
+same checks as any other upload.
+
+The staged file is allocated in full when the upload starts, and every chunk
+is written straight to its offset in it, also by concurrent requests, so no
+separate pass is needed to join the chunks once the last one arrived. Chunks
+hold a shared lock on the staged file while they are written, and completing
+the upload an exclusive one, so the file cannot change any more once it was
+checked and linked into the upload set.
+
+The protocol is served by the `chunked_blueprint`, for upload sets with
+`UPLOADED_X_CHUNKED` set:
+
+``POST /_uploads/chunked/<setname>``
+    Starts an upload. The form or JSON body has the ``filename`` and the
+    total ``size`` in bytes. It answers with ``201 Created``, the ``id`` of
+    the upload, and its URL in the ``Location`` header.
+
+``PUT /_uploads/chunked/<setname>/<id>``
+    Stores the request body as the chunk starting at the offset given in
+    the ``Upload-Offset`` header.
+
+``GET`` or ``HEAD /_uploads/chunked/<setname>/<id>``
+    Tells the number of bytes received from the start of the file without
+    gaps in the ``Upload-Offset`` header, and all received byte ranges.
+
+``POST /_uploads/chunked/<setname>/<id>/complete``
+    Saves the completed file into the upload set, and answers with its
+    ``name`` and ``url``.
+
+``DELETE /_uploads/chunked/<setname>/<id>``
+    Cancels the upload.
+"""
+import errno
+import json
+import os
+import re
+import secrets
+import shutil
+import tempfile
+import threading
+import time
+from typing import IO
+from typing import TYPE_CHECKING
+from typing import Any
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore[assignment]
+
+from flask import Blueprint
+from flask import Flask
+from flask import abort
+from flask import current_app
+from flask import jsonify
+from flask import request
+from flask import url_for
+from werkzeug.datastructures import FileStorage
+from werkzeug.routing import BuildError
+
+from .exceptions import UploadNotAllowed
+from .extensions import extension
+from .streaming import DEFAULT_BUFFER_SIZE
+from .streaming import LinkableFile
+from .streaming import open_temporary
+from .streaming import private_folder
+from .streaming import too_large
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .flask_uploads import UploadConfiguration
+    from .flask_uploads import UploadSet
+
+#: The size limit of chunked uploads to sets without `UPLOADED_X_MAX_SIZE`.
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+
+_ID = re.compile(r'^[A-Za-z0-9_-]{22}$')
+_INFO = 'upload.json'
+_DATA = 'data'
+_COMPLETING = 'completing'
+_RANGE = re.compile(r'^(\d{20})-(\d{20})\.range$')
+
+# errors which mean that the filesystem cannot allocate space up front
+_NO_FALLOCATE_ERRNOS = frozenset((
+    errno.EOPNOTSUPP, errno.ENOTSUP, errno.ENOSYS, errno.EINVAL,
+))
+
+
+def preallocate(fd: int, size: int) -> None:
+    """
+    This extends the file `fd` to `size` bytes, allocating the space on disk
+    right away where the filesystem supports it, so running out of space is
+    noticed before any data is sent, and the file is not fragmented by
+    chunks arriving out of order.
+
+    Sizes the filesystem cannot store raise `OSError` with ``EFBIG``.
+
+    :param fd: The file descriptor of an empty file.
+    :param size: The size of the file in bytes.
+    """
+    fallocate = getattr(os, 'posix_fallocate', None)
+    try:
+        if fallocate is not None and size > 0:
+            try:
+                fallocate(fd, 0, size)
+                return
+            except OSError as e:
+                if e.errno not in _NO_FALLOCATE_ERRNOS:
+                    raise
+        # a sparse file, which is filled in by the chunks
+        os.ftruncate(fd, size)
+    except OverflowError as e:
+        # larger than any file the platform can address
+        raise OSError(errno.EFBIG, os.strerror(errno.EFBIG)) from e
+
+
+def pwrite(fd: int, data: bytes, offset: int) -> None:
+    """
+    This writes all of `data` to `fd` at `offset`. Where the platform has
+    `os.pwrite`, the file position is not used, so several threads can share
+    the file descriptor.
+    """
+    view = memoryview(data)
+    while view:
+        if hasattr(os, 'pwrite'):
+            written = os.pwrite(fd, view, offset)
+        else:  # pragma: no cover
+            # every request opens the file on its own, e.g. on Windows
+            os.lseek(fd, offset, os.SEEK_SET)
+            written = os.write(fd, view)
+        offset += written
+        view = view[written:]
+
+
+def lock(fd: int, exclusive: bool = False) -> None:
+    """
+    This locks the file `fd` until it is closed, waiting for other locks if
+    needed. Any number of shared locks may be held at the same time, but an
+    exclusive lock only by itself. Where the platform has no `fcntl.flock`,
+    nothing is locked.
+
+    :param fd: The file descriptor of the staged file.
+    :param exclusive: Whether to take an exclusive instead of a shared lock.
+    """
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+
+def staging_folder(app: Flask) -> str:
+    """
+    This returns the folder chunks are staged in, which is configured with
+    `UPLOADS_CHUNKED_DEST`, and defaults to a folder in the system's
+    temporary directory. The default folder is only used if it is private to
+    the current user, see `private_folder`.
+
+    :param app: The application.
+    """
+    folder = app.config.get('UPLOADS_CHUNKED_DEST')
+    if folder is None:
+        return private_folder(
+            os.path.join(tempfile.gettempdir(), 'flask-uploads-chunked'))
+    return str(folder)
+
+
+def max_size(app: Flask, config: 'UploadConfiguration') -> int:
+    """
+    This returns the largest file which may be uploaded in chunks to an
+    upload set. The space for it is allocated as soon as an upload starts,
+    so the size clients declare is always limited, by the `max_size` of the
+    set, or else by `UPLOADS_CHUNKED_MAX_SIZE`.
+
+    :param app: The application.
+    :param config: The configuration of the upload set.
+    """
+    if config.max_size is not None:
+        return config.max_size
+    return int(app.config.get('UPLOADS_CHUNKED_MAX_SIZE', DEFAULT_MAX_SIZE))
+
+
+class ChunkedUpload:
+    """
+    This is a resumable upload, whose chunks are staged in a folder of its
+    own until it is complete. Use `create` to start an upload, and `load` to
+    continue it. The constructor's arguments are also the attributes.
+
+    :param folder: The folder the chunks are staged in.
+    :param id: The random, unguessable id of the upload.
+    :param setname: The name of the upload set the file is meant for.
+    :param filename: The filename given by the client.
+    :param size: The total size of the file in bytes.
+    """
+    def __init__(
+        self,
+        folder: str,
+        id: str,
+        setname: str,
+        filename: str,
+        size: int
+    ) -> None:
+        self.folder = folder
+        self.id = id
+        self.setname = setname
+        self.filename = filename
+        self.size = size
+
+    @classmethod
+    def create(
+        cls, staging: str, setname: str, filename: str, size: int
+    ) -> 'ChunkedUpload':
+        """
+        This starts a new upload, staged in a new folder in `staging`.
+
+        :param staging: The staging folder of the application.
+        :param setname: The name of the upload set the file is meant for.
+        :param filename: The filename given by the client.
+        :param size: The total size of the file in bytes.
+        """
+        if size < 0:
+            raise ValueError("size must not be negative")
+        os.makedirs(staging, exist_ok=True)
+        while True:
+            upload_id = secrets.token_urlsafe(16)
+            folder = os.path.join(staging, upload_id)
+            try:
+                os.mkdir(folder)
+            except FileExistsError:  # pragma: no cover
+                continue
+            break
+        upload = cls(folder, upload_id, setname, filename, size)
+        flags = os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(
+            os, 'O_BINARY', 0)
+        fd = os.open(os.path.join(folder, _DATA), flags, 0o666)
+        try:
+            preallocate(fd, size)
+        except BaseException:
+            os.close(fd)
+            upload.discard()
+            raise
+        os.close(fd)
+        info = dict(setname=setname, filename=filename, size=size)
+        temp, dst = open_temporary(folder, _INFO)
+        with dst:
+            dst.write(json.dumps(info).encode('utf-8'))
+        os.replace(temp, os.path.join(folder, _INFO))
+        return upload
+
+    @classmethod
+    def load(cls, staging: str, upload_id: str) -> 'ChunkedUpload':
+        """
+        This returns the upload with the id `upload_id`, or raises
+        `FileNotFoundError` if there is none.
+
+        :param staging: The staging folder of the application.
+        :param upload_id: The id of the upload.
+        """
+        if not _ID.match(upload_id):
+            raise FileNotFoundError(upload_id)
+        folder = os.path.join(staging, upload_id)
+        with open(os.path.join(folder, _INFO), 'rb') as f:
+            info = json.loads(f.read())
+        return cls(
+            folder, upload_id, info['setname'], info['filename'], info['size'])
+
+    @property
+    def path(self) -> str:
+        """This is the path of the staged file."""
+        return os.path.join(self.folder, _DATA)
+
+    def chunks(self) -> list[tuple[int, int]]:
+        """
+        This returns the start and end offsets of all chunks written so far,
+        ordered by their start. A chunk is only recorded once all of its
+        bytes are written, with an empty marker file named after its range.
+        """
+        chunks = []
+        for name in os.listdir(self.folder):
+            match = _RANGE.match(name)
+            if match is not None:
+                chunks.append((int(match.group(1)), int(match.group(2))))
+        chunks.sort()
+        return chunks
+
+    def received(self) -> list[tuple[int, int]]:
+        """
+        This returns the byte ranges received so far, as start and end
+        offsets, with adjacent and overlapping chunks merged.
+        """
+        ranges: list[tuple[int, int]] = []
+        for start, end in self.chunks():
+            if ranges and start <= ranges[-1][1]:
+                if end > ranges[-1][1]:
+                    ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+        return ranges
+
+    @property
+    def offset(self) -> int:
+        """
+        This is the number of bytes received from the start of the file
+        without gaps, which is where a client resumes a sequential upload.
+        """
+        ranges = self.received()
+        if ranges and ranges[0][0] == 0:
+            return ranges[0][1]
+        return 0
+
+    @property
+    def completing(self) -> bool:
+        """This tells whether the upload is being saved into its set."""
+        return os.path.exists(os.path.join(self.folder, _COMPLETING))
+
+    def _check_open(self, fd: int) -> None:
+        # the upload may have been completed or cancelled while waiting for
+        # the lock, and then the file must not be changed any more
+        if self.completing or not os.path.samestat(
+            os.fstat(fd), os.stat(self.path)
+        ):
+            raise FileNotFoundError(self.id)
+
+    @property
+    def complete(self) -> bool:
+        """This tells whether all bytes of the file have been received."""
+        return self.offset == self.size
+
+    def write(
+        self,
+        offset: int,
+        stream: IO[bytes],
+        buffer_size: int = DEFAULT_BUFFER_SIZE
+    ) -> int:
+        """
+        This writes the content of `stream` to the staged file, starting at
+        `offset`, and returns the number of bytes written. A chunk which
+        would end after the end of the file is rejected with
+        `UploadNotAllowed`. Sending a chunk again overwrites it, and chunks
+        of the same upload may be written concurrently. Once the upload is
+        being completed, or is gone, `FileNotFoundError` is raised.
+
+        :param offset: The offset of the chunk within the file.
+        :param stream: The content of the chunk.
+        :param buffer_size: The size of the pieces to read `stream` in.
+        """
+        if not 0 <= offset <= self.size:
+            raise ValueError("offset %d is out of range" % offset)
+        max_size = self.size - offset
+        written = 0
+        fd = os.open(self.path, os.O_WRONLY | getattr(os, 'O_BINARY', 0))
+        try:
+            lock(fd)
+            self._check_open(fd)
+            while True:
+                data = stream.read(buffer_size)
+                if not data:
+                    break
+                if written + len(data) > max_size:
+                    raise too_large(max_size)
+                pwrite(fd, data, offset + written)
+                written += len(data)
+            if written:
+                # the range is only recorded once all of its bytes are
+                # written
+                marker = '%020d-%020d.range' % (offset, offset + written)
+                os.close(os.open(
+                    os.path.join(self.folder, marker),
+                    os.O_CREAT | os.O_WRONLY, 0o666))
+        finally:
+            os.close(fd)
+        return written
+
+    def assemble(self) -> LinkableFile:
+        """
+        This returns the staged file of the complete upload, opened for
+        reading. As the chunks were written to their offsets in it right
+        away, there is nothing left to join, and as it is discarded once it
+        was saved, `UploadSet.save` hard-links it into place rather than
+        copying it, where it is on the same filesystem.
+        """
+        if not self.complete:
+            raise ValueError("upload %s is not complete" % self.id)
+        return LinkableFile(self.path)
+
+    def discard(self) -> None:
+        """This removes the upload and all of its chunks."""
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
+def complete_upload(
+    uset: 'UploadSet',
+    upload: ChunkedUpload,
+    folder: str | None = None,
+    name: str | None = None
+) -> str:
+    """
+    This saves a complete upload into `uset`, with the same checks as
+    `UploadSet.save`, and returns the name it was saved as. The staged file
+    is hard-linked into the upload set, or copied by the kernel if it is on
+    another filesystem, so its content never passes through Python. The
+    upload is removed afterwards, and also if it was not allowed.
+
+    Chunks which are still being written are waited for, and chunks sent
+    from then on are rejected, so the saved file is exactly the one which
+    was checked. If the upload was completed or cancelled by another request
+    in the meantime, `FileNotFoundError` is raised.
+
+    :param uset: The upload set to save the file into.
+    :param upload: The complete upload.
+    :param folder: The subfolder within the upload set to save to.
+    :param name: The name to save the file as.
+    """
+    with upload.assemble() as stream:
+        lock(stream.fileno(), exclusive=True)
+        upload._check_open(stream.fileno())
+        marker = os.path.join(upload.folder, _COMPLETING)
+        os.close(os.open(marker, os.O_CREAT | os.O_WRONLY, 0o666))
+        storage = FileStorage(
+            stream, filename=upload.filename, content_length=upload.size)
+        try:
+            saved = uset.save(storage, folder, name)
+        except UploadNotAllowed:
+            upload.discard()
+            raise
+        except BaseException:
+            # the upload may be resumed and completed again
+            os.remove(marker)
+            raise
+    upload.discard()
+    return saved
+
+
+def purge_stale(staging: str, max_age: float) -> int:
+    """
+    This removes all uploads in `staging` which were not written to for
+    `max_age` seconds, e.g. because the client gave up, and returns their
+    number. Call this periodically, e.g. from a scheduled job.
+
+    :param staging: The staging folder of the application.
+    :param max_age: The age in seconds after which uploads are removed.
+    """
+    limit = time.time() - max_age
+    removed = 0
+    try:
+        entries = list(os.scandir(staging))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        if not (_ID.match(entry.name) and entry.is_dir()):
+            continue
+        with os.scandir(entry.path) as files:
+            latest = max(
+                [entry.stat().st_mtime] +
+                [f.stat().st_mtime for f in files])
+        if latest < limit:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+    return removed
+
+
+def _upload_set(setname: str) -> 'UploadSet':
+    config = current_app.upload_set_config.get(setname)  # type: ignore
+    if config is None or not config.chunked:
+        abort(404)
+    uset: UploadSet = current_app.upload_sets[setname]  # type: ignore
+    return uset
+
+
+def _load(setname: str, upload_id: str) -> ChunkedUpload:
+    try:
+        upload = ChunkedUpload.load(staging_folder(current_app), upload_id)
+    except FileNotFoundError:
+        abort(404)
+    if upload.setname != setname:
+        abort(404)
+    return upload
+
+
+def _status(upload: ChunkedUpload, status: int = 200) -> Any:
+    ranges = upload.received()
+    offset = ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+    response = jsonify(
+        id=upload.id, size=upload.size, offset=offset,
+        received=[list(r) for r in ranges])
+    response.status_code = status
+    response.headers['Upload-Offset'] = str(offset)
+    response.headers['Upload-Length'] = str(upload.size)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+def create_upload(setname: str) -> Any:
+    uset = _upload_set(setname)
+    params = request.get_json(silent=True) or request.form
+    filename = params.get('filename')
+    try:
+        size = int(params.get('size', ''))
+    except (TypeError, ValueError):
+        abort(400)
+    if not filename or size < 0:
+        abort(400)
+    # reject what is not going to be saved before anything is sent
+    if not uset.extension_allowed(extension(uset.get_basename(filename))):
+        abort(403)
+    if size > max_size(current_app, uset.config):
+        abort(413)
+    try:
+        upload = ChunkedUpload.create(
+            staging_folder(current_app), setname, filename, size)
+    except OSError as e:
+        if e.errno == errno.EFBIG:
+            abort(413)
+        if e.errno != errno.ENOSPC:
+            raise
+        return 'Insufficient Storage', 507
+    response = _status(upload, 201)
+    response.headers['Location'] = url_for(
+        '_uploads_chunked.upload_status', setname=setname,
+        upload_id=upload.id)
+    return response
+
+
+def upload_status(setname: str, upload_id: str) -> Any:
+    _upload_set(setname)
+    return _status(_load(setname, upload_id))
+
+
+def upload_chunk(setname: str, upload_id: str) -> Any:
+    _upload_set(setname)
+    upload = _load(setname, upload_id)
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+        upload.write(offset, request.stream)
+    except ValueError:
+        abort(400)
+    except UploadNotAllowed:
+        abort(413)
+    except FileNotFoundError:
+        # completed or cancelled in the meantime
+        abort(404)
+    return _status(upload)
+
+
+def finish_upload(setname: str, upload_id: str) -> Any:
+    uset = _upload_set(setname)
+    upload = _load(setname, upload_id)
+    if not upload.complete:
+        return _status(upload, 409)
+    try:
+        name = complete_upload(uset, upload)
+    except UploadNotAllowed:
+        abort(403)
+    except FileNotFoundError:
+        abort(404)
+    try:
+        url = uset.url(name)
+    except BuildError:
+        # the files of the set are not served
+        url = None
+    response = jsonify(name=name, url=url)
+    response.status_code = 201
+    return response
+
+
+def cancel_upload(setname: str, upload_id: str) -> Any:
+    _upload_set(setname)
+    _load(setname, upload_id).discard()
+    return '', 204
+
+
+_chunked_mod: Blueprint | None = None
+_blueprint_lock = threading.Lock()
+
+
+def chunked_blueprint() -> Blueprint:
+    """
+    This returns the `_uploads_chunked` blueprint, which serves the
+    protocol. It is only created once an application needs it.
+    """
+    global _chunked_mod
+    with _blueprint_lock:
+        if _chunked_mod is None:
+            blueprint = Blueprint(
+                '_uploads_chunked', __name__, url_prefix='/_uploads/chunked')
+            blueprint.add_url_rule(
+                '/<setname>', view_func=create_upload, methods=['POST'])
+            blueprint.add_url_rule(
+                '/<setname>/<upload_id>', view_func=upload_status,
+                methods=['GET'])
+            blueprint.add_url_rule(
+                '/<setname>/<upload_id>', view_func=upload_chunk,
+                methods=['PUT', 'PATCH'])
+            blueprint.add_url_rule(
+                '/<setname>/<upload_id>/complete', view_func=finish_upload,
+                methods=['POST'])
+            blueprint.add_url_rule(
+                '/<setname>/<upload_id>', view_func=cancel_upload,
+                methods=['DELETE'])
+            _chunked_mod = blueprint
+        return _chunked_mod
@@ -0,0 +1,142 @@
+"""Indexes which speed up `UploadSet.resolve_conflict`.
+
+Without an index, resolving a name conflict probes ``name_1``, ``name_2``,
+... until a free name is found, so the n-th upload of the same filename
+costs n ``stat`` calls. A conflict index remembers the highest suffix handed
+out per directory and basename, so a warm index resolves a conflict with a
+single probe. A cold index (or one which lost its entry) falls back to the
+linear scan, which then seeds the index again.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+
+from .caching import LRUCache
+
+
+class ConflictIndex:
+    """
+    This is the interface for conflict indexes. Pass an instance to the
+    `UploadSet` constructor as `conflict_index` to enable it.
+    """
+    def reserve(self, target_folder: str, basename: str) -> int | None:
+        """
+        This returns the next suffix to try for `basename` in
+        `target_folder` and marks it as handed out, or `None` if the index
+        knows nothing about that name.
+
+        :param target_folder: The absolute path to the target folder.
+        :param basename: The file's original basename.
+        """
+        raise NotImplementedError
+
+    def record(self, target_folder: str, basename: str, count: int) -> None:
+        """
+        This stores `count` as the highest suffix in use for `basename` in
+        `target_folder`, unless a higher one is already known.
+
+        :param target_folder: The absolute path to the target folder.
+        :param basename: The file's original basename.
+        :param count: The suffix which was handed out.
+        """
+        raise NotImplementedError
+
+
+class MemoryConflictIndex(ConflictIndex):
+    """
+    A conflict index which lives in the memory of the current process. The
+    least recently used entries are evicted once more than `maxsize`
+    basenames are tracked.
+
+    :param maxsize: The maximum number of basenames to remember.
+    """
+    def __init__(self, maxsize: int = 1024) -> None:
+        self._counters: LRUCache[int] = LRUCache(maxsize)
+        self._lock = threading.Lock()
+
+    def reserve(self, target_folder: str, basename: str) -> int | None:
+        key = (target_folder, basename)
+        with self._lock:
+            count = self._counters.get(key)
+            if count is None:
+                return None
+            count += 1
+            self._counters.set(key, count)
+            return count
+
+    def record(self, target_folder: str, basename: str, count: int) -> None:
+        key = (target_folder, basename)
+        with self._lock:
+            current = self._counters.get(key)
+            if current is None or count > current:
+                self._counters.set(key, count)
+
+
+class SidecarConflictIndex(MemoryConflictIndex):
+    """
+    A `MemoryConflictIndex` which additionally persists the counters, so
+    the index survives restarts and is shared between worker processes.
+    Every counter is stored in a small file of its own in `folder`, named
+    after a hash of the target folder and basename, so recording a counter
+    does not touch any other, and no filename is revealed. Counters read
+    from these files are only ever used as a starting point, so a stale file
+    never leads to an overwritten upload.
+
+    :param folder: The folder to store the counters in, which is shared by
+                   all worker processes. It must not be served, nor be
+                   writable by other users.
+    :param maxsize: The maximum number of basenames to keep in memory.
+    """
+    def __init__(self, folder: str, maxsize: int = 1024) -> None:
+        super().__init__(maxsize)
+        self.folder = folder
+        self._file_lock = threading.Lock()
+
+    def path(self, target_folder: str, basename: str) -> str:
+        """
+        This returns the path of the file the counter of `basename` in
+        `target_folder` is stored in.
+        """
+        key = '%s\0%s' % (target_folder, basename)
+        digest = hashlib.sha256(
+            key.encode('utf-8', 'surrogateescape')).hexdigest()
+        return os.path.join(self.folder, digest[:2], digest)
+
+    def _load(self, path: str) -> int | None:
+        try:
+            with open(path) as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def reserve(self, target_folder: str, basename: str) -> int | None:
+        count = super().reserve(target_folder, basename)
+        if count is not None:
+            return count
+        stored = self._load(self.path(target_folder, basename))
+        if stored is None:
+            return None
+        super().record(target_folder, basename, stored)
+        return super().reserve(target_folder, basename)
+
+    def record(self, target_folder: str, basename: str, count: int) -> None:
+        super().record(target_folder, basename, count)
+        path = self.path(target_folder, basename)
+        with self._file_lock:
+            stored = self._load(path)
+            if stored is not None and stored >= count:
+                return
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                fd, temp = tempfile.mkstemp(
+                    '.tmp', '.', os.path.dirname(path))
+            except OSError:
+                # the stored counters are an optimization only
+                return
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    f.write(str(count))
+                os.replace(temp, path)
+            except OSError:
+                os.remove(temp)
@@ -0,0 +1,73 @@
+"""Thread pools used to move blocking filesystem work off the caller."""
+import contextvars
+import functools
+import os
+import threading
+from collections.abc import Callable
+from concurrent.futures import Executor
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from typing import TypeVar
+
+T = TypeVar('T')
+
+_default_executor: ThreadPoolExecutor | None = None
+_lock = threading.Lock()
+
+
+def default_executor() -> ThreadPoolExecutor:
+    """
+    This returns the thread pool shared by all upload sets which were not
+    given an executor of their own. It is created on first use and bounded
+    to a few threads per CPU, so a burst of uploads cannot spawn an
+    unlimited number of threads.
+    """
+    global _default_executor
+    with _lock:
+        if _default_executor is None:
+            _default_executor = ThreadPoolExecutor(
+                max_workers=min(32, (os.cpu_count() or 1) + 4),
+                thread_name_prefix='flask-uploads',
+            )
+        return _default_executor
+
+
+def submit(
+    executor: Executor | None, func: Callable[..., T], *args: Any
+) -> 'Future[T]':
+    """
+    This schedules `func` on `executor`, or the default executor, and
+    returns its future. Like `run`, it propagates the current context to the
+    worker thread.
+
+    :param executor: The executor to use, or `None` for the default one.
+    :param func: The function to call.
+    :param args: The positional arguments for `func`.
+    """
+    context = contextvars.copy_context()
+    return (executor or default_executor()).submit(context.run, func, *args)
+
+
+async def run(
+    executor: Executor | None, func: Callable[..., T], *args: Any
+) -> T:
+    """
+    This awaits `func` running on `executor`, or the default executor,
+    without blocking the event loop. It runs in a copy of the current
+    context, so it can still access the Flask application context of the
+    caller.
+
+    :param executor: The executor to use, or `None` for the default one.
+    :param func: The function to call.
+    :param args: The positional arguments for `func`.
+    """
+    # asyncio is slow to import and only needed by async views
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        executor or default_executor(),
+        functools.partial(context.run, func, *args),
+    )
@@ -98,6 +98,56 @@ class AllExcept:
         return item not in self.items
 
 
+# containers which can be compiled into a frozenset without changing what
+# `in` means for them - in contrast to e.g. a string, which matches substrings
+_SET_LIKE = (tuple, list, set, frozenset)
+
+
+class ExtensionPolicy:
+    """
+    This is the compiled form of an upload set's extensions together with
+    the `allow` and `deny` settings of its configuration. Wherever possible,
+    they are merged into a single `frozenset`, so checking an extension is a
+    single hash lookup. `configure_uploads` creates one for each upload set
+    and stores it on the `UploadConfiguration` as `policy`.
+
+    It supports `ALL` and `AllExcept`. Other containers are kept as they are
+    and checked the same way `UploadSet.extension_allowed` always did.
+
+    :param extensions: The extensions of the upload set.
+    :param allow: Extensions to allow in addition.
+    :param deny: Extensions to deny, unless they are in `allow`.
+    """
+    def __init__(
+        self,
+        extensions: Iterable[str],
+        allow: Iterable[str] = (),
+        deny: Iterable[str] = ()
+    ) -> None:
+        self.extensions = extensions
+        self.allow = frozenset(allow)
+        self.deny = frozenset(deny)
+        self._allowed: frozenset[str] | None = None
+        self._denied: frozenset[str] | None = None
+        # subclasses may have changed what `in` means, so are not compiled
+        kind: type[object] = type(extensions)
+        excluded = getattr(extensions, 'items', None)
+        if kind is All:
+            self._denied = self.deny - self.allow
+        elif kind is AllExcept and isinstance(excluded, _SET_LIKE):
+            self._denied = (frozenset(excluded) | self.deny) - self.allow
+        elif isinstance(extensions, _SET_LIKE):
+            self._allowed = self.allow | (frozenset(extensions) - self.deny)
+
+    def __contains__(self, ext: str) -> bool:
+        if self._allowed is not None:
+            return ext in self._allowed
+        if self._denied is not None:
+            return ext not in self._denied
+        return ((ext in self.allow) or
+                (ext in self.extensions and ext not in self.deny))
+
+
 def extension(filename: str) -> str:
     ext = os.path.splitext(filename)[1]
     if ext.startswith('.'):
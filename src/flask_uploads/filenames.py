@@ -0,0 +1,64 @@
+"""Sanitizing client filenames in a single pass.
+
+`UploadSet.save` needs the sanitized name of an upload, its lowercase
+extension, and whether a requested name ends with a dot, so the extension
+of the upload is to be appended. `normalize_filename` works all of them out
+at once, instead of splitting the name again for each of them. Clients send
+the same few names over and over, e.g. ``image.jpg`` or ``blob``, so the
+results can be kept in a bounded cache.
+"""
+from typing import NamedTuple
+
+from werkzeug.utils import secure_filename
+
+from .caching import LRUCache
+
+
+class Filename(NamedTuple):
+    """
+    This is a filename sanitized with `werkzeug.utils.secure_filename`,
+    split into its parts.
+    """
+    #: The sanitized filename, in its original case.
+    name: str
+    #: The sanitized filename without its extension.
+    stem: str
+    #: The lowercase extension, without the dot, or an empty string.
+    ext: str
+    #: Whether the filename given ended with a dot.
+    dotted: bool
+
+    @property
+    def basename(self) -> str:
+        """This is the sanitized filename with a lowercase extension."""
+        return self.stem + '.' + self.ext if self.ext else self.stem
+
+
+def normalize_filename(
+    filename: str, cache: 'LRUCache[Filename] | None' = None
+) -> Filename:
+    """
+    This sanitizes `filename` and splits it into its parts. The `basename`
+    of the result is the same as ``lowercase_ext(secure_filename(filename))``
+    and its `ext` the same as `extension` of that.
+
+    :param filename: The filename sent by the client, or requested by the
+                     application.
+    :param cache: If given, the results are looked up in and added to this
+                  cache, which can be shared between threads.
+    """
+    if cache is not None:
+        normalized = cache.get(filename)
+        if normalized is not None:
+            return normalized
+    name = secure_filename(filename)
+    # sanitized names neither start nor end with a dot, and have no folders,
+    # so this splits them like `os.path.splitext`
+    stem, dot, ext = name.rpartition('.')
+    if not dot:
+        stem, ext = name, ''
+    normalized = Filename(
+        name, stem, ext.lower(), filename.rstrip().endswith('.'))
+    if cache is not None:
+        cache.set(filename, normalized)
+    return normalized
@@ -10,27 +10,77 @@ and upload your files to it.
 :copyright: 2019-2020 Jürgen Gmach <juergen.gmach@googlemail.com>
 :license:   MIT/X11, see LICENSE for details
 """
+import copy
+import hashlib
+import io
 import os
 import os.path
 import posixpath
+import tempfile
+import threading
 from collections.abc import Callable
 from collections.abc import Iterable
+from concurrent.futures import Executor
+from concurrent.futures import Future
+from typing import IO
 from typing import Any
 from typing import Union
+from typing import cast
 
 from flask import Blueprint
 from flask import Flask
 from flask import abort
 from flask import current_app
+from flask import request
 from flask import send_from_directory
 from flask import url_for
 from werkzeug.datastructures import FileStorage
-from werkzeug.utils import secure_filename
+from werkzeug.exceptions import HTTPException
 
+from . import executors
+from .backends import FileSystemBackend
+from .backends import StorageBackend
+from .caching import LRUCache
+from .conflicts import ConflictIndex
 from .exceptions import UploadNotAllowed
 from .extensions import DEFAULTS
+from .extensions import ExtensionPolicy
 from .extensions import extension
-from .extensions import lowercase_ext
+from .filenames import Filename
+from .filenames import normalize_filename
+from .processing import Job
+from .processing import ProcessingQueue
+from .processing import Processor
+from .processing import default_queue
+from .serving import FileInfo
+from .serving import send_upload
+from .sharding import Sharding
+from .signals import Measurement
+from .signals import count_conflict
+from .signals import measure
+from .signals import recording
+from .signals import upload_rejected
+from .signals import upload_saved
+from .signals import upload_served
+from .signatures import content_matches
+from .streaming import DEFAULT_BUFFER_SIZE
+from .streaming import MeteredStream
+from .streaming import copy_stream
+from .streaming import linkable_path
+from .streaming import private_folder
+from .streaming import remaining_size
+from .streaming import save_atomically
+from .streaming import save_content_addressed
+from .streaming import too_large
+from .variants import DEFAULT_CACHE_SIZE
+from .variants import Variant
+from .variants import VariantCache
+from .variants import parse_variants
+from .variants import pillow_available
+from .variants import send_variant
+
+# the sanitized filenames most recently sent by clients
+_filenames: LRUCache[Filename] = LRUCache(1024)
 
 
 def addslash(url: str) -> str:
@@ -39,6 +89,12 @@ def addslash(url: str) -> str:
     return url + '/'
 
 
+def storage_key(folder: str | None, basename: str) -> str:
+    if folder:
+        return posixpath.join(folder, basename)
+    return basename
+
+
 def config_for_set(
         uset: 'UploadSet',
         app: Flask,
@@ -66,7 +122,28 @@ def config_for_set(
         config.get(prefix + 'DENY', ()))  # Union[Tuple[()], Tuple[str, ...]]
     destination = config.get(prefix + 'DEST')
     base_url = config.get(prefix + 'URL')
+    reserve_names = bool(config.get(prefix + 'RESERVE_NAMES', False))
+    atomic_save = bool(config.get(prefix + 'ATOMIC_SAVE', False))
+    buffer_size = config.get(prefix + 'BUFFER_SIZE')
+    sniff = bool(config.get(prefix + 'SNIFF', False))
+    max_size = config.get(prefix + 'MAX_SIZE')
+    content_hash = config.get(prefix + 'CONTENT_HASH')
+    backend = config.get(prefix + 'BACKEND')
+    sharding = config.get(prefix + 'SHARDING')
+    sendfile = bool(config.get(prefix + 'SENDFILE', False))
+    accel_redirect = config.get(prefix + 'ACCEL_REDIRECT')
+    cache_max_age = config.get(prefix + 'CACHE_MAX_AGE')
+    stat_cache_ttl = config.get(prefix + 'STAT_CACHE_TTL')
+    stat_cache_size = config.get(prefix + 'STAT_CACHE_SIZE', 4096)
+    chunked = bool(config.get(prefix + 'CHUNKED', False))
+    variants = config.get(prefix + 'VARIANTS')
+    variants_dest = config.get(prefix + 'VARIANTS_DEST')
+    variants_max_size = config.get(
+        prefix + 'VARIANTS_MAX_SIZE', DEFAULT_CACHE_SIZE)
 
+    if destination is None and backend is not None:
+        # files are not stored on the local filesystem
+        destination = ''
     if destination is None:
         # the upload set's destination wasn't given
         if uset.default_dest:
@@ -80,12 +157,27 @@ def config_for_set(
             else:
                 raise RuntimeError("no destination for set %s" % uset.name)
 
+    if variants and variants_dest is None:
+        # anybody can create folders in the temporary directory
+        variants_dest = os.path.join(private_folder(os.path.join(
+            tempfile.gettempdir(), 'flask-uploads-variants')), uset.name)
+
     if base_url is None and using_defaults:
         if defaults['url'] is not None:
             base_url = addslash(defaults['url']) + uset.name + '/'
 
     return UploadConfiguration(
-        destination, base_url, allow_extensions, deny_extensions)
+        destination, base_url, allow_extensions, deny_extensions,
+        reserve_names=reserve_names, atomic_save=atomic_save,
+        buffer_size=buffer_size, sniff=sniff, max_size=max_size,
+        content_hash=content_hash, backend=backend, sharding=sharding,
+        sendfile=sendfile, accel_redirect=accel_redirect,
+        cache_max_age=cache_max_age, stat_cache_ttl=stat_cache_ttl,
+        stat_cache_size=stat_cache_size, chunked=chunked,
+        variants=variants, variants_dest=variants_dest,
+        variants_max_size=variants_max_size,
+        policy=ExtensionPolicy(
+            uset.extensions, allow_extensions, deny_extensions))
 
 
 def configure_uploads(
@@ -109,6 +201,7 @@ def configure_uploads(
 
     if not hasattr(app, 'upload_set_config'):
         app.upload_set_config = {}  # type: ignore
+        app.upload_sets = {}  # type: ignore
     set_config = app.upload_set_config  # type: ignore
     defaults = dict(
         dest=app.config.get('UPLOADS_DEFAULT_DEST'),
@@ -118,12 +211,21 @@ def configure_uploads(
     for uset in upload_sets:
         config = config_for_set(uset, app, defaults)
         set_config[uset.name] = config
+        app.upload_sets[uset.name] = uset  # type: ignore
 
     autoserve = app.config.get("UPLOADS_AUTOSERVE", False)
     if autoserve:
-        should_serve = any(s.base_url is None for s in set_config.values())
+        # variants are always created by the blueprint
+        should_serve = any(
+            s.base_url is None or s.variant_cache is not None
+            for s in set_config.values())
         if '_uploads' not in app.blueprints and should_serve:
-            app.register_blueprint(uploads_mod)
+            app.register_blueprint(uploads_blueprint())
+
+    chunked = any(s.chunked for s in set_config.values())
+    if '_uploads_chunked' not in app.blueprints and chunked:
+        from .chunked import chunked_blueprint
+        app.register_blueprint(chunked_blueprint())
 
 
 class UploadConfiguration:
@@ -139,18 +241,253 @@ class UploadConfiguration:
                   `UploadSet` extensions list.
     :param deny: A list of extensions to deny, even if they are in the
                  `UploadSet` extensions list.
+    :param reserve_names: If `True`, the final name of an upload is claimed
+                          with an exclusive create before the file is
+                          written, so concurrent saves of the same filename
+                          never overwrite each other.
+    :param atomic_save: If `True`, uploads are streamed into a temporary
+                        file next to the target, which is renamed into place
+                        once complete, so no half-written files are ever
+                        visible.
+    :param buffer_size: The size of the chunks uploads are copied in. If
+                        this is `None`, werkzeug's default is used for
+                        regular saves, and 64 KiB for atomic saves.
+    :param sniff: If `True`, the first bytes of every upload are checked
+                  against the magic numbers of the type its extension
+                  claims, see `UploadSet.content_allowed`.
+    :param max_size: The maximum size of an upload in bytes, or `None` for
+                     no limit. Larger uploads are rejected with
+                     `UploadNotAllowed` while they are being written, and
+                     the partial file is removed. This implies
+                     `atomic_save`.
+    :param content_hash: The name of a `hashlib` algorithm, e.g.
+                         ``sha256`` or ``blake2b``. If this is given, the
+                         upload set is content-addressed: every file is
+                         stored once under the digest of its content, and
+                         saving the same content again returns the same
+                         name without writing it.
+    :param backend: The `~flask_uploads.backends.StorageBackend` to store
+                    the files in. If this is `None`, they are written to
+                    `destination` on the local filesystem, which is the
+                    only storage supporting `reserve_names`.
+    :param sharding: A `~flask_uploads.sharding.Sharding`, or its
+                     specification like ``hash:2/2``. If this is given,
+                     files are stored in subfolders named after a hash of
+                     their basename, while the names returned by
+                     `UploadSet.save` stay the same. This cannot be combined
+                     with `content_hash`, which shards by itself.
+    :param sendfile: If `True`, autoserved files are not sent by Flask, but
+                     by the front server, which is told the path of the
+                     file in an ``X-Sendfile`` header. This only works
+                     without a `backend`.
+    :param accel_redirect: The prefix of an internal nginx location, e.g.
+                           ``/protected/photos/``. If this is given,
+                           autoserved files are sent by nginx, which is told
+                           the prefix followed by the name of the file in an
+                           ``X-Accel-Redirect`` header.
+    :param cache_max_age: The number of seconds browsers and proxies may
+                          cache autoserved files. Files of content-addressed
+                          upload sets never change, so they are marked as
+                          immutable, and cached for a year by default.
+    :param stat_cache_ttl: If given, the size, modification time and ETag of
+                           autoserved files are cached for this many
+                           seconds, so conditional and ``HEAD`` requests
+                           are answered without accessing the storage.
+                           Saving or deleting a file through the upload set
+                           updates the cache of the current process.
+    :param stat_cache_size: The maximum number of files in the stat cache.
+    :param chunked: If `True`, files can be uploaded to the set in chunks,
+                    with the resumable upload protocol of
+                    `flask_uploads.chunked`.
+    :param variants: The names of the resized variants of images which can
+                     be requested from the `_uploads` blueprint, like
+                     ``w320``, see `flask_uploads.variants.Variant.parse`.
+                     This requires Pillow.
+    :param variants_dest: The folder the variants are stored in, once they
+                          were created.
+    :param variants_max_size: The maximum size of all variants in
+                              `variants_dest` in bytes. Once it is exceeded,
+                              the least recently used ones are removed.
+    :param policy: The `ExtensionPolicy` compiled from the upload set's
+                   extensions and `allow` and `deny`. If this is `None`, it
+                   is compiled on first use.
     """
     def __init__(
             self,
             destination: str,
             base_url: str | None = None,
             allow: tuple[()] | tuple[str, ...] = (),
-            deny: tuple[()] | tuple[str, ...] = ()
+            deny: tuple[()] | tuple[str, ...] = (),
+            reserve_names: bool = False,
+            atomic_save: bool = False,
+            buffer_size: int | None = None,
+            sniff: bool = False,
+            max_size: int | None = None,
+            content_hash: str | None = None,
+            backend: StorageBackend | None = None,
+            sharding: Sharding | str | None = None,
+            sendfile: bool = False,
+            accel_redirect: str | None = None,
+            cache_max_age: int | None = None,
+            stat_cache_ttl: float | None = None,
+            stat_cache_size: int = 4096,
+            chunked: bool = False,
+            variants: Iterable[str | Variant] | None = None,
+            variants_dest: str | None = None,
+            variants_max_size: int = DEFAULT_CACHE_SIZE,
+            policy: ExtensionPolicy | None = None
     ) -> None:
         self.destination = destination
         self.base_url = base_url
         self.allow = allow
         self.deny = deny
+        self.reserve_names = reserve_names
+        self.atomic_save = atomic_save
+        if buffer_size is not None and buffer_size < 1:
+            raise ValueError("buffer_size must be a positive number")
+        self.buffer_size = buffer_size
+        self.sniff = sniff
+        if max_size is not None and max_size < 0:
+            raise ValueError("max_size must not be negative")
+        self.max_size = max_size
+        if content_hash is not None:
+            # fail early for algorithms which are not available
+            hashlib.new(content_hash)
+        self.content_hash = content_hash
+        self.backend = backend
+        if isinstance(sharding, str):
+            sharding = Sharding.parse(sharding)
+        if sharding is not None and content_hash is not None:
+            raise ValueError(
+                "Content-addressed upload sets cannot be sharded")
+        self.sharding = sharding
+        if sendfile and backend is not None:
+            raise ValueError("X-Sendfile needs files on the local filesystem")
+        if sendfile and accel_redirect is not None:
+            raise ValueError(
+                "X-Sendfile and X-Accel-Redirect cannot be used together")
+        self.sendfile = sendfile
+        self.accel_redirect = accel_redirect
+        if cache_max_age is not None and cache_max_age < 0:
+            raise ValueError("cache_max_age must not be negative")
+        self.cache_max_age = cache_max_age
+        self.stat_cache: LRUCache[FileInfo] | None = None
+        if stat_cache_ttl is not None:
+            self.stat_cache = LRUCache(stat_cache_size, stat_cache_ttl)
+        self.chunked = chunked
+        self.variant_cache: VariantCache | None = None
+        if variants:
+            if not pillow_available():
+                raise RuntimeError(
+                    "Image variants require Pillow, install it with "
+                    "Flask-Reuploaded[images]")
+            if variants_dest is None:
+                raise ValueError("Image variants need a variants_dest")
+            self.variant_cache = VariantCache(
+                variants_dest, parse_variants(variants), variants_max_size)
+        self.policy = policy
+        self._storage: StorageBackend | None = backend
+        self._real_destination: str | None = None
+        self._folders: LRUCache[bool] = LRUCache(1024)
+
+    @property
+    def real_destination(self) -> str:
+        """
+        This is the canonical path of `destination`, with all symbolic links
+        resolved. It is computed once and then cached, until `invalidate` is
+        called.
+        """
+        if self._real_destination is None:
+            self._real_destination = os.path.realpath(self.destination)
+        return self._real_destination
+
+    @property
+    def storage(self) -> StorageBackend:
+        """
+        This is the `backend` of the upload set, or a
+        `~flask_uploads.backends.FileSystemBackend` for `destination` if
+        there is none.
+        """
+        if self._storage is None:
+            self._storage = FileSystemBackend(self.destination)
+        return self._storage
+
+    @property
+    def plain_serving(self) -> bool:
+        """
+        This tells whether autoserved files are sent by
+        `flask.send_from_directory`, which is the case if none of the
+        serving options are configured, and the files are neither in a
+        `backend` nor content-addressed.
+        """
+        return (
+            self.backend is None and not self.content_hash and
+            not self.sendfile and self.accel_redirect is None and
+            self.cache_max_age is None and self.stat_cache is None)
+
+    def key(self, name: str) -> str:
+        """
+        This returns the key a file is stored under in `storage`, which is
+        `name` itself, unless the upload set is sharded.
+
+        :param name: A name as returned by `UploadSet.save`.
+        """
+        if self.sharding is None:
+            return name
+        return self.sharding.key(name)
+
+    def locate(self, folder: str, name: str) -> str:
+        """
+        This returns the path of the file `name` within `folder`, with the
+        subfolders of the sharding, if any.
+
+        :param folder: The absolute path of a folder of the upload set.
+        :param name: The name of the file, relative to `folder`.
+        """
+        return os.path.join(folder, self.key(name))
+
+    def forget(self, name: str) -> None:
+        """
+        This removes a file from the stat cache, if there is one, and its
+        image variants. It is called whenever a file is saved or deleted
+        through the upload set.
+
+        :param name: A name as returned by `UploadSet.save`.
+        """
+        if self.stat_cache is not None:
+            self.stat_cache.pop(self.key(name))
+        if self.variant_cache is not None:
+            self.variant_cache.discard(self.key(name))
+
+    def ensure_folder(self, folder: str) -> None:
+        """
+        This creates `folder` if it does not exist yet. Folders which are
+        known to exist are cached, so saving many files to the same folder
+        does not check for it over and over again.
+
+        :param folder: The absolute path of the folder.
+        """
+        if folder in self._folders:
+            return
+        if not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+        self._folders.set(folder, True)
+
+    def invalidate(self, folder: str | None = None) -> None:
+        """
+        This clears the cached state of this configuration. Call this when
+        folders of the upload set are removed, or `destination` is changed,
+        while the application is running.
+
+        :param folder: If given, only forget that this folder exists.
+        """
+        if folder is not None:
+            self._folders.pop(folder)
+            return
+        self._real_destination = None
+        self._folders.clear()
+        if self.stat_cache is not None:
+            self.stat_cache.clear()
 
     @property
     def tuple(self) -> tuple[
@@ -185,19 +522,43 @@ class UploadSet:
     :param default_dest: If given, this should be a callable. If you call it
                          with the app, it should return the default upload
                          destination path for that app.
+    :param conflict_index: If given, this should be a
+                           `~flask_uploads.conflicts.ConflictIndex`. It
+                           remembers the suffixes handed out by
+                           `resolve_conflict`, so repeated uploads of the
+                           same filename do not have to probe every
+                           previously used name.
+    :param executor: The `concurrent.futures.Executor` the async methods,
+                     e.g. `save_async`, run the blocking filesystem work on.
+                     By default, a small thread pool shared by all upload
+                     sets is used.
+    :param processing_queue: The `~flask_uploads.processing.ProcessingQueue`
+                             the `processors` run on. By default, a small
+                             bounded thread pool shared by all upload sets
+                             is used.
     """
     def __init__(
         self,
         name: str = 'files',
         extensions: Iterable[str] = DEFAULTS,
-        default_dest: Callable[[Flask], str] | None = None
+        default_dest: Callable[[Flask], str] | None = None,
+        conflict_index: ConflictIndex | None = None,
+        executor: Executor | None = None,
+        processing_queue: ProcessingQueue | None = None
     ) -> None:
         if not name.isalnum():
             raise ValueError("Name must be alphanumeric (no underscores)")
         self.name = name
         self.extensions = extensions
         self._config: UploadConfiguration | None = None
+        # the upload set `bind` was called on, which sends the signals
+        self._unbound: UploadSet | None = None
         self.default_dest = default_dest
+        self.conflict_index = conflict_index
+        self.executor = executor
+        self.processing_queue = processing_queue
+        self.processors: list[Processor] = []
+        self._jobs: LRUCache[list[Job]] = LRUCache(4096)
 
     @property
     def config(self) -> 'UploadConfiguration':
@@ -205,9 +566,8 @@ class UploadSet:
         This gets the current configuration. By default, it looks up the
         current application and gets the configuration from there. But if you
         don't want to go to the full effort of setting an application, or it's
-        otherwise outside of a request context, set the `_config` attribute to
-        an `UploadConfiguration` instance, then set it back to `None` when
-        you're done.
+        otherwise outside of a request context, use `bind` to get a copy of
+        the upload set with a fixed configuration.
         """
         if self._config is not None:
             return self._config
@@ -221,34 +581,83 @@ class UploadSet:
                 "The application is not properly configured. "
                 "Please make sure to use `configure_uploads`.")
 
-    def url(self, filename: str) -> str:
+    def bind(self, app: 'Flask | UploadConfiguration') -> 'UploadSet':
+        """
+        This returns a copy of this upload set which always uses the
+        configuration of `app`, so it can be used without an application
+        context, e.g. in background workers processing many files. The
+        configuration is looked up once, and the copy is safe to share
+        between threads. It shares the `processors`, jobs and
+        `conflict_index` with this upload set, which itself is not changed,
+        and sends the signals with this upload set as sender.
+
+        `url` still needs an application context for files served by the
+        `_uploads` blueprint. Bind again after calling `configure_uploads`
+        anew.
+
+        :param app: The application `configure_uploads` was called with, or
+                    the `UploadConfiguration` to use.
+        """
+        if isinstance(app, UploadConfiguration):
+            config = app
+        else:
+            try:
+                config = app.upload_set_config[self.name]  # type: ignore
+            except (AttributeError, KeyError):
+                raise RuntimeError(
+                    "The application is not properly configured. "
+                    "Please make sure to use `configure_uploads`.")
+        bound = copy.copy(self)
+        bound._config = config
+        bound._unbound = self._unbound or self
+        return bound
+
+    def url(self, filename: str, variant: str | None = None) -> str:
         """
         This function gets the URL a file uploaded to this set would be
         accessed at. It doesn't check whether said file exists.
 
         :param filename: The filename to return the URL for.
+        :param variant: The name of a resized variant of the image to return
+                        the URL for, as configured with
+                        `UPLOADED_X_VARIANTS`. Variants are always served by
+                        the `_uploads` blueprint.
         """
-        base = self.config.base_url
+        config = self.config
+        base = config.base_url
+        if variant is not None:
+            cache = config.variant_cache
+            if cache is None or variant not in cache.variants:
+                raise ValueError("Unknown variant %r" % variant)
+            return url_for('_uploads.uploaded_file', setname=self.name,
+                           filename=filename, variant=variant,
+                           _external=True)
         if base is None:
             return url_for('_uploads.uploaded_file', setname=self.name,
                            filename=filename, _external=True)
         else:
-            return base + filename
+            return base + config.key(filename)
 
     def path(self, filename: str, folder: str | None = None) -> str:
         """
         This returns the absolute path of a file uploaded to this set. It
-        doesn't actually check whether said file exists.
+        doesn't actually check whether said file exists. Files in a
+        storage `backend` have no path, so this raises a `RuntimeError` for
+        such upload sets.
 
         :param filename: The filename to return the path for.
         :param folder: The subfolder within the upload set previously used
                        to save to.
         """
+        config = self.config
+        if not isinstance(config.storage, FileSystemBackend):
+            raise RuntimeError(
+                "Files in a storage backend have no local path")
         if folder is not None:
-            target_folder = os.path.join(self.config.destination, folder)
+            target_folder = os.path.join(config.destination, folder)
         else:
-            target_folder = self.config.destination
-        return os.path.join(target_folder, filename)
+            target_folder = config.destination
+        return config.locate(target_folder, filename)
 
     def file_allowed(self, storage: FileStorage, basename: str) -> bool:
         """This tells whether a file is allowed.
@@ -265,6 +674,23 @@ class UploadSet:
         """
         return self.extension_allowed(extension(basename))
 
+    def content_allowed(self, storage: FileStorage, basename: str) -> bool:
+        """This tells whether the content of a file matches its basename.
+
+        It is called by `save` with the final basename, if the `sniff`
+        option is configured, and should return `False` to reject the
+        upload.
+
+        The default implementation peeks at the first bytes of the stream,
+        without consuming it, and compares them with the magic numbers in
+        `flask_uploads.signatures.SIGNATURES`. Extensions without a known
+        signature are always allowed.
+
+        :param storage: The `werkzeug.datastructures.FileStorage` to check.
+        :param basename: The basename it will be saved under.
+        """
+        return content_matches(storage.stream, extension(basename))
+
     def extension_allowed(self, ext: str) -> bool:
         """
         This determines whether a specific extension is allowed. It is called
@@ -273,14 +699,52 @@ class UploadSet:
 
         :param ext: The extension to check, without the dot.
         """
-        return ((ext in self.config.allow) or
-                (ext in self.extensions and ext not in self.config.deny))
+        config = self.config
+        policy = config.policy
+        if policy is None or policy.extensions is not self.extensions:
+            policy = config.policy = ExtensionPolicy(
+                self.extensions, config.allow, config.deny)
+        return ext in policy
 
     def get_basename(self, filename: str) -> str:
-        # `secure_filename` is already typed via typeshed
-        # cf https://github.com/python/typeshed/pull/4308
-        # but not yet available via `mypy` from PyPi
-        return lowercase_ext(secure_filename(filename))
+        # this is ``lowercase_ext(secure_filename(filename))``
+        return normalize_filename(filename, _filenames).basename
+
+    def validate_names(self, filenames: Iterable[str]) -> 'ValidatedNames':
+        """
+        This checks many filenames at once, e.g. the members of an archive
+        before importing it, without saving anything. Every filename is
+        sanitized like `save` does, and checked with `extension_allowed`.
+        Repeated filenames and extensions are only handled once, so large
+        batches with few distinct names are checked quickly.
+
+        :param filenames: The filenames to check.
+        """
+        names: list[str] = []
+        rejected: list[int] = []
+        duplicates: list[int] = []
+        basenames: dict[str, str] = {}
+        extensions: dict[str, bool] = {}
+        seen: set[str] = set()
+        for i, filename in enumerate(filenames):
+            basename = basenames.get(filename)
+            if basename is None:
+                # not cached like uploads, so large batches do not evict the
+                # names clients send over and over
+                basename = basenames[filename] = normalize_filename(
+                    filename).basename
+            names.append(basename)
+            ext = extension(basename)
+            allowed = extensions.get(ext)
+            if allowed is None:
+                allowed = extensions[ext] = self.extension_allowed(ext)
+            if not basename or not allowed:
+                rejected.append(i)
+            elif basename in seen:
+                duplicates.append(i)
+            else:
+                seen.add(basename)
+        return ValidatedNames(names, rejected, duplicates)
 
     def save(
         self,
@@ -305,22 +769,127 @@ class UploadSet:
                      are using `name`, you can include the folder in the
                      `name` instead of explicitly using `folder`, i.e.
                      ``uset.save(file, name="someguy/photo_123.")``
+                     This cannot be used with content-addressed sets.
+        """
+        measurement = measure(upload_saved, upload_rejected)
+        if measurement is None:
+            return self._save(storage, folder, name, None)
+        sender = self._unbound or self
+        with recording(measurement):
+            try:
+                saved = self._save(storage, folder, name, measurement)
+            except (ValueError, UploadNotAllowed) as e:
+                upload_rejected.send(
+                    sender, filename=storage.filename, error=e)
+                raise
+        duration = measurement.duration
+        config = self.config
+        upload_saved.send(
+            sender, name=saved,
+            size=config.storage.stat(config.key(saved)).size,
+            duration=duration, timings=measurement.timings,
+            conflicts=measurement.conflicts)
+        return saved
+
+    def _save(
+        self,
+        storage: FileStorage,
+        folder: str | None,
+        name: str | None,
+        measurement: Measurement | None
+    ) -> str:
+        folder, basename = self._validate(storage, folder, name)
+        config = self.config
+        self._check_processing(config)
+        if name is not None and config.content_hash:
+            raise ValueError(
+                "A name cannot be given for content-addressed upload sets")
+        if measurement is not None:
+            measurement.lap('validate')
+
+        backend = config.backend
+        if backend is not None:
+            if not config.content_hash and backend.exists(
+                config.key(storage_key(folder, basename))
+            ):
+                basename = self._free_name(
+                    folder or '', basename,
+                    lambda n: backend.exists(
+                        config.key(storage_key(folder, n))))
+            if measurement is not None:
+                measurement.lap('resolve')
+            basename = self._put(storage, folder, basename, config)
+            if measurement is not None:
+                measurement.lap('write')
+            return self._saved(storage_key(folder, basename), config)
+
+        if folder:
+            target_folder = os.path.join(config.destination, folder)
+        else:
+            target_folder = config.destination
+        config.ensure_folder(target_folder)
+        if measurement is not None:
+            measurement.lap('folder')
+        if config.content_hash:
+            self._check_containment(target_folder, config)
+        else:
+            if not config.reserve_names and os.path.exists(
+                config.locate(target_folder, basename)
+            ):
+                basename = self._next_name(target_folder, basename, config)
+
+            # Verify path containment to prevent directory traversal
+            self._check_containment(
+                config.locate(target_folder, basename), config)
+        if measurement is not None:
+            measurement.lap('resolve')
+
+        stream = storage.stream
+        position = stream.tell() if stream.seekable() else None
+        try:
+            basename = self._store(storage, target_folder, basename, config)
+        except FileNotFoundError:
+            # the folder may have been removed behind our back, e.g. by a
+            # cleanup job, so it is created again for a second attempt
+            config.invalidate(target_folder)
+            if config.sharding is not None:
+                config.invalidate(os.path.dirname(
+                    config.locate(target_folder, basename)))
+            if position is None:
+                # the data read so far cannot be read a second time
+                raise
+            stream.seek(position)
+            config.ensure_folder(target_folder)
+            basename = self._store(storage, target_folder, basename, config)
+        if measurement is not None:
+            measurement.lap('write')
+        return self._saved(storage_key(folder, basename), config)
+
+    def _saved(self, name: str, config: UploadConfiguration) -> str:
+        # the file is completely written, so it is safe to process it now
+        config.forget(name)
+        if self.processors:
+            self._process(name, config)
+        return name
+
+    def _validate(
+        self,
+        storage: FileStorage,
+        folder: str | None,
+        name: str | None
+    ) -> tuple[str | None, str]:
+        """
+        This runs all checks of `save` which do not touch the filesystem, and
+        returns the sanitized folder and the basename to save the file as.
         """
         if not isinstance(storage, FileStorage):
             raise TypeError("storage must be a werkzeug.FileStorage")
 
-        # Track if name ends with dot before any processing
-        name_ends_with_dot = name is not None and name.rstrip().endswith('.')
-
         if folder is None and name is not None and "/" in name:
             folder, name = os.path.split(name)
-            # Check again after split
-            name_ends_with_dot = name.rstrip().endswith('.')
-            # Sanitize folder and name extracted from name parameter
-            if folder:
-                folder = secure_filename(folder)
-            if name:
-                name = secure_filename(name)
+            if not normalize_filename(name, _filenames).name:
+                # nothing is left of the name, so the upload's name is used
+                name = ''
         if storage.filename is None:
             raise ValueError("Filename must not be empty!")
         basename = self.get_basename(storage.filename)
@@ -330,54 +899,355 @@ class UploadSet:
 
         if name:
             # Sanitize name parameter to prevent path traversal
-            name = secure_filename(name)
-            if not name:
+            requested = normalize_filename(name, _filenames)
+            if not requested.name:
                 raise ValueError("Invalid filename after sanitization")
 
-            if name_ends_with_dot and not name.endswith('.'):
-                # Restore the dot if it was removed by secure_filename
-                basename = name + '.' + extension(basename)
+            if requested.dotted:
+                # Restore the dot removed by secure_filename, and append the
+                # extension of the upload
+                ext = extension(basename).lower()
+                basename = requested.name + '.' + ext
             else:
-                basename = name
-
-            basename = lowercase_ext(basename)
+                ext = requested.ext
+                basename = requested.basename
 
             # Re-validate extension after name override
-            ext = extension(basename)
             if ext and not self.extension_allowed(ext):
                 raise UploadNotAllowed(
                     f"File extension '{ext}' is not allowed"
                 )
 
-        if folder:
-            # Additional sanitization of folder parameter
-            folder = secure_filename(folder)
-            target_folder = os.path.join(self.config.destination, folder)
-        else:
-            target_folder = self.config.destination
-        if not os.path.exists(target_folder):
-            os.makedirs(target_folder)
-        if os.path.exists(os.path.join(target_folder, basename)):
-            basename = self.resolve_conflict(target_folder, basename)
+        config = self.config
+        if config.max_size is not None:
+            # reject what is known to be too large before writing anything
+            size = remaining_size(storage.stream)
+            if size is None:
+                size = storage.content_length or 0
+            if size > config.max_size:
+                raise too_large(config.max_size)
+
+        if config.sniff and not self.content_allowed(storage, basename):
+            raise UploadNotAllowed(
+                "File content does not match its extension")
 
-        target = os.path.join(target_folder, basename)
+        if folder:
+            # Sanitize folder parameter to prevent path traversal
+            folder = normalize_filename(folder, _filenames).name
+        return folder, basename
 
-        # Verify path containment to prevent directory traversal
-        target_real = os.path.realpath(target)
-        dest_real = os.path.realpath(self.config.destination)
+    def _check_containment(
+        self, path: str, config: 'UploadConfiguration'
+    ) -> None:
+        path_real = os.path.realpath(path)
+        dest_real = config.real_destination
         if not (
-            target_real.startswith(dest_real + os.sep) or
-            target_real == dest_real
+            path_real.startswith(dest_real + os.sep) or
+            path_real == dest_real
         ):
             raise ValueError(
                 "Security: Path traversal attempt detected"
             )
 
-        storage.save(target)
+    def _store(
+        self,
+        storage: FileStorage,
+        target_folder: str,
+        basename: str,
+        config: 'UploadConfiguration'
+    ) -> str:
+        """
+        This writes `storage` to `basename` in `target_folder` and returns
+        the basename it was finally saved as, which only differs if names
+        are reserved and another request claimed the name in the meantime,
+        or if the upload set is content-addressed.
+        """
+        if config.content_hash:
+            return save_content_addressed(
+                storage, target_folder, extension(basename),
+                config.content_hash,
+                config.buffer_size or DEFAULT_BUFFER_SIZE, config.max_size)
+        if not config.reserve_names:
+            target = config.locate(target_folder, basename)
+            if config.sharding is not None:
+                config.ensure_folder(os.path.dirname(target))
+            self._write(storage, target, config)
+            return basename
+        basename = self._reserve(target_folder, basename, config)
+        target = config.locate(target_folder, basename)
+        try:
+            self._write(storage, target, config)
+        except BaseException:
+            os.remove(target)
+            raise
+        return basename
+
+    def _put(
+        self,
+        storage: FileStorage,
+        folder: str | None,
+        basename: str,
+        config: 'UploadConfiguration'
+    ) -> str:
+        """
+        This is `_store` for upload sets with a `backend`, where `folder` is
+        relative to the storage.
+        """
+        backend = config.storage
+        buffer_size = config.buffer_size or DEFAULT_BUFFER_SIZE
+        if not config.content_hash:
+            backend.save(
+                config.key(storage_key(folder, basename)),
+                io.BufferedReader(
+                    MeteredStream(storage.stream, config.max_size)),
+                buffer_size)
+            return basename
+        # the key is only known once the whole upload has been hashed
+        hasher = hashlib.new(config.content_hash)
+        with tempfile.SpooledTemporaryFile(buffer_size) as spool:
+            copy_stream(
+                storage.stream, spool, buffer_size, config.max_size,
+                hasher.update)
+            digest = hasher.hexdigest()
+            ext = extension(basename)
+            name = digest + '.' + ext if ext else digest
+            basename = posixpath.join(digest[:2], digest[2:4], name)
+            key = storage_key(folder, basename)
+            if not backend.exists(key):
+                spool.seek(0)
+                backend.save(key, spool, buffer_size)
+        return basename
+
+    def save_many(
+        self,
+        storages: Iterable[FileStorage],
+        folder: str | None = None
+    ) -> list['SaveResult']:
+        """This saves several `storages` into this upload set at once.
+
+        This is meant for form fields accepting multiple files, e.g.
+        ``uset.save_many(request.files.getlist('photos'))``.
+
+        All files are validated before anything is written. Name conflicts
+        are resolved in a single pass against one listing of the target
+        folder, also between files of the same batch, with the
+        `conflict_index` and an overridden `resolve_conflict` like in
+        `save`, and the files are then written concurrently on the upload
+        set's `executor`.
+
+        Instead of raising, a `SaveResult` is returned for every storage, in
+        the same order, which either holds the name the file was saved as,
+        or the error which prevented it from being saved.
+
+        :param storages: The uploaded files to save.
+        :param folder: The subfolder within the upload set to save to.
+        """
+        config = self.config
+        self._check_processing(config)
+        results = [SaveResult(storage) for storage in storages]
+        pending: list[tuple[SaveResult, str]] = []
+        for result in results:
+            try:
+                _, basename = self._validate(result.storage, None, None)
+            except (TypeError, ValueError, UploadNotAllowed) as e:
+                result.error = e
+            else:
+                pending.append((result, basename))
+        if not pending:
+            return results
+
         if folder:
-            return posixpath.join(folder, basename)
+            folder = normalize_filename(folder, _filenames).name
+        backend = config.backend
+        taken: set[str] = set()
+        store: Callable[..., str]
+        exists: Callable[[str], bool]
+        if backend is not None:
+            store = self._put
+            target_folder = folder or ''
+            exists = (lambda n: backend.exists(
+                config.key(storage_key(folder, n))))
+            if not config.content_hash and config.sharding is None:
+                taken.update(
+                    posixpath.basename(key)
+                    for key in backend.list(target_folder)
+                    if posixpath.dirname(key) == target_folder)
         else:
-            return basename
+            store = self._store
+            if folder:
+                target_folder = os.path.join(config.destination, folder)
+            else:
+                target_folder = config.destination
+            config.ensure_folder(target_folder)
+            self._check_containment(target_folder, config)
+            exists = (lambda n: os.path.exists(
+                config.locate(target_folder, n)))
+            if not config.content_hash and config.sharding is None:
+                # content-addressed files are named after their content
+                taken.update(os.listdir(target_folder))
+
+        def is_taken(name: str) -> bool:
+            # sharded files are spread over many folders, so rather than
+            # listing them all, only the candidate names are looked up
+            if name in taken:
+                return True
+            return config.sharding is not None and exists(name)
+
+        # like in `save`, an overridden `resolve_conflict` is used for
+        # unsharded folders, but it cannot know about the rest of the batch
+        custom = (
+            backend is None and config.sharding is None and
+            type(self).resolve_conflict is not UploadSet.resolve_conflict)
+        saving: list[tuple[SaveResult, Future[str]]] = []
+        for result, basename in pending:
+            if is_taken(basename):
+                if custom:
+                    basename = self.resolve_conflict(target_folder, basename)
+                if is_taken(basename):
+                    basename = self._free_name(
+                        target_folder, basename, is_taken)
+            if backend is None and not config.content_hash:
+                try:
+                    self._check_containment(
+                        config.locate(target_folder, basename), config)
+                except ValueError as e:
+                    result.error = e
+                    continue
+            taken.add(basename)
+            saving.append((result, executors.submit(
+                self.executor, store,
+                result.storage, target_folder, basename, config)))
+
+        for result, future in saving:
+            try:
+                basename = future.result()
+            except Exception as e:
+                result.error = e
+            else:
+                result.name = self._saved(
+                    storage_key(folder, basename), config)
+        return results
+
+    async def save_async(
+        self,
+        storage: FileStorage,
+        folder: str | None = None,
+        name: str | None = None
+    ) -> str:
+        """This is the asynchronous version of `save`.
+
+        All filesystem work, including copying the file, is done on the
+        upload set's `executor`, so the event loop is not blocked while
+        large files are written. It takes the same arguments, raises the
+        same errors and returns the same name as `save`.
+
+        :param storage: The uploaded file to save.
+        :param folder: The subfolder within the upload set to save to.
+        :param name: The name to save the file as.
+        """
+        return await executors.run(
+            self.executor, self.save, storage, folder, name)
+
+    async def path_async(
+        self, filename: str, folder: str | None = None
+    ) -> str:
+        """This is the asynchronous version of `path`.
+
+        :param filename: The filename to return the path for.
+        :param folder: The subfolder within the upload set previously used
+                       to save to.
+        """
+        return await executors.run(self.executor, self.path, filename, folder)
+
+    async def resolve_conflict_async(
+        self, target_folder: str, basename: str
+    ) -> str:
+        """This is the asynchronous version of `resolve_conflict`.
+
+        :param target_folder: The absolute path to the target.
+        :param basename: The file's original basename.
+        """
+        return await executors.run(
+            self.executor, self.resolve_conflict, target_folder, basename)
+
+    def _write(
+        self,
+        storage: FileStorage,
+        target: str,
+        config: 'UploadConfiguration'
+    ) -> None:
+        if (
+            config.atomic_save or config.max_size is not None or
+            # e.g. a completed chunked upload or a spooled request body,
+            # which is moved into place instead of copied
+            linkable_path(storage.stream) is not None
+        ):
+            save_atomically(
+                storage, target, config.buffer_size or DEFAULT_BUFFER_SIZE,
+                config.max_size)
+        elif config.buffer_size is not None:
+            storage.save(target, config.buffer_size)
+        else:
+            storage.save(target)
+
+    def reserve_name(self, target_folder: str, basename: str) -> str:
+        """
+        This atomically claims a name for a new file in the target folder
+        and returns it. It is used by `save` when the `reserve_names`
+        option is configured.
+
+        An empty file is created with an exclusive create, which fails if
+        the name is already taken, even by a concurrent request in another
+        worker process. In that case, `resolve_conflict` is asked for
+        another name, until a name could be claimed.
+
+        :param target_folder: The absolute path to the target.
+        :param basename: The file's original basename.
+        """
+        return self._reserve(target_folder, basename, None)
+
+    def _reserve(
+        self,
+        target_folder: str,
+        basename: str,
+        config: 'UploadConfiguration | None'
+    ) -> str:
+        flags = os.O_CREAT | os.O_EXCL | os.O_WRONLY
+        candidate = basename
+        while True:
+            if config is None:
+                target = os.path.join(target_folder, candidate)
+            else:
+                target = config.locate(target_folder, candidate)
+                if config.sharding is not None:
+                    config.ensure_folder(os.path.dirname(target))
+            try:
+                fd = os.open(target, flags, 0o666)
+            except FileExistsError:
+                if config is None:
+                    candidate = self.resolve_conflict(target_folder, basename)
+                else:
+                    candidate = self._next_name(
+                        target_folder, basename, config)
+            else:
+                os.close(fd)
+                return candidate
+
+    def _next_name(
+        self,
+        target_folder: str,
+        basename: str,
+        config: 'UploadConfiguration'
+    ) -> str:
+        """
+        This is `resolve_conflict`, which takes the sharding of the upload
+        set into account.
+        """
+        if config.sharding is None:
+            return self.resolve_conflict(target_folder, basename)
+        return self._free_name(
+            target_folder, basename,
+            lambda n: os.path.exists(config.locate(target_folder, n)))
 
     def resolve_conflict(self, target_folder: str, basename: str) -> str:
         """
@@ -389,24 +1259,241 @@ class UploadSet:
         suffix to the name consisting of an underscore and a number, and tries
         that until it finds one that doesn't exist.
 
+        If the upload set has a `conflict_index`, the search starts right
+        after the last suffix handed out for this basename, so usually only
+        a single name has to be tried.
+
         :param target_folder: The absolute path to the target.
         :param basename: The file's original basename.
         """
+        return self._free_name(
+            target_folder, basename,
+            lambda n: os.path.exists(os.path.join(target_folder, n)))
+
+    def _free_name(
+        self, scope: str, basename: str, exists: Callable[[str], bool]
+    ) -> str:
         name, ext = os.path.splitext(basename)
+        index = self.conflict_index
         count = 0
+        if index is not None:
+            reserved = index.reserve(scope, basename)
+            if reserved is not None:
+                count = reserved - 1
         while True:
             count = count + 1
             newname = '%s_%d%s' % (name, count, ext)
-            if not os.path.exists(os.path.join(target_folder, newname)):
+            count_conflict()
+            if not exists(newname):
+                if index is not None:
+                    index.record(scope, basename, count)
                 return newname
 
+    def processor(self, func: Processor) -> Processor:
+        """
+        This registers `func` to be called with the absolute path of every
+        file saved to this upload set. It runs on the `processing_queue`
+        after the file was completely written, so the response does not have
+        to wait for it. It can be used as a decorator.
+
+        :param func: The processor, e.g. a function creating a thumbnail.
+        """
+        self.processors.append(func)
+        return func
+
+    def process(self, filename: str) -> list[Job]:
+        """
+        This queues all `processors` for a file of this upload set, and
+        returns their jobs. It is called by `save` and `save_many`, but can
+        also be used to process a file again, e.g. after adding a processor.
+
+        :param filename: The name the file was saved as.
+        """
+        config = self.config
+        self._check_processing(config)
+        return self._process(filename, config)
+
+    def _check_processing(self, config: UploadConfiguration) -> None:
+        if self.processors and not isinstance(
+            config.storage, FileSystemBackend
+        ):
+            raise RuntimeError(
+                "Processors require the files to be stored on the local "
+                "filesystem")
+
+    def _process(self, name: str, config: UploadConfiguration) -> list[Job]:
+        storage = cast(FileSystemBackend, config.storage)
+        path = storage.path(config.key(name))
+        queue = self.processing_queue or default_queue()
+        jobs = [
+            Job(getattr(func, '__name__', repr(func)), name,
+                queue.submit(func, path))
+            for func in self.processors
+        ]
+        self._jobs.set(name, jobs)
+        return jobs
+
+    def jobs(self, filename: str) -> list[Job]:
+        """
+        This returns the jobs last queued for a file, to check on their
+        `~flask_uploads.processing.Job.status`. Only the jobs of the most
+        recently saved files are remembered.
+
+        :param filename: The name the file was saved as.
+        """
+        return self._jobs.get(filename) or []
+
+    def exists(self, filename: str) -> bool:
+        """
+        This tells whether a file is stored in this upload set.
+
+        :param filename: The name the file was saved as.
+        """
+        config = self.config
+        return config.storage.exists(config.key(filename))
+
+    def open(self, filename: str) -> IO[bytes]:
+        """
+        This opens a file of this upload set for reading. This works for
+        every storage backend, unlike opening `path`.
+
+        :param filename: The name the file was saved as.
+        """
+        config = self.config
+        return config.storage.open(config.key(filename))
+
+    def delete(self, filename: str) -> None:
+        """
+        This removes a file from this upload set. `FileNotFoundError` is
+        raised if there is no such file.
+
+        :param filename: The name the file was saved as.
+        """
+        config = self.config
+        try:
+            config.storage.delete(config.key(filename))
+        finally:
+            config.forget(filename)
+
+
+class SaveResult:
+    """
+    This is the outcome of saving a single file with `UploadSet.save_many`.
+    The constructor's arguments are also the attributes.
+
+    :param storage: The uploaded file.
+    :param name: The name the file was saved as, or `None` if it was not
+                 saved.
+    :param error: The exception which prevented the file from being saved,
+                  e.g. `UploadNotAllowed`, or `None`.
+    """
+    def __init__(
+        self,
+        storage: FileStorage,
+        name: str | None = None,
+        error: Exception | None = None
+    ) -> None:
+        self.storage = storage
+        self.name = name
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.name is not None
 
-uploads_mod = Blueprint('_uploads', __name__, url_prefix='/_uploads')
+    def __repr__(self) -> str:
+        return '<SaveResult %r name=%r error=%r>' % (
+            self.storage.filename, self.name, self.error)
+
+
+class ValidatedNames:
+    """
+    This is the outcome of checking filenames with
+    `UploadSet.validate_names`. The constructor's arguments are also the
+    attributes.
+
+    :param names: The sanitized basename of every filename, in the same
+                  order, which is empty if nothing was left of it.
+    :param rejected: The indexes of the filenames which are not allowed.
+    :param duplicates: The indexes of the allowed filenames whose basename
+                       occurred earlier in the batch, so `save` would give
+                       them another name.
+    """
+    def __init__(
+        self, names: list[str], rejected: list[int], duplicates: list[int]
+    ) -> None:
+        self.names = names
+        self.rejected = rejected
+        self.duplicates = duplicates
+
+    @property
+    def ok(self) -> bool:
+        return not self.rejected and not self.duplicates
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __repr__(self) -> str:
+        return '<ValidatedNames %d names, %d rejected, %d duplicates>' % (
+            len(self.names), len(self.rejected), len(self.duplicates))
 
 
-@uploads_mod.route('/<setname>/<path:filename>')
 def uploaded_file(setname: UploadSet, filename: str) -> Any:
+    measurement = measure(upload_served)
+    if measurement is None:
+        return _serve(setname, filename)
+    status = 500
+    try:
+        response = _serve(setname, filename)
+        status = response.status_code
+        return response
+    except HTTPException as e:
+        status = e.code or status
+        raise
+    finally:
+        upload_served.send(
+            current_app._get_current_object(),  # type: ignore
+            setname=setname, filename=filename,
+            variant=request.args.get('variant'), status=status,
+            duration=measurement.duration)
+
+
+def _serve(setname: UploadSet, filename: str) -> Any:
     config = current_app.upload_set_config.get(setname)  # type: ignore
     if config is None:
         abort(404)
-    return send_from_directory(config.destination, filename)
+    variant = request.args.get('variant')
+    if variant is not None:
+        return send_variant(config, filename, variant)
+    if config.plain_serving:
+        return send_from_directory(config.destination, config.key(filename))
+    return send_upload(config, filename)
+
+
+_uploads_mod: Blueprint | None = None
+_blueprint_lock = threading.Lock()
+
+
+def uploads_blueprint() -> Blueprint:
+    """
+    This returns the `_uploads` blueprint, which serves the files of upload
+    sets. It is only created once an application needs it, so importing
+    Flask-Reuploaded stays cheap.
+    """
+    global _uploads_mod
+    with _blueprint_lock:
+        if _uploads_mod is None:
+            blueprint = Blueprint(
+                '_uploads', __name__, url_prefix='/_uploads')
+            blueprint.add_url_rule(
+                '/<setname>/<path:filename>', view_func=uploaded_file)
+            _uploads_mod = blueprint
+        return _uploads_mod
+
+
+def __getattr__(name: str) -> Any:
+    # `uploads_mod` used to be created on import
+    if name == 'uploads_mod':
+        return uploads_blueprint()
+    raise AttributeError(
+        'module %r has no attribute %r' % (__name__, name))
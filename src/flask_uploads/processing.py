@@ -0,0 +1,183 @@
+"""Background processing of saved uploads.
+
+Processors are functions registered on an `UploadSet`, e.g. to create
+thumbnails, compute checksums or scan for viruses. Every time a file is
+saved, a `Job` is queued for each processor, which is called with the path
+of the file once `UploadSet.save` returned, so it always sees the complete
+file, and the request does not have to wait for it.
+
+Jobs run on a `ProcessingQueue`. By default, this is a `ThreadQueue` in the
+current process, shared by all upload sets. An `ExecutorQueue` runs them on
+any `concurrent.futures.Executor` instead, e.g. a process pool for CPU bound
+processors, which then have to be importable module level functions.
+"""
+import contextvars
+import queue
+import secrets
+import threading
+from collections.abc import Callable
+from concurrent.futures import Executor
+from concurrent.futures import Future
+from typing import Any
+
+Processor = Callable[[str], Any]
+
+
+class Job:
+    """
+    This is a processor queued for a saved file. The constructor's arguments
+    are also the attributes.
+
+    :param processor: The name of the processor.
+    :param name: The name the file was saved as.
+    :param future: The future of the call of the processor.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+    def __init__(
+        self, processor: str, name: str, future: 'Future[Any]'
+    ) -> None:
+        self.id = secrets.token_urlsafe(12)
+        self.processor = processor
+        self.name = name
+        self.future = future
+
+    @property
+    def status(self) -> str:
+        """
+        This is one of `PENDING`, `RUNNING`, `DONE`, `FAILED` and
+        `CANCELLED`.
+        """
+        future = self.future
+        if future.cancelled():
+            return self.CANCELLED
+        if future.done():
+            return self.FAILED if future.exception() else self.DONE
+        return self.RUNNING if future.running() else self.PENDING
+
+    def result(self, timeout: float | None = None) -> Any:
+        """
+        This waits for the processor and returns its result, or raises its
+        exception.
+
+        :param timeout: The maximum number of seconds to wait.
+        """
+        return self.future.result(timeout)
+
+    def __repr__(self) -> str:
+        return '<Job %s %r %s>' % (self.processor, self.name, self.status)
+
+
+class ProcessingQueue:
+    """This is the interface for queues running processors."""
+
+    def submit(self, processor: Processor, path: str) -> 'Future[Any]':
+        """
+        This queues a call of `processor` with `path`, and returns its
+        future.
+
+        :param processor: The processor to call.
+        :param path: The absolute path of the saved file.
+        """
+        raise NotImplementedError
+
+
+class ThreadQueue(ProcessingQueue):
+    """
+    This runs processors on worker threads of the current process. Calls are
+    queued in a bounded queue, so a burst of uploads cannot pile up an
+    unlimited number of jobs. Once it is full, `submit` blocks until a
+    worker is free again. Processors run in a copy of the context they were
+    queued from, so they can use the application context of the request.
+
+    :param workers: The number of worker threads.
+    :param maxsize: The maximum number of waiting calls.
+    """
+    def __init__(self, workers: int = 2, maxsize: int = 128) -> None:
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.workers = workers
+        self._queue: 'queue.Queue[tuple[Any, ...] | None]' = queue.Queue(
+            maxsize)
+        self._threads: list[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    def _start(self) -> None:
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._work, daemon=True,
+                    name='flask-uploads-processing-%d' % len(self._threads))
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            context, future, processor, path = item
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = context.run(processor, path)
+                except BaseException as e:
+                    future.set_exception(e)
+                    if not isinstance(e, Exception):
+                        # e.g. SystemExit, which ends this worker
+                        raise
+                else:
+                    future.set_result(result)
+
+    def submit(self, processor: Processor, path: str) -> 'Future[Any]':
+        self._start()
+        future: Future[Any] = Future()
+        self._queue.put(
+            (contextvars.copy_context(), future, processor, path))
+        return future
+
+    def shutdown(self) -> None:
+        """
+        This waits for all queued calls to finish, and stops the workers.
+        They are started again by the next `submit`.
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
+
+
+class ExecutorQueue(ProcessingQueue):
+    """
+    This runs processors on `executor`, e.g. a
+    `concurrent.futures.ProcessPoolExecutor`.
+
+    :param executor: The executor to submit the calls to.
+    """
+    def __init__(self, executor: Executor) -> None:
+        self.executor = executor
+
+    def submit(self, processor: Processor, path: str) -> 'Future[Any]':
+        return self.executor.submit(processor, path)
+
+
+_default_queue: ThreadQueue | None = None
+_lock = threading.Lock()
+
+
+def default_queue() -> ThreadQueue:
+    """
+    This returns the queue shared by all upload sets which were not given a
+    queue of their own.
+    """
+    global _default_queue
+    with _lock:
+        if _default_queue is None:
+            _default_queue = ThreadQueue()
+        return _default_queue
@@ -0,0 +1,210 @@
+"""Serving uploaded files from the `_uploads` blueprint.
+
+Files are streamed from the storage of their upload set, with strong ETags,
+``Last-Modified`` and support for conditional and range requests. Upload
+sets can also hand the transfer over to the front server, with
+``X-Accel-Redirect`` for nginx or ``X-Sendfile`` for Apache and lighttpd, so
+the Python worker only checks that the file exists.
+
+Upload sets with a stat cache keep the metadata of served files in memory,
+so conditional and ``HEAD`` requests for them are answered without touching
+the storage at all.
+"""
+import mimetypes
+import os
+import posixpath
+import zlib
+from datetime import datetime
+from datetime import timezone
+from typing import TYPE_CHECKING
+from typing import Any
+from urllib.parse import quote
+
+from flask import abort
+from flask import current_app
+from flask import request
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.http import is_resource_modified
+from werkzeug.wsgi import wrap_file
+
+from .backends import StoredFile
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .flask_uploads import UploadConfiguration
+
+#: The `max_age` of content-addressed files, if none is configured.
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def guess_mimetype(key: str) -> str:
+    return mimetypes.guess_type(key)[0] or 'application/octet-stream'
+
+
+class FileInfo:
+    """
+    This holds everything needed to answer a request for a file, except its
+    content. The constructor's arguments are also the attributes.
+
+    :param size: The size of the file in bytes.
+    :param last_modified: The time of the last modification.
+    :param etag: The strong ETag of the file.
+    :param mimetype: The mimetype to serve the file with.
+    """
+    def __init__(
+        self, size: int, last_modified: datetime, etag: str, mimetype: str
+    ) -> None:
+        self.size = size
+        self.last_modified = last_modified
+        self.etag = etag
+        self.mimetype = mimetype
+
+
+def file_etag(
+    config: 'UploadConfiguration', key: str, stored: StoredFile
+) -> str:
+    """
+    This returns a strong ETag for the file stored under `key`. Files of
+    content-addressed upload sets are tagged with their digest, which never
+    changes, all others with their modification time, size and key.
+
+    :param config: The configuration of the upload set.
+    :param key: The key the file is stored under.
+    :param stored: The metadata of the file.
+    """
+    if config.content_hash:
+        return posixpath.basename(key).partition('.')[0]
+    check = zlib.adler32(key.encode('utf-8')) & 0xffffffff
+    return '%s-%d-%d' % (stored.mtime, stored.size, check)
+
+
+def set_cache_control(config: 'UploadConfiguration', response: Any) -> None:
+    max_age = config.cache_max_age
+    immutable = bool(config.content_hash)
+    if max_age is None and immutable:
+        max_age = IMMUTABLE_MAX_AGE
+    if max_age is None:
+        response.cache_control.no_cache = True
+        return
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    if immutable:
+        response.cache_control.immutable = True
+
+
+def file_info(
+    config: 'UploadConfiguration',
+    key: str,
+    stored: StoredFile | None = None
+) -> FileInfo:
+    """
+    This returns the `FileInfo` of the file stored under `key`, from the
+    stat cache of the upload set, if it has one. `FileNotFoundError` or
+    `ValueError` is raised if there is no such file.
+
+    :param config: The configuration of the upload set.
+    :param key: The key the file is stored under.
+    :param stored: The current metadata of the file. If given, it replaces
+                   the cached information instead of being looked up.
+    """
+    cache = config.stat_cache
+    if stored is None:
+        if cache is not None:
+            info = cache.get(key)
+            if info is not None:
+                return info
+        stored = config.storage.stat(key)
+    info = FileInfo(
+        stored.size, datetime.fromtimestamp(stored.mtime, timezone.utc),
+        file_etag(config, key, stored), guess_mimetype(key))
+    if cache is not None:
+        cache.set(key, info)
+    return info
+
+
+def stream_stat(
+    config: 'UploadConfiguration', key: str, stream: Any
+) -> StoredFile:
+    """
+    This returns the metadata of the file `stream` was opened from, which
+    may have been replaced since it was cached.
+
+    :param config: The configuration of the upload set.
+    :param key: The key the file is stored under.
+    :param stream: The opened file.
+    """
+    try:
+        st = os.fstat(stream.fileno())
+    except (AttributeError, OSError):
+        # not a real file, as from a remote storage
+        return config.storage.stat(key)
+    return StoredFile(st.st_size, st.st_mtime)
+
+
+def send_upload(config: 'UploadConfiguration', filename: str) -> Any:
+    """
+    This serves the file `filename` of an upload set with the configuration
+    `config`, or aborts with 404 if there is no such file.
+
+    :param config: The configuration of the upload set.
+    :param filename: A name as returned by `UploadSet.save`.
+    """
+    key = config.key(filename)
+    cached = config.stat_cache is not None and key in config.stat_cache
+    try:
+        info = file_info(config, key)
+    except (FileNotFoundError, ValueError):
+        abort(404)
+
+    response = current_app.response_class(mimetype=info.mimetype)
+    response.content_length = info.size
+    response.last_modified = info.last_modified
+    response.set_etag(info.etag)
+    set_cache_control(config, response)
+
+    offload = config.accel_redirect is not None or config.sendfile
+    if config.accel_redirect is not None:
+        response.headers['X-Accel-Redirect'] = (
+            config.accel_redirect + quote(key))
+    elif config.sendfile:
+        response.headers['X-Sendfile'] = config.locate(
+            config.destination, filename)
+    elif request.method != 'HEAD' and (
+        # werkzeug answers range requests before checking If-None-Match
+        request.range is not None or is_resource_modified(
+            request.environ, etag=info.etag, last_modified=info.last_modified)
+    ):
+        # only open the file if its content is going to be sent
+        try:
+            stream = config.storage.open(key)
+        except FileNotFoundError:
+            # removed in the meantime
+            config.forget(filename)
+            abort(404)
+        if cached:
+            # the cached information may be out of date, and the headers
+            # have to describe the content which is sent
+            try:
+                info = file_info(
+                    config, key, stream_stat(config, key, stream))
+            except FileNotFoundError:
+                stream.close()
+                config.forget(filename)
+                abort(404)
+            response.content_length = info.size
+            response.last_modified = info.last_modified
+            response.set_etag(info.etag)
+        response.response = wrap_file(request.environ, stream)
+        response.direct_passthrough = True
+
+    try:
+        # range requests for offloaded files are handled by the front server
+        response.make_conditional(
+            request, accept_ranges=not offload, complete_length=info.size)
+    except RequestedRangeNotSatisfiable:
+        response.close()
+        raise
+    if response.status_code == 304:
+        # some front servers ignore the status and send the file anyway
+        response.headers.pop('X-Accel-Redirect', None)
+        response.headers.pop('X-Sendfile', None)
+    return response
@@ -0,0 +1,80 @@
+"""Fan-out directory layouts for large upload sets.
+
+Storing millions of files in a single folder makes every lookup in it slow
+on many filesystems. A sharded upload set places each file in subfolders
+named after a hash of its basename, e.g. ``photo.jpg`` is stored as
+``6b/1f/photo.jpg``. The names returned by `UploadSet.save` do not contain
+these subfolders, they are added whenever a name is resolved to a path, URL
+or storage key.
+"""
+import hashlib
+import posixpath
+from collections.abc import Sequence
+
+
+class Sharding:
+    """
+    This is a sharding strategy, which maps the name of a file to the
+    subfolders it is stored in.
+
+    :param widths: The number of hex digits of the hash used for the name of
+                   each subfolder level, e.g. ``(2, 2)`` for two levels with
+                   256 subfolders each.
+    """
+    def __init__(self, widths: Sequence[int]) -> None:
+        widths = tuple(widths)
+        if not widths or min(widths) < 1 or sum(widths) > 32:
+            raise ValueError(
+                "Sharding needs between 1 and 32 hex digits in total")
+        self.widths = widths
+
+    @classmethod
+    def parse(cls, spec: str) -> 'Sharding':
+        """
+        This creates a strategy from a specification like ``hash:2/2``, as
+        used by the `UPLOADED_X_SHARDING` setting.
+
+        :param spec: ``hash:`` followed by the widths of the levels,
+                     separated by slashes.
+        """
+        kind, _, widths = spec.partition(':')
+        try:
+            if kind != 'hash':
+                raise ValueError
+            return cls([int(width) for width in widths.split('/')])
+        except ValueError:
+            raise ValueError("Invalid sharding %r" % spec) from None
+
+    def shard(self, basename: str) -> list[str]:
+        """
+        This returns the names of the subfolders for `basename`.
+
+        :param basename: The basename of a file.
+        """
+        digest = hashlib.md5(
+            basename.encode('utf-8'), usedforsecurity=False).hexdigest()
+        parts = []
+        start = 0
+        for width in self.widths:
+            parts.append(digest[start:start + width])
+            start += width
+        return parts
+
+    def key(self, name: str) -> str:
+        """
+        This returns the path of the file `name` within the upload set, with
+        the subfolders inserted between its folder and its basename, e.g.
+        ``someguy/6b/1f/photo.jpg`` for ``someguy/photo.jpg``.
+
+        :param name: A name as returned by `UploadSet.save`.
+        """
+        folder, basename = posixpath.split(name)
+        return posixpath.join(folder, *self.shard(basename), basename)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Sharding):
+            return NotImplemented
+        return self.widths == other.widths
+
+    def __repr__(self) -> str:
+        return '<Sharding hash:%s>' % '/'.join(map(str, self.widths))
@@ -0,0 +1,116 @@
+"""Signals for monitoring uploads, e.g. to export metrics to Prometheus.
+
+`UploadSet.save` sends `upload_saved` with the time spent in each stage of
+saving a file, and `upload_rejected` for files it refused. The `_uploads`
+blueprint sends `upload_served` for every request. Like Flask's own signals,
+they are `blinker` signals, so receivers are connected with
+``upload_saved.connect(receiver)``, or ``connect(receiver, sender=photos)``
+for a single upload set.
+
+Nothing is measured while no receiver is connected, so the signals cost
+nothing unless they are used.
+"""
+import contextlib
+import time
+from collections.abc import Iterator
+from contextvars import ContextVar
+
+from blinker import NamedSignal
+from blinker import Namespace
+
+_signals = Namespace()
+
+#: This is sent by `UploadSet.save` once a file was saved, with the upload
+#: set as sender, and these arguments:
+#:
+#: - ``name``: the name the file was saved as
+#: - ``size``: the number of bytes stored
+#: - ``duration``: the seconds `save` took in total
+#: - ``timings``: the seconds spent in each stage by its name: ``validate``
+#:   for the checks of the file, ``folder`` for creating the target folder,
+#:   ``resolve`` for finding a free name, and ``write`` for storing the file
+#: - ``conflicts``: the number of alternative names tried, because the
+#:   name was taken already
+upload_saved = _signals.signal('upload-saved')
+
+#: This is sent by `UploadSet.save` if a file was not saved, because it is
+#: not allowed or its name is invalid, with the upload set as sender, and
+#: these arguments:
+#:
+#: - ``filename``: the name of the uploaded file
+#: - ``error``: the `UploadNotAllowed` or `ValueError` raised
+upload_rejected = _signals.signal('upload-rejected')
+
+#: This is sent by the `_uploads` blueprint for every request, with the
+#: application as sender, and these arguments:
+#:
+#: - ``setname``: the name of the upload set
+#: - ``filename``: the name of the requested file
+#: - ``variant``: the name of the requested image variant, or `None`
+#: - ``status``: the status code of the response
+#: - ``duration``: the seconds it took to prepare the response, excluding
+#:   sending the content of the file
+upload_served = _signals.signal('upload-served')
+
+_measurement: ContextVar['Measurement | None'] = ContextVar(
+    'flask_uploads_measurement', default=None)
+
+
+class Measurement:
+    """
+    This collects the timings of the stages of a single operation.
+    """
+    def __init__(self) -> None:
+        self.start = self._last = time.perf_counter()
+        self.timings: dict[str, float] = {}
+        self.conflicts = 0
+
+    def lap(self, stage: str) -> None:
+        """
+        This records the time since the previous stage ended as the time of
+        `stage`.
+
+        :param stage: The name of the stage which just ended.
+        """
+        now = time.perf_counter()
+        self.timings[stage] = self.timings.get(stage, 0.0) + now - self._last
+        self._last = now
+
+    @property
+    def duration(self) -> float:
+        """This is the time since the measurement started."""
+        return time.perf_counter() - self.start
+
+
+def measure(*signals: NamedSignal) -> Measurement | None:
+    """
+    This returns a new `Measurement` if any of `signals` has receivers, or
+    else `None`, so callers can skip measuring altogether.
+    """
+    for signal in signals:
+        if signal.receivers:
+            return Measurement()
+    return None
+
+
+@contextlib.contextmanager
+def recording(measurement: Measurement) -> Iterator[Measurement]:
+    """
+    This makes `measurement` the measurement of the current `save`, for
+    `count_conflict`.
+    """
+    token = _measurement.set(measurement)
+    try:
+        yield measurement
+    finally:
+        _measurement.reset(token)
+
+
+def count_conflict() -> None:
+    """
+    This counts a taken name for the measurement of the current `save`, if
+    there is one.
+    """
+    measurement = _measurement.get()
+    if measurement is not None:
+        measurement.conflicts += 1
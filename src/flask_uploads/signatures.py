@@ -0,0 +1,150 @@
+"""Content sniffing for uploaded files.
+
+This checks whether the first bytes of an upload match the magic numbers of
+the file type its extension claims. Only a small prefix of the stream is
+read, which is then rewound, so the check is cheap even for large files.
+
+Signatures are provided for the types in `IMAGES`, `DOCUMENTS`, `ARCHIVES`
+and `AUDIO`. Uploads with any other extension are not checked.
+"""
+from collections.abc import Callable
+from typing import IO
+
+#: The number of bytes read from the start of an upload.
+PEEK_SIZE = 2048
+
+Signature = Callable[[bytes], bool]
+
+_BOM_AND_WHITESPACE = b'\xef\xbb\xbf \t\r\n'
+
+
+def _starts(*magics: bytes) -> Signature:
+    return lambda head: head.startswith(magics)
+
+
+def _at(offset: int, magic: bytes) -> Signature:
+    return lambda head: head[offset:offset + len(magic)] == magic
+
+
+def _riff(kind: bytes) -> Signature:
+    return lambda head: head[:4] == b'RIFF' and head[8:12] == kind
+
+
+def _xml(*roots: bytes) -> Signature:
+    def matches(head: bytes) -> bool:
+        text = head.lstrip(_BOM_AND_WHITESPACE).lower()
+        return text.startswith(b'<') and any(root in text for root in roots)
+    return matches
+
+
+def _mpeg_audio(head: bytes) -> bool:
+    # an ID3 tag, or an MPEG audio frame sync
+    return head.startswith(b'ID3') or (
+        len(head) > 1 and head[0] == 0xff and head[1] & 0xe0 == 0xe0)
+
+
+def _adts(head: bytes) -> bool:
+    # an ADIF header, or an ADTS frame sync with layer 0
+    return head.startswith(b'ADIF') or (
+        len(head) > 1 and head[0] == 0xff and head[1] & 0xf6 == 0xf0)
+
+
+def _pdf(head: bytes) -> bool:
+    # readers accept garbage before the header within the first KiB
+    return b'%PDF-' in head[:1024]
+
+
+_JPEG = _starts(b'\xff\xd8\xff')
+_ZIP = _starts(b'PK\x03\x04', b'PK\x05\x06', b'PK\x07\x08')
+_OLE2 = _starts(b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1')
+_GZIP = _starts(b'\x1f\x8b')
+_XZ = _starts(b'\xfd7zXZ\x00')
+_OGG = _starts(b'OggS')
+
+#: The known signatures by extension. An upload matches if any of the
+#: signatures for its extension matches its first bytes.
+SIGNATURES: dict[str, tuple[Signature, ...]] = {
+    # IMAGES
+    'jpg': (_JPEG,),
+    'jpe': (_JPEG,),
+    'jpeg': (_JPEG,),
+    'png': (_starts(b'\x89PNG\r\n\x1a\n'),),
+    'gif': (_starts(b'GIF87a', b'GIF89a'),),
+    'svg': (_xml(b'<svg'),),
+    'bmp': (_starts(b'BM'),),
+    'webp': (_riff(b'WEBP'),),
+    # DOCUMENTS
+    'rtf': (_starts(b'{\\rtf'),),
+    'odf': (_ZIP,),
+    'ods': (_ZIP,),
+    'gnumeric': (_GZIP, _xml(b'gnumeric')),
+    'abw': (_xml(b'<abiword'),),
+    'doc': (_OLE2,),
+    'docx': (_ZIP,),
+    'xls': (_OLE2,),
+    'xlsx': (_ZIP,),
+    'pdf': (_pdf,),
+    # ARCHIVES
+    'gz': (_GZIP,),
+    'bz2': (_starts(b'BZh'),),
+    'zip': (_ZIP,),
+    'tar': (_at(257, b'ustar'),),
+    'tgz': (_GZIP,),
+    'txz': (_XZ,),
+    '7z': (_starts(b"7z\xbc\xaf'\x1c"),),
+    # AUDIO
+    'wav': (_riff(b'WAVE'),),
+    'mp3': (_mpeg_audio,),
+    'aac': (_adts,),
+    'ogg': (_OGG,),
+    'oga': (_OGG,),
+    'flac': (_starts(b'fLaC', b'ID3'),),
+}
+
+
+def peek(stream: IO[bytes], size: int = PEEK_SIZE) -> bytes | None:
+    """
+    This reads up to `size` bytes from the current position of `stream` and
+    moves back to that position. If the stream cannot be rewound, `None` is
+    returned and nothing is read.
+
+    :param stream: The stream to read from.
+    :param size: The maximum number of bytes to read.
+    """
+    try:
+        if not stream.seekable():
+            return None
+        position = stream.tell()
+    except (AttributeError, OSError, ValueError):
+        return None
+    chunks = []
+    remaining = size
+    try:
+        while remaining > 0:
+            chunk = stream.read(remaining)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            remaining -= len(chunk)
+    finally:
+        stream.seek(position)
+    return b''.join(chunks)
+
+
+def content_matches(stream: IO[bytes], ext: str) -> bool:
+    """
+    This tells whether the content of `stream` matches the extension `ext`.
+    Extensions without a known signature always match. Streams which cannot
+    be rewound never match a known signature, as they cannot be checked
+    without consuming them.
+
+    :param stream: The stream of the uploaded file.
+    :param ext: The extension to check against, without the dot.
+    """
+    signatures = SIGNATURES.get(ext)
+    if signatures is None:
+        return True
+    head = peek(stream)
+    if head is None:
+        return False
+    return any(signature(head) for signature in signatures)
@@ -0,0 +1,486 @@
+"""The streaming save pipeline used by `UploadSet.save`.
+
+Instead of writing directly to the final path, the upload is copied into a
+temporary file in the target folder, which is then renamed into place with
+`os.replace`. Readers therefore either see the complete file or no file at
+all. When the upload is backed by a real file, the copy is done by the
+kernel (``copy_file_range`` or ``sendfile``) without passing the data
+through Python. When it is backed by a temporary file on the same
+filesystem, like the ones werkzeug spools large uploads to, it is not copied
+at all, but hard-linked into place.
+
+For content-addressed upload sets, the upload is hashed while it is
+streamed, and stored under a path derived from its digest.
+"""
+import errno
+import functools
+import hashlib
+import io
+import os
+import posixpath
+import secrets
+import stat
+import tempfile
+from collections.abc import Callable
+from typing import IO
+from typing import Any
+
+from werkzeug.datastructures import FileStorage
+
+from .exceptions import UploadNotAllowed
+
+# the same default as `shutil` uses for copying files
+DEFAULT_BUFFER_SIZE = 64 * 1024
+
+# errors which mean that a kernel side copy is not possible for this pair
+# of files, but a copy through user space is
+_FALLBACK_ERRNOS = frozenset((
+    errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP,
+    errno.EBADF, errno.ENOTSUP, errno.ESPIPE,
+))
+
+# where anonymous files can be linked from, on Linux
+_PROC_FDS = '/proc/self/fd'
+
+
+def real_file(stream: IO[bytes]) -> IO[bytes] | None:
+    """
+    This returns the file object which backs `stream` if it is a regular
+    file on disk, unwrapping a rolled over `tempfile.SpooledTemporaryFile`.
+    Otherwise, e.g. for in-memory streams, `None` is returned.
+
+    :param stream: The stream of an uploaded file.
+    """
+    candidate = getattr(stream, '_file', stream)
+    try:
+        fd = candidate.fileno()
+        return candidate if stat.S_ISREG(os.fstat(fd).st_mode) else None
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def too_large(max_size: int) -> UploadNotAllowed:
+    return UploadNotAllowed(
+        "File exceeds the maximum size of %d bytes" % max_size)
+
+
+def remaining_size(stream: IO[bytes]) -> int | None:
+    """
+    This returns the number of bytes left in `stream` if it is backed by a
+    real file, which can be told without reading it, else `None`.
+
+    :param stream: The stream of an uploaded file.
+    """
+    backing = real_file(stream)
+    if backing is None:
+        return None
+    return max(os.fstat(backing.fileno()).st_size - backing.tell(), 0)
+
+
+def _kernel_copy(
+    source: IO[bytes], dst: IO[bytes], chunk: int, max_size: int | None
+) -> int:
+    """Copy as much as possible without going through user space."""
+    src_fd, dst_fd = source.fileno(), dst.fileno()
+    offset = source.tell()
+    copied = 0
+    for name in ('copy_file_range', 'sendfile'):
+        func = getattr(os, name, None)
+        if func is None:
+            continue  # pragma: no cover
+        try:
+            while True:
+                count = chunk
+                if max_size is not None:
+                    # one byte more than allowed tells that it is too large
+                    count = min(chunk, max_size + 1 - copied)
+                if name == 'copy_file_range':
+                    n = func(src_fd, dst_fd, count, offset + copied)
+                else:
+                    n = func(dst_fd, src_fd, offset + copied, count)
+                if not n:
+                    source.seek(offset + copied)
+                    return copied
+                copied += n
+                if max_size is not None and copied > max_size:
+                    raise too_large(max_size)
+        except OSError as e:
+            if e.errno not in _FALLBACK_ERRNOS:
+                raise
+    # let the user space copy continue where the kernel gave up
+    source.seek(offset + copied)
+    return copied
+
+
+def copy_stream(
+    source: IO[bytes],
+    dst: IO[bytes] | None,
+    buffer_size: int = DEFAULT_BUFFER_SIZE,
+    max_size: int | None = None,
+    update: Callable[[bytes], object] | None = None
+) -> int:
+    """
+    This copies the remaining content of `source` into the binary file
+    `dst` and returns the number of bytes copied.
+
+    :param source: The stream to read from.
+    :param dst: The file to write to, or `None` to only read `source`.
+    :param buffer_size: The size of the chunks to copy through user space.
+    :param max_size: If given, `UploadNotAllowed` is raised as soon as more
+                     than this many bytes were read, and the copy stops.
+    :param update: If given, this is called with every chunk, e.g. the
+                   `update` method of a hash. The data is then always
+                   copied through user space.
+    """
+    copied = 0
+    backing = real_file(source)
+    if backing is not None and dst is not None and update is None:
+        dst.flush()
+        copied = _kernel_copy(
+            backing, dst, max(buffer_size, 1 << 20), max_size)
+        source = backing
+    while True:
+        chunk = source.read(buffer_size)
+        if not chunk:
+            return copied
+        copied += len(chunk)
+        if max_size is not None and copied > max_size:
+            raise too_large(max_size)
+        if update is not None:
+            update(chunk)
+        if dst is not None:
+            dst.write(chunk)
+
+
+@functools.lru_cache(maxsize=None)
+def current_umask() -> int:
+    """This returns the umask of the process, which is read only once."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('Umask:'):
+                    return int(line.split()[1], 8)
+    except (OSError, ValueError):  # pragma: no cover
+        pass
+    mask = os.umask(0o022)  # pragma: no cover
+    os.umask(mask)  # pragma: no cover
+    return mask  # pragma: no cover
+
+
+def private_folder(folder: str) -> str:
+    """
+    This creates `folder`, only accessible by the current user, if it does
+    not exist yet, and returns it. An existing folder is only accepted if it
+    belongs to the current user and no other user has access to it, as e.g.
+    a folder in the shared temporary directory may have been created by
+    anybody. Otherwise, `PermissionError` is raised.
+
+    :param folder: The path of the folder.
+    """
+    try:
+        os.makedirs(folder, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(folder)
+    if not stat.S_ISDIR(st.st_mode) or (
+        # Windows has neither owners nor modes like these
+        hasattr(os, 'getuid') and (
+            st.st_uid != os.getuid() or st.st_mode & 0o077)
+    ):
+        raise PermissionError(
+            errno.EACCES, "Folder is not private to the current user", folder)
+    return folder
+
+
+def _temporary_name(folder: str, name: str) -> str:
+    return os.path.join(folder, '.%s.%s.part' % (name, secrets.token_hex(6)))
+
+
+class LinkableFile(io.BufferedReader):
+    """
+    This is a file opened for reading, which is removed once it was saved,
+    e.g. the staged file of a chunked upload, so it may be hard-linked into
+    place instead of copied.
+
+    :param path: The path of the file.
+    """
+    def __init__(self, path: str) -> None:
+        super().__init__(io.FileIO(path, 'rb'))
+
+
+def anonymous_file(folder: str | None = None) -> IO[bytes]:
+    """
+    This creates a temporary file without a name in `folder`, opened for
+    reading and writing, which `UploadSet.save` can hard-link into place. Use
+    it to spool uploads to, see `UPLOADED_[SETNAME]_ATOMIC_SAVE`.
+
+    Files created by `tempfile.TemporaryFile` have no name either, but are
+    opened with ``O_EXCL``, which keeps them from ever being linked. This
+    needs ``O_TMPFILE``, i.e. Linux and a filesystem supporting it, and
+    otherwise falls back to `tempfile.TemporaryFile`, whose content is copied.
+
+    :param folder: The folder to create the file in, which should be on the
+                   same filesystem as the upload sets. It defaults to the
+                   system's temporary directory.
+    """
+    if folder is None:
+        folder = tempfile.gettempdir()
+    tmpfile = getattr(os, 'O_TMPFILE', None)
+    if tmpfile is not None:
+        try:
+            fd = os.open(folder, tmpfile | os.O_RDWR, 0o600)
+        except OSError:
+            pass  # e.g. EOPNOTSUPP on filesystems without O_TMPFILE
+        else:
+            return io.open(fd, 'rb+')
+    return tempfile.TemporaryFile('rb+', dir=folder)
+
+
+def _anonymous_path(stream: IO[bytes]) -> str | None:
+    """
+    This returns a path to link the anonymous temporary file backing
+    `stream` from, e.g. one created by `anonymous_file`, possibly rolled over
+    from a `tempfile.SpooledTemporaryFile`. Such a file has no name, so
+    nobody else can open it, and it is linked through ``/proc/self/fd``.
+    Elsewhere, `None` is returned.
+    """
+    backing = real_file(stream)
+    if backing is None or not isinstance(getattr(backing, 'name', None), int):
+        return None
+    fd = backing.fileno()
+    if os.fstat(fd).st_nlink != 0 or not os.path.isdir(_PROC_FDS):
+        return None
+    return os.path.join(_PROC_FDS, str(fd))
+
+
+def linkable_path(stream: IO[bytes]) -> str | None:
+    """
+    This returns the path of the file backing `stream`, if its content may
+    be hard-linked instead of copied. This is only the case for temporary
+    files which have not been read from yet, as these are deleted
+    afterwards anyway, so linking them is the same as moving them: files
+    created by `tempfile.NamedTemporaryFile`, `LinkableFile` and anonymous
+    temporary files, like the ones werkzeug spools large uploads to.
+
+    Once it was linked, the temporary file shares its content with the
+    saved file, so a `tempfile.NamedTemporaryFile` must not be written to
+    any more after it was saved.
+
+    :param stream: The stream of an uploaded file.
+    """
+    wrapper = getattr(tempfile, '_TemporaryFileWrapper', None)
+    if isinstance(stream, LinkableFile) or (
+        wrapper is not None and isinstance(stream, wrapper)
+    ):
+        path = stream.name
+        if not isinstance(path, str):
+            return None  # pragma: no cover
+    else:
+        anonymous = _anonymous_path(stream)
+        if anonymous is None:
+            return None
+        path = anonymous
+    try:
+        if stream.tell() != 0:
+            return None
+        stream.flush()
+    except (OSError, ValueError):
+        return None
+    return path
+
+
+def _link(path: str, temp: str) -> None:
+    if os.path.dirname(path) != _PROC_FDS:
+        os.link(path, temp)
+        return
+    # os.link only follows the link to the file with a directory descriptor
+    fds = os.open(_PROC_FDS, os.O_RDONLY)
+    try:
+        os.link(
+            os.path.basename(path), temp, src_dir_fd=fds,
+            follow_symlinks=True)
+    finally:
+        os.close(fds)
+
+
+def link_temporary(stream: IO[bytes], folder: str, name: str) -> str | None:
+    """
+    This hard-links the temporary file backing `stream` to a new temporary
+    name next to `name` in `folder` and returns that path. If the
+    stream cannot be linked, e.g. because it is in memory or on another
+    filesystem, `None` is returned and the caller has to copy it.
+
+    :param stream: The stream of an uploaded file.
+    :param folder: The folder to create the link in.
+    :param name: The basename of the file it will become.
+    """
+    path = linkable_path(stream)
+    if path is None:
+        return None
+    while True:
+        temp = _temporary_name(folder, name)
+        try:
+            _link(path, temp)
+        except FileExistsError:  # pragma: no cover
+            continue
+        except OSError:
+            # e.g. EXDEV for another filesystem, or EPERM
+            return None
+        break
+    # make sure the path was not swapped out underneath the stream
+    if not os.path.samestat(os.stat(temp), os.fstat(stream.fileno())):
+        os.remove(temp)  # pragma: no cover
+        return None  # pragma: no cover
+    # temporary files are only readable by their owner
+    os.chmod(temp, 0o666 & ~current_umask())
+    return temp
+
+
+def open_temporary(folder: str, name: str) -> tuple[str, IO[bytes]]:
+    """
+    This creates a new, hidden temporary file next to `name` in `folder` and
+    returns its path and the opened file. The file is created with the same
+    permissions as a regular upload.
+
+    :param folder: The folder to create the file in.
+    :param name: The basename of the file it will become.
+    """
+    flags = os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, 'O_BINARY', 0)
+    while True:
+        temp = _temporary_name(folder, name)
+        try:
+            fd = os.open(temp, flags, 0o666)
+        except FileExistsError:  # pragma: no cover
+            continue
+        return temp, io.open(fd, 'wb')
+
+
+def save_atomically(
+    storage: FileStorage,
+    target: str,
+    buffer_size: int = DEFAULT_BUFFER_SIZE,
+    max_size: int | None = None
+) -> int:
+    """
+    This streams `storage` into a temporary file in the target folder and
+    renames it to `target` once it is complete. The number of bytes written
+    is returned. If anything goes wrong, the temporary file is removed and
+    `target` is left untouched.
+
+    If `storage` is backed by a temporary file on the same filesystem, see
+    `linkable_path`, it is hard-linked instead of copied.
+
+    :param storage: The uploaded file to save.
+    :param target: The final path of the file.
+    :param buffer_size: The size of the chunks to copy through user space.
+    :param max_size: If given, larger uploads are rejected with
+                     `UploadNotAllowed` as soon as the limit is exceeded.
+    """
+    folder, name = os.path.split(target)
+    stream = storage.stream
+    linked = link_temporary(stream, folder, name)
+    if linked is not None:
+        temp = linked
+    else:
+        temp, dst = open_temporary(folder, name)
+    try:
+        if linked is not None:
+            size = os.stat(temp).st_size
+            if max_size is not None and size > max_size:
+                raise too_large(max_size)
+            stream.seek(0, os.SEEK_END)
+        else:
+            with dst:
+                size = copy_stream(stream, dst, buffer_size, max_size)
+        os.replace(temp, target)
+    except BaseException:
+        try:
+            os.remove(temp)
+        except OSError:  # pragma: no cover
+            pass
+        raise
+    return size
+
+
+def save_content_addressed(
+    storage: FileStorage,
+    folder: str,
+    ext: str,
+    algorithm: str = 'sha256',
+    buffer_size: int = DEFAULT_BUFFER_SIZE,
+    max_size: int | None = None
+) -> str:
+    """
+    This stores `storage` in `folder` under the hex digest of its content,
+    sharded into two levels of subfolders, e.g. ``ab/cd/abcd....png``, and
+    returns that relative path. The digest is computed while the upload is
+    streamed into a temporary file, so it is read only once. If a file with
+    the same content is stored already, the temporary file is discarded and
+    the existing path is returned.
+
+    :param storage: The uploaded file to save.
+    :param folder: The folder to store the file in.
+    :param ext: The extension to give the file, without the dot.
+    :param algorithm: The name of a `hashlib` algorithm.
+    :param buffer_size: The size of the chunks to read the upload in.
+    :param max_size: If given, larger uploads are rejected with
+                     `UploadNotAllowed` as soon as the limit is exceeded.
+    """
+    hasher = hashlib.new(algorithm)
+    stream = storage.stream
+    # a named temporary file only has to be read, not copied
+    linked = link_temporary(stream, folder, 'blob')
+    if linked is not None:
+        temp = linked
+    else:
+        temp, dst = open_temporary(folder, 'blob')
+    try:
+        if linked is not None:
+            copy_stream(stream, None, buffer_size, max_size, hasher.update)
+        else:
+            with dst:
+                copy_stream(stream, dst, buffer_size, max_size, hasher.update)
+        digest = hasher.hexdigest()
+        name = digest + '.' + ext if ext else digest
+        relative = posixpath.join(digest[:2], digest[2:4], name)
+        final = os.path.join(folder, digest[:2], digest[2:4], name)
+        if os.path.exists(final):
+            os.remove(temp)
+        else:
+            os.makedirs(os.path.dirname(final), exist_ok=True)
+            os.replace(temp, final)
+    except BaseException:
+        try:
+            os.remove(temp)
+        except OSError:  # pragma: no cover
+            pass
+        raise
+    return relative
+
+
+class MeteredStream(io.RawIOBase):
+    """
+    This is a read-only stream, which passes the content of `stream` through
+    and counts the bytes read. It is used to enforce a maximum size on
+    storages which only take a stream, like most object storages.
+
+    :param stream: The stream to read from.
+    :param max_size: If given, `UploadNotAllowed` is raised as soon as more
+                     than this many bytes were read.
+    """
+    def __init__(self, stream: IO[bytes], max_size: int | None = None) -> None:
+        self.stream = stream
+        self.max_size = max_size
+        self.count = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        data = self.stream.read(len(buffer))
+        size = len(data)
+        self.count += size
+        if self.max_size is not None and self.count > self.max_size:
+            raise too_large(self.max_size)
+        buffer[:size] = data
+        return size
@@ -0,0 +1,313 @@
+"""Resized variants of uploaded images, created on demand.
+
+Instead of creating every size of an image when it is uploaded, upload sets
+can whitelist variants like ``w320``, which are requested with
+``uset.url(filename, variant='w320')``. The `_uploads` blueprint creates a
+variant when it is requested for the first time, and stores it in a cache
+folder, from which it is served directly afterwards. Concurrent requests for
+the same missing variant wait for the first one to create it, instead of
+all resizing the same image.
+
+Variants are created with `Pillow <https://python-pillow.org>`_, which is
+installed with the ``images`` extra of Flask-Reuploaded.
+"""
+import contextlib
+import importlib.util
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+from collections.abc import Iterable
+from collections.abc import Iterator
+from typing import IO
+from typing import TYPE_CHECKING
+from typing import Any
+
+from flask import abort
+from flask import send_file
+from werkzeug.security import safe_join
+
+from .backends import normalize_key
+from .serving import guess_mimetype
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .flask_uploads import UploadConfiguration
+
+#: The default size limit of the cache folder of an upload set.
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024
+
+_SPEC = re.compile(r'^(?:w(\d+)|h(\d+)|(\d+)x(\d+))$')
+# the EXIF orientations which swap width and height
+_TRANSPOSED = {5, 6, 7, 8}
+
+
+def pillow_available() -> bool:
+    return importlib.util.find_spec('PIL') is not None
+
+
+class Variant:
+    """
+    This is a size images are scaled down to, keeping their aspect ratio.
+    Images are never scaled up.
+
+    :param name: The name of the variant, as used in URLs.
+    :param width: The maximum width, or `None` for any width.
+    :param height: The maximum height, or `None` for any height.
+    """
+    def __init__(
+        self, name: str, width: int | None = None, height: int | None = None
+    ) -> None:
+        if width is None and height is None:
+            raise ValueError("A variant needs a width or a height")
+        if any(n is not None and n < 1 for n in (width, height)):
+            raise ValueError("The size of a variant must be positive")
+        self.name = name
+        self.width = width
+        self.height = height
+
+    @classmethod
+    def parse(cls, spec: str) -> 'Variant':
+        """
+        This creates a variant named after its specification, as used by
+        the `UPLOADED_X_VARIANTS` setting: ``w320`` for a maximum width,
+        ``h240`` for a maximum height, or ``320x240`` for both.
+
+        :param spec: The specification of the variant.
+        """
+        match = _SPEC.match(spec)
+        if match is None:
+            raise ValueError("Invalid variant %r" % spec)
+        width, height, box_width, box_height = match.groups()
+        width = width or box_width
+        height = height or box_height
+        return cls(
+            spec,
+            None if width is None else int(width),
+            None if height is None else int(height))
+
+    def box(self, transposed: bool = False) -> tuple[int, int]:
+        """
+        This returns the maximum width and height of the stored image.
+
+        :param transposed: Whether the image is displayed rotated by 90
+                           degrees, according to its EXIF orientation.
+        """
+        huge = 1 << 30
+        box = (self.width or huge, self.height or huge)
+        return (box[1], box[0]) if transposed else box
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Variant):
+            return NotImplemented
+        return (self.name, self.width, self.height) == (
+            other.name, other.width, other.height)
+
+    def __repr__(self) -> str:
+        return '<Variant %s %sx%s>' % (self.name, self.width, self.height)
+
+
+def parse_variants(
+    variants: Iterable['str | Variant']
+) -> dict[str, Variant]:
+    """
+    This returns the variants by name.
+
+    :param variants: Variants, or their specifications.
+    """
+    result = {}
+    for variant in variants:
+        if isinstance(variant, str):
+            variant = Variant.parse(variant)
+        result[variant.name] = variant
+    return result
+
+
+def render(source: IO[bytes], path: str, variant: Variant) -> None:
+    """
+    This writes `variant` of the image read from `source` to `path`, in
+    the same format. `ValueError` is raised for files which are not images
+    Pillow can read.
+
+    :param source: The original image.
+    :param path: The path to write the variant to.
+    :param variant: The size to scale the image down to.
+    """
+    from PIL import Image
+    from PIL import ImageOps
+    from PIL import UnidentifiedImageError
+
+    try:
+        with Image.open(source) as original:
+            fmt = original.format
+            orientation = original.getexif().get(0x0112)
+            # this decodes JPEGs at a reduced scale already
+            original.thumbnail(variant.box(orientation in _TRANSPOSED))
+            image = ImageOps.exif_transpose(original)
+            folder = os.path.dirname(path)
+            os.makedirs(folder, exist_ok=True)
+            fd, temp = tempfile.mkstemp(dir=folder, prefix='.')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    image.save(f, format=fmt)
+                os.replace(temp, path)
+            except BaseException:
+                os.unlink(temp)
+                raise
+    except (UnidentifiedImageError, Image.DecompressionBombError) as e:
+        raise ValueError("Cannot create variant: %s" % e) from e
+
+
+class VariantCache:
+    """
+    This is the folder the variants of an upload set are stored in. Once
+    they take up more than `max_size` bytes, the least recently used ones
+    are removed. Each process tracks the variants it created or served, so
+    with several processes, the folder may grow somewhat larger.
+
+    :param folder: The folder to store the variants in.
+    :param variants: The allowed variants by name.
+    :param max_size: The maximum size of the folder in bytes.
+    """
+    def __init__(
+        self,
+        folder: str,
+        variants: dict[str, Variant],
+        max_size: int = DEFAULT_CACHE_SIZE
+    ) -> None:
+        if max_size < 1:
+            raise ValueError("max_size must be a positive number")
+        self.folder = os.path.abspath(folder)
+        self.variants = variants
+        self.max_size = max_size
+        self._index: OrderedDict[str, int] | None = None
+        self._size = 0
+        self._lock = threading.Lock()
+        self._locks: dict[str, tuple[threading.Lock, int]] = {}
+
+    def path(self, name: str, key: str) -> str:
+        """
+        This returns the path of the variant `name` of the file stored under
+        `key`.
+        """
+        path = safe_join(self.folder, name, normalize_key(key))
+        if path is None:
+            raise ValueError("Invalid key %r" % key)  # pragma: no cover
+        return path
+
+    def get(
+        self, name: str, key: str, opener: Callable[[str], IO[bytes]]
+    ) -> str:
+        """
+        This returns the path of the variant `name` of the file stored under
+        `key`, creating it first if needed.
+
+        :param name: The name of the variant.
+        :param key: The storage key of the original image.
+        :param opener: The function to open the original image with.
+        """
+        path = self.path(name, key)
+        try:
+            size = os.stat(path).st_size
+        except FileNotFoundError:
+            with self._locked(path):
+                # another thread may have created it while we waited
+                if not os.path.exists(path):
+                    with opener(key) as source:
+                        render(source, path, self.variants[name])
+                size = os.stat(path).st_size
+        self._used(path, size)
+        return path
+
+    def discard(self, key: str) -> None:
+        """
+        This removes all variants of the file stored under `key`, e.g.
+        because it was replaced.
+        """
+        for name in self.variants:
+            path = self.path(name, key)
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            with self._lock:
+                if self._index is not None:
+                    self._size -= self._index.pop(path, 0)
+
+    @property
+    def size(self) -> int:
+        """This is the size of all variants known to this process."""
+        with self._lock:
+            self._load()
+            return self._size
+
+    @contextlib.contextmanager
+    def _locked(self, path: str) -> Iterator[None]:
+        with self._lock:
+            lock, users = self._locks.get(path, (threading.Lock(), 0))
+            self._locks[path] = (lock, users + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self._lock:
+                lock, users = self._locks[path]
+                if users == 1:
+                    del self._locks[path]
+                else:
+                    self._locks[path] = (lock, users - 1)
+
+    def _load(self) -> 'OrderedDict[str, int]':
+        # must be called with the lock held
+        if self._index is not None:
+            return self._index
+        found = []
+        for folder, _, files in os.walk(self.folder):
+            for filename in files:
+                if filename.startswith('.'):
+                    continue
+                path = os.path.join(folder, filename)
+                with contextlib.suppress(FileNotFoundError):
+                    st = os.stat(path)
+                    found.append((st.st_mtime, path, st.st_size))
+        found.sort()
+        self._index = OrderedDict((path, size) for _, path, size in found)
+        self._size = sum(self._index.values())
+        return self._index
+
+    def _used(self, path: str, size: int) -> None:
+        evicted = []
+        with self._lock:
+            index = self._load()
+            self._size += size - index.pop(path, 0)
+            index[path] = size
+            # never evict the variant which is about to be served
+            while self._size > self.max_size and len(index) > 1:
+                old, old_size = index.popitem(last=False)
+                self._size -= old_size
+                evicted.append(old)
+        for old in evicted:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(old)
+
+
+def send_variant(
+    config: 'UploadConfiguration', filename: str, name: str
+) -> Any:
+    """
+    This returns a response with the variant `name` of a file of an upload
+    set, which is created if it does not exist yet.
+
+    :param config: The configuration of the upload set.
+    :param filename: The name the file was saved as.
+    :param name: The name of the variant.
+    """
+    cache = config.variant_cache
+    if cache is None or name not in cache.variants:
+        abort(404)
+    key = config.key(filename)
+    try:
+        path = cache.get(name, key, config.storage.open)
+    except (FileNotFoundError, ValueError):
+        abort(404)
+    return send_file(
+        path, mimetype=guess_mimetype(key), max_age=config.cache_max_age)
@@ -0,0 +1,64 @@
+import io
+from collections.abc import Callable
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Any
+
+import pytest
+from flask import Flask
+from flask_uploads import ALL
+from flask_uploads import UploadConfiguration
+from flask_uploads import UploadSet
+from flask_uploads import configure_uploads
+from werkzeug.datastructures import FileStorage
+
+MakeSet = Callable[..., UploadSet]
+MakeStorage = Callable[..., FileStorage]
+MakeApp = Callable[..., Flask]
+
+
+@pytest.fixture
+def make_set(tmp_path: Path) -> MakeSet:
+    """
+    This returns a factory for upload sets which are configured without an
+    application, and save to `destination`, by default `tmp_path`. Further
+    keyword arguments are passed on to `UploadConfiguration`.
+    """
+    def make_set(
+        destination: Path | str | None = None,
+        extensions: Iterable[str] = ALL,
+        name: str = "files",
+        **options: Any
+    ) -> UploadSet:
+        uset = UploadSet(name, extensions)
+        uset._config = UploadConfiguration(
+            str(tmp_path if destination is None else destination), **options)
+        return uset
+    return make_set
+
+
+@pytest.fixture
+def make_storage() -> MakeStorage:
+    """
+    This returns a factory for uploaded files with the content `data`, held
+    in memory.
+    """
+    def make_storage(
+        filename: str = "foo.txt", data: bytes = b"data"
+    ) -> FileStorage:
+        return FileStorage(io.BytesIO(data), filename=filename)
+    return make_storage
+
+
+@pytest.fixture
+def make_app() -> MakeApp:
+    """
+    This returns a factory for applications with the configuration `config`,
+    which are configured for `upload_sets`.
+    """
+    def make_app(*upload_sets: UploadSet, **config: Any) -> Flask:
+        app = Flask(__name__)
+        app.config.update(config)
+        configure_uploads(app, upload_sets)
+        return app
+    return make_app
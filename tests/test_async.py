@@ -0,0 +1,73 @@
+import asyncio
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+from flask_uploads import ALL
+from flask_uploads import IMAGES
+from flask_uploads import UploadConfiguration
+from flask_uploads import UploadNotAllowed
+from flask_uploads import UploadSet
+from werkzeug.datastructures import FileStorage
+
+from .conftest import MakeApp
+from .conftest import MakeSet
+from .conftest import MakeStorage
+
+
+class TestAsync:
+    def test_save_async_uses_the_app_context(
+        self, tmp_path: Path, make_app: MakeApp, make_storage: MakeStorage
+    ) -> None:
+        files = UploadSet("files", ALL)
+        app = make_app(files, UPLOADED_FILES_DEST=str(tmp_path))
+        with app.app_context():
+            name = asyncio.run(
+                files.save_async(make_storage(), folder="someguy"))
+
+        assert name == "someguy/foo.txt"
+        assert (tmp_path / "someguy" / "foo.txt").read_bytes() == b"data"
+
+    def test_save_async_runs_on_the_executor(self, tmp_path: Path) -> None:
+        threads = []
+
+        class RecordingStorage(FileStorage):
+            def save(  # type: ignore
+                self, dst: str, buffer_size: int = 16384
+            ) -> None:
+                threads.append(threading.current_thread().name)
+                super().save(dst, buffer_size)
+
+        executor = ThreadPoolExecutor(1, thread_name_prefix="uploads")
+        uset = UploadSet("files", ALL, executor=executor)
+        uset._config = UploadConfiguration(str(tmp_path))
+        storage = RecordingStorage(io.BytesIO(b"data"), filename="foo.txt")
+
+        assert asyncio.run(uset.save_async(storage)) == "foo.txt"
+        assert threads[0].startswith("uploads")
+        executor.shutdown()
+
+    def test_save_async_raises_like_save(
+        self, make_set: MakeSet, make_storage: MakeStorage
+    ) -> None:
+        uset = make_set(extensions=IMAGES, name="photos")
+        with pytest.raises(UploadNotAllowed):
+            asyncio.run(uset.save_async(make_storage("foo.exe")))
+
+    def test_path_and_resolve_conflict_async(
+        self, tmp_path: Path, make_set: MakeSet
+    ) -> None:
+        uset = make_set()
+        (tmp_path / "foo.txt").touch()
+
+        async def main() -> tuple[str, str]:
+            return await asyncio.gather(
+                uset.path_async("foo.txt", folder="someguy"),
+                uset.resolve_conflict_async(str(tmp_path), "foo.txt"),
+            )
+
+        path, name = asyncio.run(main())
+        assert path == str(tmp_path / "someguy" / "foo.txt")
+        assert name == "foo_1.txt"
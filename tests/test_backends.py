@@ -0,0 +1,303 @@
+import hashlib
+import io
+import os
+from collections.abc import Iterator
+from datetime import datetime
+from datetime import timezone
+from pathlib import Path
+from typing import Any
+
+import pytest
+from flask_uploads import ALL
+from flask_uploads import FileSystemBackend
+from flask_uploads import MemoryBackend
+from flask_uploads import MemoryConflictIndex
+from flask_uploads import S3Backend
+from flask_uploads import StorageBackend
+from flask_uploads import UploadConfiguration
+from flask_uploads import UploadNotAllowed
+from flask_uploads import UploadSet
+from flask_uploads.backends import StoredFile
+from flask_uploads.backends import normalize_key
+
+from .conftest import MakeApp
+from .conftest import MakeSet
+from .conftest import MakeStorage
+
+
+class ClientError(Exception):
+    def __init__(self, code: str) -> None:
+        super().__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+
+class FakeS3Client:
+    """the subset of the boto3 S3 client used by `S3Backend`"""
+
+    page_size = 2
+
+    def __init__(self) -> None:
+        self.objects: dict[tuple[str, str], bytes] = {}
+
+    def _get(self, bucket: str, key: str) -> bytes:
+        try:
+            return self.objects[bucket, key]
+        except KeyError:
+            raise ClientError("404") from None
+
+    def upload_fileobj(self, stream: Any, bucket: str, key: str) -> None:
+        self.objects[bucket, key] = stream.read()
+
+    def head_object(self, Bucket: str, Key: str) -> dict[str, Any]:
+        return {
+            "ContentLength": len(self._get(Bucket, Key)),
+            "LastModified": datetime(2020, 1, 1, tzinfo=timezone.utc),
+        }
+
+    def get_object(self, Bucket: str, Key: str) -> dict[str, Any]:
+        return {"Body": io.BytesIO(self._get(Bucket, Key))}
+
+    def delete_object(self, Bucket: str, Key: str) -> None:
+        self.objects.pop((Bucket, Key), None)
+
+    def list_objects_v2(
+        self, Bucket: str, Prefix: str, ContinuationToken: str = "0"
+    ) -> dict[str, Any]:
+        keys = sorted(
+            key for bucket, key in self.objects
+            if bucket == Bucket and key.startswith(Prefix))
+        start = int(ContinuationToken)
+        end = start + self.page_size
+        response: dict[str, Any] = {
+            "Contents": [{"Key": key} for key in keys[start:end]],
+            "IsTruncated": end < len(keys),
+        }
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = str(end)
+        return response
+
+
+@pytest.fixture(params=["filesystem", "memory", "s3"])
+def backend(request: Any, tmp_path: Path) -> Iterator[StorageBackend]:
+    if request.param == "filesystem":
+        yield FileSystemBackend(str(tmp_path))
+    elif request.param == "memory":
+        yield MemoryBackend()
+    else:
+        yield S3Backend(FakeS3Client(), "bucket", prefix="uploads/")
+
+
+@pytest.fixture
+def files(make_set: MakeSet, backend: StorageBackend) -> UploadSet:
+    return make_set("", backend=backend)
+
+
+class TestKeys:
+    @pytest.mark.parametrize("key", ["../etc/passwd", "/etc/passwd",
+                                     "a/../..", "a\\b", ".", ""])
+    def test_keys_must_stay_within_the_storage(self, key: str) -> None:
+        with pytest.raises(ValueError):
+            normalize_key(key)
+
+    def test_keys_are_normalized(self) -> None:
+        assert normalize_key("a//b/./c.txt") == "a/b/c.txt"
+
+
+class TestBackends:
+    def test_the_interface_is_abstract(self) -> None:
+        backend = StorageBackend()
+        with pytest.raises(NotImplementedError):
+            backend.save("key", io.BytesIO())
+        for method in ("exists", "open", "stat", "delete", "list"):
+            with pytest.raises(NotImplementedError):
+                getattr(backend, method)("key")
+
+    def test_backends_store_files(self, backend: StorageBackend) -> None:
+        assert not backend.exists("a/b.txt")
+        assert backend.save("a/b.txt", io.BytesIO(b"content"), 2) == 7
+        assert backend.exists("a/b.txt")
+        with backend.open("a/b.txt") as f:
+            assert f.read() == b"content"
+        assert backend.stat("a/b.txt").size == 7
+        backend.save("c.txt", io.BytesIO(b"other"))
+        assert sorted(backend.list()) == ["a/b.txt", "c.txt"]
+        assert list(backend.list("a")) == ["a/b.txt"]
+        backend.delete("a/b.txt")
+        assert not backend.exists("a/b.txt")
+
+    def test_backends_report_missing_files(
+        self, backend: StorageBackend
+    ) -> None:
+        for method in ("open", "stat", "delete"):
+            with pytest.raises(FileNotFoundError):
+                getattr(backend, method)("missing.txt")
+
+    def test_filesystem_backend_writes_atomically(
+        self, tmp_path: Path
+    ) -> None:
+        class Broken(io.BytesIO):
+            def read(self, size: int | None = -1) -> bytes:
+                raise OSError("connection lost")
+
+        backend = FileSystemBackend(str(tmp_path))
+        with pytest.raises(OSError):
+            backend.save("a.txt", Broken())
+        assert os.listdir(tmp_path) == []
+
+    def test_s3_backend_lists_all_pages(self) -> None:
+        backend = S3Backend(FakeS3Client(), "bucket")
+        for i in range(5):
+            backend.save("%d.txt" % i, io.BytesIO(b"x"))
+        assert list(backend.list()) == ["%d.txt" % i for i in range(5)]
+
+    def test_s3_backend_stat(self) -> None:
+        backend = S3Backend(FakeS3Client(), "bucket")
+        backend.save("a.txt", io.BytesIO(b"abc"))
+        assert backend.stat("a.txt") == StoredFile(
+            3, datetime(2020, 1, 1, tzinfo=timezone.utc).timestamp())
+
+    def test_s3_backend_passes_other_errors_on(self) -> None:
+        class Forbidden(FakeS3Client):
+            def _get(self, bucket: str, key: str) -> bytes:
+                raise ClientError("403")
+
+        backend = S3Backend(Forbidden(), "bucket")
+        for method in ("exists", "open"):
+            with pytest.raises(ClientError):
+                getattr(backend, method)("a.txt")
+
+    def test_stored_file_equality(self) -> None:
+        assert StoredFile(1, 2.0) == StoredFile(1, 2.0)
+        assert StoredFile(1, 2.0) != StoredFile(1, 3.0)
+        assert StoredFile(1, 2.0) != (1, 2.0)
+        assert repr(StoredFile(1, 2.0)) == "<StoredFile size=1 mtime=2.0>"
+
+
+class TestConfiguration:
+    def test_backend_is_read_from_the_configuration(
+        self, make_app: MakeApp
+    ) -> None:
+        backend = MemoryBackend()
+        app = make_app(UploadSet("files"), UPLOADED_FILES_BACKEND=backend)
+        config = app.upload_set_config["files"]  # type: ignore
+        assert config.backend is backend
+        assert config.storage is backend
+
+    def test_filesystem_is_the_default_storage(
+        self, tmp_path: Path, make_set: MakeSet, make_storage: MakeStorage
+    ) -> None:
+        uset = make_set()
+        uset.save(make_storage())
+        storage = uset.config.storage
+        assert isinstance(storage, FileSystemBackend)
+        assert storage.root == str(tmp_path)
+        assert uset.exists("foo.txt")
+        with uset.open("foo.txt") as f:
+            assert f.read() == b"data"
+        uset.delete("foo.txt")
+        assert not uset.exists("foo.txt")
+
+
+class TestSavingToBackends:
+    def test_save_to_backend(
+        self, files: UploadSet, make_storage: MakeStorage
+    ) -> None:
+        assert files.save(make_storage()) == "foo.txt"
+        assert files.save(make_storage(data=b"again")) == "foo_1.txt"
+        assert files.save(make_storage(), folder="someguy") == (
+            "someguy/foo.txt")
+        assert files.save(make_storage(), name="bar.") == "bar.txt"
+        with files.open("foo_1.txt") as f:
+            assert f.read() == b"again"
+
+    def test_files_in_backends_have_no_path(self, make_set: MakeSet) -> None:
+        uset = make_set("", backend=MemoryBackend())
+        with pytest.raises(RuntimeError):
+            uset.path("foo.txt")
+
+    def test_conflicts_use_the_index(self, make_storage: MakeStorage) -> None:
+        uset = UploadSet("files", ALL, conflict_index=MemoryConflictIndex())
+        uset._config = UploadConfiguration("", backend=MemoryBackend())
+        names = [uset.save(make_storage()) for _ in range(3)]
+        assert names == ["foo.txt", "foo_1.txt", "foo_2.txt"]
+
+    def test_max_size_is_enforced(
+        self,
+        backend: StorageBackend,
+        make_set: MakeSet,
+        make_storage: MakeStorage
+    ) -> None:
+        uset = make_set("", backend=backend, max_size=3)
+        with pytest.raises(UploadNotAllowed):
+            uset.save(make_storage())
+        assert list(backend.list()) == []
+
+    def test_content_addressed_backend(
+        self,
+        backend: StorageBackend,
+        make_set: MakeSet,
+        make_storage: MakeStorage
+    ) -> None:
+        uset = make_set("", backend=backend, content_hash="sha256")
+        digest = hashlib.sha256(b"data").hexdigest()
+        name = "%s/%s/%s.txt" % (digest[:2], digest[2:4], digest)
+        assert uset.save(make_storage()) == name
+        assert uset.save(make_storage("copy.txt")) == name
+        assert list(backend.list()) == [name]
+        empty = hashlib.sha256(b"").hexdigest()
+        assert uset.save(make_storage("blob", b""), folder="x") == (
+            "x/%s/%s/%s" % (empty[:2], empty[2:4], empty))
+
+    def test_save_many_to_backend(
+        self, make_set: MakeSet, make_storage: MakeStorage
+    ) -> None:
+        backend = MemoryBackend()
+        backend.save("someguy/foo.txt", io.BytesIO(b"old"))
+        backend.save("someguy/deeper/foo_1.txt", io.BytesIO(b"old"))
+        uset = make_set("", backend=backend)
+        results = uset.save_many(
+            [make_storage(), make_storage()], folder="someguy")
+        assert [r.name for r in results] == [
+            "someguy/foo_1.txt", "someguy/foo_2.txt"]
+
+    def test_save_many_content_addressed_backend(
+        self, make_set: MakeSet, make_storage: MakeStorage
+    ) -> None:
+        uset = make_set("", backend=MemoryBackend(), content_hash="sha256")
+        results = uset.save_many([make_storage(), make_storage()])
+        assert results[0].ok and results[0].name == results[1].name
+
+
+class TestServingFromBackends:
+    def test_serve_from_backend(
+        self, backend: StorageBackend, make_app: MakeApp
+    ) -> None:
+        backend.save("a/b.txt", io.BytesIO(b"0123456789"))
+        app = make_app(UploadSet("files", ALL), UPLOADS_AUTOSERVE=True,
+                       UPLOADED_FILES_BACKEND=backend)
+        with app.test_client() as client:
+            response = client.get("/_uploads/files/a/b.txt")
+            assert response.status_code == 200
+            assert response.data == b"0123456789"
+            assert response.mimetype == "text/plain"
+            assert response.headers["Accept-Ranges"] == "bytes"
+            last_modified = response.headers["Last-Modified"]
+
+            response = client.get(
+                "/_uploads/files/a/b.txt", headers={"Range": "bytes=2-4"})
+            assert response.status_code == 206
+            assert response.data == b"234"
+
+            response = client.get(
+                "/_uploads/files/a/b.txt",
+                headers={"If-Modified-Since": last_modified})
+            assert response.status_code == 304
+
+    @pytest.mark.parametrize("path", ["missing.txt", "a/../../b.txt"])
+    def test_serve_missing_from_backend(
+        self, path: str, make_app: MakeApp
+    ) -> None:
+        app = make_app(UploadSet("files", ALL), UPLOADS_AUTOSERVE=True,
+                       UPLOADED_FILES_BACKEND=MemoryBackend())
+        with app.test_client() as client:
+            assert client.get("/_uploads/files/" + path).status_code == 404
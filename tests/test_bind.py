@@ -0,0 +1,87 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+from flask import Flask
+from flask_uploads import ALL
+from flask_uploads import MemoryBackend
+from flask_uploads import UploadConfiguration
+from flask_uploads import UploadSet
+
+from .conftest import MakeApp
+from .conftest import MakeStorage
+
+
+@pytest.fixture
+def files() -> UploadSet:
+    return UploadSet("files", ALL)
+
+
+@pytest.fixture
+def app(tmp_path: Path, files: UploadSet, make_app: MakeApp) -> Flask:
+    return make_app(
+        files, UPLOADED_FILES_DEST=str(tmp_path),
+        UPLOADED_FILES_URL="https://cdn.example.com/")
+
+
+class TestBind:
+    def test_bound_upload_sets_need_no_app_context(
+        self,
+        tmp_path: Path,
+        app: Flask,
+        files: UploadSet,
+        make_storage: MakeStorage
+    ) -> None:
+        bound = files.bind(app)
+        assert bound is not files
+        assert bound.name == "files"
+        assert bound.config is app.upload_set_config["files"]  # type: ignore
+        assert bound.save(make_storage("a.txt")) == "a.txt"
+        assert bound.save(make_storage("a.txt")) == "a_1.txt"
+        assert bound.path("a.txt") == str(tmp_path / "a.txt")
+        assert bound.url("a.txt") == "https://cdn.example.com/a.txt"
+        assert bound.exists("a_1.txt")
+        bound.delete("a_1.txt")
+        assert not bound.exists("a_1.txt")
+        # the upload set itself is not bound
+        with pytest.raises(RuntimeError):
+            files.config
+
+    def test_bound_upload_sets_share_their_state(
+        self,
+        tmp_path: Path,
+        app: Flask,
+        files: UploadSet,
+        make_storage: MakeStorage
+    ) -> None:
+        paths: list[str] = []
+        files.processor(paths.append)
+        bound = files.bind(app)
+        name = bound.save(make_storage("a.txt"))
+        bound.jobs(name)[0].result(timeout=5)
+        assert paths == [str(tmp_path / "a.txt")]
+        assert files.jobs(name) == bound.jobs(name)
+
+    def test_bind_to_a_configuration(
+        self, files: UploadSet, make_storage: MakeStorage
+    ) -> None:
+        bound = files.bind(
+            UploadConfiguration("/unused", backend=MemoryBackend()))
+        assert bound.save(make_storage("a.txt")) == "a.txt"
+        with bound.open("a.txt") as f:
+            assert f.read() == b"data"
+
+    def test_bind_to_unconfigured_applications(self, app: Flask) -> None:
+        with pytest.raises(RuntimeError):
+            UploadSet("other").bind(app)
+        with pytest.raises(RuntimeError):
+            UploadSet("files").bind(Flask(__name__))
+
+    def test_bound_upload_sets_are_thread_safe(
+        self, app: Flask, files: UploadSet, make_storage: MakeStorage
+    ) -> None:
+        bound = files.bind(app)
+        with ThreadPoolExecutor(8) as pool:
+            names = list(pool.map(
+                lambda i: bound.save(make_storage("%d.txt" % i)), range(100)))
+        assert sorted(names) == sorted("%d.txt" % i for i in range(100))
@@ -0,0 +1,479 @@
+import errno
+import io
+import os
+import time
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+from flask_uploads import IMAGES
+from flask_uploads import UploadNotAllowed
+from flask_uploads import UploadSet
+from flask_uploads.chunked import ChunkedUpload
+from flask_uploads.chunked import complete_upload
+from flask_uploads.chunked import lock
+from flask_uploads.chunked import purge_stale
+from flask_uploads.chunked import staging_folder
+from flask_uploads.streaming import _kernel_copy
+
+from .conftest import MakeApp
+
+PNG = b"\x89PNG\r\n\x1a\n" + os.urandom(10_000)
+SIZE = len(PNG)
+
+
+@pytest.fixture
+def photos() -> UploadSet:
+    return UploadSet("photos", IMAGES)
+
+
+@pytest.fixture
+def make_chunked_app(
+    tmp_path: Path, photos: UploadSet, make_app: MakeApp
+) -> MakeApp:
+    """
+    This returns a factory for applications with chunked uploads to
+    `photos`, and a second set without them.
+    """
+    def make_chunked_app(**config: object) -> Flask:
+        return make_app(
+            photos, UploadSet("others"),
+            UPLOADS_CHUNKED_DEST=str(tmp_path / "staging"),
+            UPLOADED_PHOTOS_DEST=str(tmp_path / "photos"),
+            UPLOADED_PHOTOS_CHUNKED=True,
+            UPLOADED_OTHERS_DEST=str(tmp_path / "others"),
+            **config)
+    return make_chunked_app
+
+
+def start(client: FlaskClient, size: int = SIZE, **params: object) -> str:
+    params = dict(dict(filename="Holiday.PNG", size=size), **params)
+    response = client.post("/_uploads/chunked/photos", json=params)
+    assert response.status_code == 201
+    return str(response.headers["Location"])
+
+
+def put(client: FlaskClient, url: str, offset: int, data: bytes) -> int:
+    response = client.put(
+        url, data=data, headers={"Upload-Offset": str(offset)})
+    return response.status_code
+
+
+class TestStagingFolder:
+    def test_staging_folder_defaults_to_the_temporary_directory(
+        self, tmp_path: Path
+    ) -> None:
+        with patch("tempfile.gettempdir", return_value=str(tmp_path)):
+            folder = staging_folder(Flask(__name__))
+        assert folder == str(tmp_path / "flask-uploads-chunked")
+        assert os.stat(folder).st_mode & 0o777 == 0o700
+
+    @pytest.mark.parametrize("mode", [0o777, 0o750])
+    def test_default_staging_folder_must_be_private(
+        self, tmp_path: Path, mode: int
+    ) -> None:
+        # e.g. created in the shared temporary directory by another user
+        (tmp_path / "flask-uploads-chunked").mkdir()
+        (tmp_path / "flask-uploads-chunked").chmod(mode)
+        with patch("tempfile.gettempdir", return_value=str(tmp_path)):
+            with pytest.raises(PermissionError):
+                staging_folder(Flask(__name__))
+        (tmp_path / "flask-uploads-chunked").chmod(0o700)
+        with patch("tempfile.gettempdir", return_value=str(tmp_path)), \
+                patch("os.getuid", return_value=os.getuid() + 1):
+            with pytest.raises(PermissionError):
+                staging_folder(Flask(__name__))
+
+
+class TestChunkedViews:
+    def test_blueprint_is_only_registered_for_chunked_sets(
+        self, tmp_path: Path, make_chunked_app: MakeApp, make_app: MakeApp
+    ) -> None:
+        app = make_app(UploadSet("files"), UPLOADS_DEFAULT_DEST=str(tmp_path))
+        assert "_uploads_chunked" not in app.blueprints
+        app = make_chunked_app()
+        assert "_uploads_chunked" in app.blueprints
+        assert app.upload_sets["others"].name == "others"  # type: ignore
+
+    def test_sequential_upload(
+        self, tmp_path: Path, make_chunked_app: MakeApp
+    ) -> None:
+        app = make_chunked_app()
+        client = app.test_client()
+        url = start(client)
+        for offset in range(0, len(PNG), 4096):
+            assert put(client, url, offset, PNG[offset:offset + 4096]) == 200
+        response = client.post(url + "/complete")
+        assert response.status_code == 201
+        assert response.json == dict(name="Holiday.png", url=None)
+        assert (tmp_path / "photos" / "Holiday.png").read_bytes() == PNG
+        assert os.listdir(tmp_path / "staging") == []
+
+    def test_resume_and_parallel_chunks(
+        self, tmp_path: Path, make_chunked_app: MakeApp
+    ) -> None:
+        app = make_chunked_app(UPLOADS_AUTOSERVE=True)
+        client = app.test_client()
+        url = start(client)
+        # the second half arrives first, and a chunk is sent twice
+        assert put(client, url, 5000, PNG[5000:]) == 200
+        assert put(client, url, 0, PNG[:1000]) == 200
+        assert put(client, url, 0, PNG[:1000]) == 200
+
+        response = client.head(url)
+        assert response.headers["Upload-Offset"] == "1000"
+        assert response.headers["Upload-Length"] == str(len(PNG))
+        assert put(client, url, 2000, b"") == 200
+        response = client.get(url)
+        assert response.json == dict(
+            id=url.rpartition("/")[2], size=len(PNG), offset=1000,
+            received=[[0, 1000], [5000, len(PNG)]])
+
+        # not complete yet
+        response = client.post(url + "/complete")
+        assert response.status_code == 409
+
+        assert put(client, url, 900, PNG[900:5100]) == 200
+        assert client.head(url).headers["Upload-Offset"] == str(len(PNG))
+        response = client.post(url + "/complete")
+        assert response.status_code == 201
+        assert response.json == dict(
+            name="Holiday.png",
+            url="http://localhost/_uploads/photos/Holiday.png")
+        assert (tmp_path / "photos" / "Holiday.png").read_bytes() == PNG
+
+    @pytest.mark.parametrize("params, status", [
+        (dict(filename="virus.exe"), 403),
+        (dict(filename=""), 400),
+        (dict(size="many"), 400),
+        (dict(size=-1), 400),
+        (dict(size=1_000_000), 413),
+    ])
+    def test_uploads_are_checked_up_front(
+        self, params: dict[str, object], status: int, make_chunked_app: MakeApp
+    ) -> None:
+        app = make_chunked_app(UPLOADED_PHOTOS_MAX_SIZE=100_000)
+        params = dict(dict(filename="photo.png", size=10), **params)
+        with app.test_client() as client:
+            response = client.post("/_uploads/chunked/photos", data=params)
+        assert response.status_code == status
+
+    @pytest.mark.parametrize("config, size, status", [
+        ({}, 1 << 30, 201),
+        ({}, (1 << 30) + 1, 413),
+        (dict(UPLOADS_CHUNKED_MAX_SIZE=100), 101, 413),
+        # the limit of the set wins
+        (dict(UPLOADS_CHUNKED_MAX_SIZE=100, UPLOADED_PHOTOS_MAX_SIZE=200), 200,
+         201),
+    ])
+    def test_declared_sizes_are_limited(
+        self,
+        config: dict[str, object],
+        size: int,
+        status: int,
+        make_chunked_app: MakeApp
+    ) -> None:
+        app = make_chunked_app(**config)
+        with patch("flask_uploads.chunked.preallocate"):
+            with app.test_client() as client:
+                response = client.post(
+                    "/_uploads/chunked/photos",
+                    data=dict(filename="a.png", size=size))
+        assert response.status_code == status
+
+    @pytest.mark.parametrize("size", [2 ** 62, 10 ** 30])
+    def test_sizes_too_large_for_the_filesystem(
+        self, tmp_path: Path, size: int, make_chunked_app: MakeApp
+    ) -> None:
+        with pytest.raises(OSError) as e:
+            ChunkedUpload.create(str(tmp_path), "photos", "a.png", size)
+        assert e.value.errno == errno.EFBIG
+        assert os.listdir(tmp_path) == []
+        app = make_chunked_app(UPLOADED_PHOTOS_MAX_SIZE=10 ** 40)
+        with app.test_client() as client:
+            response = client.post(
+                "/_uploads/chunked/photos",
+                data=dict(filename="a.png", size=size))
+        assert response.status_code == 413
+
+    def test_chunks_are_checked(self, make_chunked_app: MakeApp) -> None:
+        app = make_chunked_app()
+        client = app.test_client()
+        url = start(client, size=10)
+        assert put(client, url, 5, b"123456") == 413
+        assert put(client, url, 11, b"") == 400
+        assert client.put(url, data=b"1").status_code == 400
+        assert client.head(url).headers["Upload-Offset"] == "0"
+
+    def test_unknown_sets_and_uploads(self, make_chunked_app: MakeApp) -> None:
+        app = make_chunked_app()
+        client = app.test_client()
+        assert client.post(
+            "/_uploads/chunked/others", data=dict(filename="a.txt", size=1)
+        ).status_code == 404
+        assert client.get("/_uploads/chunked/photos/bad!id").status_code == 404
+        assert client.post(
+            "/_uploads/chunked/missing", data=dict(filename="a.txt", size=1)
+        ).status_code == 404
+        assert client.get(
+            "/_uploads/chunked/photos/../../etc").status_code == 404
+        assert client.get(
+            "/_uploads/chunked/photos/" + "a" * 22).status_code == 404
+        url = start(client)
+        # another chunked set
+        app.upload_set_config["others"].chunked = True  # type: ignore
+        assert client.get(url.replace("photos", "others")).status_code == 404
+
+    def test_cancel(self, make_chunked_app: MakeApp) -> None:
+        app = make_chunked_app()
+        client = app.test_client()
+        url = start(client)
+        assert client.delete(url).status_code == 204
+        assert client.get(url).status_code == 404
+
+    def test_completing_uploads_are_not_found(
+        self, tmp_path: Path, make_chunked_app: MakeApp
+    ) -> None:
+        app = make_chunked_app()
+        client = app.test_client()
+        url = start(client)
+        assert put(client, url, 0, PNG) == 200
+        # as if another request was completing the upload
+        upload_id = url.rpartition("/")[2]
+        (tmp_path / "staging" / upload_id / "completing").touch()
+        assert put(client, url, 0, PNG) == 404
+        assert client.post(url + "/complete").status_code == 404
+        assert not (tmp_path / "photos" / "Holiday.png").exists()
+
+    def test_content_is_checked_on_completion(
+        self, make_chunked_app: MakeApp
+    ) -> None:
+        app = make_chunked_app(UPLOADED_PHOTOS_SNIFF=True)
+        client = app.test_client()
+        url = start(client, size=3)
+        assert put(client, url, 0, b"GIF") == 200
+        assert client.post(url + "/complete").status_code == 403
+        assert client.get(url).status_code == 404
+
+    def test_disk_full(
+        self, tmp_path: Path, make_chunked_app: MakeApp
+    ) -> None:
+        app = make_chunked_app()
+        with patch("os.posix_fallocate",
+                   side_effect=OSError(errno.ENOSPC, "")):
+            with pytest.raises(OSError):
+                ChunkedUpload.create(str(tmp_path), "photos", "a.png", 100)
+            assert os.listdir(tmp_path) == []
+            with app.test_client() as client:
+                response = client.post(
+                    "/_uploads/chunked/photos",
+                    data=dict(filename="a.png", size=9))
+            assert response.status_code == 507
+        with patch("os.posix_fallocate", side_effect=OSError(errno.EIO, "")):
+            with app.test_client() as client:
+                response = client.post(
+                    "/_uploads/chunked/photos",
+                    data=dict(filename="a.png", size=9))
+            assert response.status_code == 500
+
+
+class TestCompletion:
+    def test_complete_upload_into_a_folder(
+        self, tmp_path: Path, make_chunked_app: MakeApp, photos: UploadSet
+    ) -> None:
+        app = make_chunked_app()
+        upload = ChunkedUpload.create(
+            str(tmp_path / "staging"), "photos", "a.png", 3)
+        upload.write(0, io.BytesIO(b"abc"))
+        with pytest.raises(ValueError):
+            ChunkedUpload.create(
+                str(tmp_path / "staging"), "photos", "a.png", -1)
+        with app.app_context():
+            assert complete_upload(photos, upload, folder="someguy") == (
+                "someguy/a.png")
+        empty = ChunkedUpload.create(
+            str(tmp_path / "staging"), "photos", "a.png", 1)
+        with pytest.raises(ValueError):
+            empty.assemble()
+        upload = ChunkedUpload.create(
+            str(tmp_path / "staging"), "photos", "a.exe", 0)
+        with app.app_context(), pytest.raises(UploadNotAllowed):
+            complete_upload(photos, upload)
+
+    def test_completed_uploads_are_linked_into_place(
+        self, tmp_path: Path, make_chunked_app: MakeApp, photos: UploadSet
+    ) -> None:
+        app = make_chunked_app()
+        upload = ChunkedUpload.create(
+            str(tmp_path / "staging"), "photos", "a.png", len(PNG))
+        upload.write(0, io.BytesIO(PNG))
+        staged = os.stat(upload.path)
+        with patch("shutil.copyfileobj", side_effect=AssertionError), \
+                patch("flask_uploads.streaming.copy_stream",
+                      side_effect=AssertionError), \
+                app.app_context():
+            assert complete_upload(photos, upload) == "a.png"
+        saved = tmp_path / "photos" / "a.png"
+        assert os.path.samestat(os.stat(saved), staged)
+        assert saved.read_bytes() == PNG
+        assert not os.path.exists(upload.folder)
+
+    def test_completed_uploads_are_copied_by_the_kernel(
+        self, tmp_path: Path, make_chunked_app: MakeApp, photos: UploadSet
+    ) -> None:
+        app = make_chunked_app()
+        upload = ChunkedUpload.create(
+            str(tmp_path / "staging"), "photos", "a.png", len(PNG))
+        upload.write(0, io.BytesIO(PNG))
+        # as if the staging folder was on another filesystem
+        with patch("os.link", side_effect=OSError(errno.EXDEV, "")), \
+                patch("shutil.copyfileobj", side_effect=AssertionError), \
+                patch("flask_uploads.streaming._kernel_copy",
+                      wraps=_kernel_copy) as spy, \
+                app.app_context():
+            assert complete_upload(photos, upload) == "a.png"
+        assert spy.call_count == 1
+        assert (tmp_path / "photos" / "a.png").read_bytes() == PNG
+
+    def test_chunks_wait_for_completion(self, tmp_path: Path) -> None:
+        upload = ChunkedUpload.create(str(tmp_path), "photos", "a.png", 10)
+        with ThreadPoolExecutor(1) as pool:
+            with open(upload.path, "rb") as f:
+                lock(f.fileno(), exclusive=True)
+                future = pool.submit(upload.write, 0, io.BytesIO(b"1"))
+                assert not wait([future], timeout=0.2).done
+            assert future.result() == 1
+
+    def test_chunks_of_completing_uploads_are_rejected(
+        self, tmp_path: Path
+    ) -> None:
+        upload = ChunkedUpload.create(str(tmp_path), "photos", "a.png", 10)
+        (Path(upload.folder) / "completing").touch()
+        with pytest.raises(FileNotFoundError):
+            upload.write(0, io.BytesIO(b"1"))
+        assert upload.received() == []
+
+    def test_chunks_of_replaced_files_are_rejected(
+        self, tmp_path: Path
+    ) -> None:
+        upload = ChunkedUpload.create(str(tmp_path), "photos", "a.png", 10)
+
+        def replace(fd: int, exclusive: bool = False) -> None:
+            # as if the file was moved into its set while waiting
+            (tmp_path / "other").write_bytes(b"0" * 10)
+            os.replace(tmp_path / "other", upload.path)
+
+        with patch("flask_uploads.chunked.lock", side_effect=replace):
+            with pytest.raises(FileNotFoundError):
+                upload.write(0, io.BytesIO(b"1"))
+        assert Path(upload.path).read_bytes() == b"0" * 10
+        assert upload.received() == []
+
+    def test_chunks_sent_while_completing_are_rejected(
+        self, tmp_path: Path, make_chunked_app: MakeApp, photos: UploadSet
+    ) -> None:
+        app = make_chunked_app(UPLOADED_PHOTOS_SNIFF=True)
+        client = app.test_client()
+        url = start(client)
+        assert put(client, url, 0, PNG) == 200
+        upload = ChunkedUpload.load(
+            str(tmp_path / "staging"), url.rpartition("/")[2])
+        futures: list[Future[int]] = []
+        save = photos.save
+
+        def saving(*args: object) -> str:
+            # a chunk, and another completion, sent while the file is being
+            # checked and saved
+            if not futures:
+                futures.append(pool.submit(
+                    put, app.test_client(), url, 0, b"<?php evil ?>"))
+                futures.append(pool.submit(
+                    lambda: app.test_client().post(
+                        url + "/complete").status_code))
+                assert not wait(futures, timeout=0.2).done
+            return save(*args)  # type: ignore
+
+        with ThreadPoolExecutor(2) as pool:
+            with patch.object(photos, "save", side_effect=saving):
+                assert client.post(url + "/complete").status_code == 201
+            assert [f.result() for f in futures] == [404, 404]
+        assert (tmp_path / "photos" / "Holiday.png").read_bytes() == PNG
+        # the file linked into the set cannot be written through the upload
+        with pytest.raises(FileNotFoundError):
+            upload.write(0, io.BytesIO(b"<?php evil ?>"))
+        assert client.post(url + "/complete").status_code == 404
+
+    def test_failed_completions_can_be_retried(
+        self, tmp_path: Path, make_chunked_app: MakeApp, photos: UploadSet
+    ) -> None:
+        app = make_chunked_app()
+        upload = ChunkedUpload.create(
+            str(tmp_path / "staging"), "photos", "a.png", 3)
+        upload.write(0, io.BytesIO(b"abc"))
+        with app.app_context():
+            with patch.object(photos, "save", side_effect=OSError):
+                with pytest.raises(OSError):
+                    complete_upload(photos, upload)
+            assert not upload.completing
+            assert upload.write(0, io.BytesIO(b"xyz")) == 3
+            assert complete_upload(photos, upload) == "a.png"
+        assert (tmp_path / "photos" / "a.png").read_bytes() == b"xyz"
+
+
+class TestStaging:
+    def test_failed_chunks_are_not_staged(self, tmp_path: Path) -> None:
+        class Broken(io.BytesIO):
+            def read(self, size: int | None = -1) -> bytes:
+                raise OSError("connection lost")
+
+        upload = ChunkedUpload.create(str(tmp_path), "photos", "a.png", 10)
+        with pytest.raises(OSError):
+            upload.write(0, Broken())
+        assert sorted(os.listdir(upload.folder)) == ["data", "upload.json"]
+        assert upload.received() == []
+
+    def test_staged_file_is_preallocated(self, tmp_path: Path) -> None:
+        upload = ChunkedUpload.create(
+            str(tmp_path), "photos", "a.png", 1 << 20)
+        st = os.stat(upload.path)
+        assert st.st_size == 1 << 20
+        assert ChunkedUpload.load(str(tmp_path), upload.id).path == upload.path
+
+    @pytest.mark.parametrize("error", [errno.EOPNOTSUPP, errno.EINVAL])
+    def test_sparse_file_without_fallocate(
+        self, tmp_path: Path, error: int
+    ) -> None:
+        with patch("os.posix_fallocate", side_effect=OSError(error, "")):
+            upload = ChunkedUpload.create(
+                str(tmp_path), "photos", "a.png", 100)
+        assert os.stat(upload.path).st_size == 100
+
+    def test_concurrent_chunks(self, tmp_path: Path) -> None:
+        upload = ChunkedUpload.create(
+            str(tmp_path), "photos", "a.png", len(PNG))
+        offsets = range(0, len(PNG), 1000)
+        with ThreadPoolExecutor(4) as pool:
+            sizes = list(pool.map(
+                lambda o: upload.write(o, io.BytesIO(PNG[o:o + 1000]), 100),
+                offsets))
+        assert sum(sizes) == len(PNG)
+        assert upload.received() == [(0, len(PNG))]
+        with upload.assemble() as f:
+            assert f.read() == PNG
+
+    def test_purge_stale(self, tmp_path: Path) -> None:
+        assert purge_stale(str(tmp_path / "missing"), 60) == 0
+        old = ChunkedUpload.create(str(tmp_path), "photos", "a.png", 10)
+        old.write(0, io.BytesIO(b"1"))
+        new = ChunkedUpload.create(str(tmp_path), "photos", "a.png", 10)
+        (tmp_path / "unrelated").mkdir()
+        past = time.time() - 3600
+        for name in ["", *os.listdir(old.folder)]:
+            os.utime(os.path.join(old.folder, name), (past, past))
+        assert purge_stale(str(tmp_path), 60) == 1
+        assert sorted(os.listdir(tmp_path)) == sorted([new.id, "unrelated"])
@@ -0,0 +1,168 @@
+import os
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from flask_uploads import ALL
+from flask_uploads import ConflictIndex
+from flask_uploads import MemoryConflictIndex
+from flask_uploads import SidecarConflictIndex
+from flask_uploads import TestingFileStorage
+from flask_uploads import UploadConfiguration
+from flask_uploads import UploadSet
+from flask_uploads.caching import LRUCache
+
+
+class TestLRUCache:
+    def test_lru_cache_evicts_least_recently_used(self) -> None:
+        cache: LRUCache[int] = LRUCache(2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        assert cache.get("a") == 1
+        cache.set("c", 3)
+        assert "a" in cache
+        assert "b" not in cache
+        assert len(cache) == 2
+        assert cache.pop("c") == 3
+        cache.clear()
+        assert cache.get("a") is None
+
+    def test_lru_cache_needs_a_positive_size(self) -> None:
+        with pytest.raises(ValueError):
+            LRUCache(0)
+
+
+class TestMemoryConflictIndex:
+    def test_conflict_index_is_an_interface(self) -> None:
+        index = ConflictIndex()
+        with pytest.raises(NotImplementedError):
+            index.reserve("/uploads", "foo.txt")
+        with pytest.raises(NotImplementedError):
+            index.record("/uploads", "foo.txt", 1)
+
+    def test_memory_index_hands_out_increasing_suffixes(self) -> None:
+        index = MemoryConflictIndex()
+        assert index.reserve("/uploads", "foo.txt") is None
+        index.record("/uploads", "foo.txt", 3)
+        index.record("/uploads", "foo.txt", 2)
+        assert index.reserve("/uploads", "foo.txt") == 4
+        assert index.reserve("/uploads", "foo.txt") == 5
+        assert index.reserve("/other", "foo.txt") is None
+
+    def test_resolve_conflict_probes_once_with_a_warm_index(
+        self, tmp_path: Path
+    ) -> None:
+        uset = UploadSet("files", ALL, conflict_index=MemoryConflictIndex())
+        uset._config = UploadConfiguration(str(tmp_path))
+        for n in range(5):
+            (tmp_path / ("foo_%d.txt" % n if n else "foo.txt")).touch()
+
+        # the cold index falls back to the linear scan
+        assert uset.resolve_conflict(str(tmp_path), "foo.txt") == "foo_5.txt"
+        (tmp_path / "foo_5.txt").touch()
+
+        probes = []
+        real_exists = os.path.exists
+
+        def exists(path: str) -> bool:
+            probes.append(path)
+            return real_exists(path)
+
+        os.path.exists = exists  # type: ignore
+        try:
+            result = uset.resolve_conflict(str(tmp_path), "foo.txt")
+        finally:
+            os.path.exists = real_exists
+        assert result == "foo_6.txt"
+        assert probes == [os.path.join(str(tmp_path), "foo_6.txt")]
+
+    def test_stale_index_never_overwrites(self, tmp_path: Path) -> None:
+        index = MemoryConflictIndex()
+        index.record(str(tmp_path), "foo.txt", 1)
+        (tmp_path / "foo_2.txt").touch()
+        uset = UploadSet("files", ALL, conflict_index=index)
+        assert uset.resolve_conflict(str(tmp_path), "foo.txt") == "foo_3.txt"
+
+    def test_save_uses_conflict_index(self, tmp_path: Path) -> None:
+        uset = UploadSet("files", ALL, conflict_index=MemoryConflictIndex())
+        uset._config = UploadConfiguration(str(tmp_path))
+        (tmp_path / "foo.txt").touch()
+        for expected in ("foo_1.txt", "foo_2.txt"):
+            tfs = TestingFileStorage(filename="foo.txt")
+            assert uset.save(tfs) == expected
+            assert tfs.saved is not None
+            Path(tfs.saved).touch()
+
+
+class TestSidecarConflictIndex:
+    def test_sidecar_index_survives_restarts(self, tmp_path: Path) -> None:
+        state = str(tmp_path / "state")
+        uploads = str(tmp_path / "uploads")
+        SidecarConflictIndex(folder=state).record(uploads, "foo.txt", 7)
+
+        index = SidecarConflictIndex(folder=state)
+        assert index.reserve(uploads, "foo.txt") == 8
+        assert index.reserve(uploads, "bar.txt") is None
+        assert index.reserve(str(tmp_path), "foo.txt") is None
+
+        # lower counters do not rewind the stored one
+        index.record(uploads, "foo.txt", 2)
+        assert SidecarConflictIndex(folder=state).reserve(
+            uploads, "foo.txt") == 8
+
+    def test_sidecar_index_stores_counters_apart(self, tmp_path: Path) -> None:
+        index = SidecarConflictIndex(folder=str(tmp_path / "state"))
+        uploads = tmp_path / "uploads"
+        uploads.mkdir()
+        index.record(str(uploads), "secret-report.pdf", 2)
+        index.record(str(uploads), "foo.txt", 1)
+        # nothing is written to the served folder
+        assert os.listdir(uploads) == []
+        paths = [index.path(str(uploads), name)
+                 for name in ("secret-report.pdf", "foo.txt")]
+        assert paths[0] != paths[1]
+        assert [Path(p).read_text() for p in paths] == ["2", "1"]
+        assert all("secret" not in p for p in paths)
+
+    def test_sidecar_index_needs_a_folder(self) -> None:
+        with pytest.raises(TypeError):
+            SidecarConflictIndex()  # type: ignore
+
+    def test_sidecar_index_does_not_follow_planted_links(
+        self, tmp_path: Path
+    ) -> None:
+        index = SidecarConflictIndex(folder=str(tmp_path / "state"))
+        path = Path(index.path("/uploads", "foo.txt"))
+        path.parent.mkdir(parents=True)
+        victim = tmp_path / "victim"
+        victim.write_text("precious")
+        for pid in range(os.getpid() - 5, os.getpid() + 5):
+            Path("%s.%d.tmp" % (path, pid)).symlink_to(victim)
+        index.record("/uploads", "foo.txt", 3)
+        assert victim.read_text() == "precious"
+        assert path.read_text() == "3"
+        assert not path.is_symlink()
+
+    def test_sidecar_index_ignores_broken_files(self, tmp_path: Path) -> None:
+        index = SidecarConflictIndex(folder=str(tmp_path))
+        path = Path(index.path("/uploads", "foo.txt"))
+        path.parent.mkdir()
+        path.write_text("not a number")
+        assert index.reserve("/uploads", "foo.txt") is None
+
+    def test_sidecar_index_tolerates_unwritable_folders(
+        self, tmp_path: Path
+    ) -> None:
+        (tmp_path / "state").write_text("not a folder")
+        index = SidecarConflictIndex(folder=str(tmp_path / "state"))
+        index.record("/uploads", "foo.txt", 3)
+        assert index.reserve("/uploads", "foo.txt") == 4
+
+    def test_sidecar_index_removes_unused_temporary_files(
+        self, tmp_path: Path
+    ) -> None:
+        index = SidecarConflictIndex(folder=str(tmp_path))
+        with patch("os.replace", side_effect=OSError):
+            index.record("/uploads", "foo.txt", 3)
+        folder = os.path.dirname(index.path("/uploads", "foo.txt"))
+        assert os.listdir(folder) == []
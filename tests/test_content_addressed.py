@@ -0,0 +1,102 @@
+import hashlib
+import io
+import os
+import tempfile
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from flask_uploads import UploadConfiguration
+from flask_uploads import UploadNotAllowed
+from flask_uploads import UploadSet
+from werkzeug.datastructures import FileStorage
+
+from .conftest import MakeApp
+from .conftest import MakeSet
+from .conftest import MakeStorage
+
+PAYLOAD = os.urandom(100_000)
+DIGEST = hashlib.sha256(PAYLOAD).hexdigest()
+NAME = "%s/%s/%s.pdf" % (DIGEST[:2], DIGEST[2:4], DIGEST)
+
+
+@pytest.fixture
+def files(make_set: MakeSet) -> UploadSet:
+    return make_set(content_hash="sha256")
+
+
+class TestConfiguration:
+    def test_content_hash_is_read_from_the_configuration(
+        self, make_app: MakeApp
+    ) -> None:
+        app = make_app(
+            UploadSet("files"), UPLOADED_FILES_DEST="/uploads",
+            UPLOADED_FILES_CONTENT_HASH="blake2b")
+        config = app.upload_set_config["files"]  # type: ignore
+        assert config.content_hash == "blake2b"
+
+    def test_unknown_algorithms_are_rejected(self) -> None:
+        with pytest.raises(ValueError):
+            UploadConfiguration("/uploads", content_hash="md42")
+
+
+class TestContentAddressedSaving:
+    def test_files_are_stored_under_their_digest(
+        self, tmp_path: Path, files: UploadSet, make_storage: MakeStorage
+    ) -> None:
+        assert files.save(make_storage("report.PDF", PAYLOAD)) == NAME
+        assert Path(files.path(NAME)).read_bytes() == PAYLOAD
+        assert os.listdir(tmp_path) == [DIGEST[:2]]
+
+    def test_duplicates_are_not_written_again(
+        self, tmp_path: Path, files: UploadSet, make_storage: MakeStorage
+    ) -> None:
+        assert files.save(make_storage("report.PDF", PAYLOAD)) == NAME
+        with patch("os.replace") as replace:
+            assert files.save(make_storage("copy.pdf", PAYLOAD)) == NAME
+        replace.assert_not_called()
+        assert os.listdir(tmp_path / DIGEST[:2] / DIGEST[2:4]) == [
+            DIGEST + ".pdf"]
+
+    def test_folders_and_files_without_extension(
+        self, files: UploadSet, make_storage: MakeStorage
+    ) -> None:
+        digest = hashlib.sha256(b"").hexdigest()
+        assert files.save(make_storage("blob", b""), folder="someguy") == (
+            "someguy/%s/%s/%s" % (digest[:2], digest[2:4], digest))
+
+    def test_names_cannot_be_given(
+        self, files: UploadSet, make_storage: MakeStorage
+    ) -> None:
+        with pytest.raises(ValueError):
+            files.save(make_storage("report.PDF"), name="report.pdf")
+
+    def test_max_size_is_enforced(
+        self, tmp_path: Path, make_set: MakeSet
+    ) -> None:
+        uset = make_set(content_hash="sha256", max_size=1000)
+        with pytest.raises(UploadNotAllowed):
+            uset.save(FileStorage(io.BufferedReader(io.BytesIO(PAYLOAD)),
+                                  filename="report.pdf"))
+        assert os.listdir(tmp_path) == []
+
+    def test_named_temporary_files_are_linked(
+        self, tmp_path: Path, make_set: MakeSet
+    ) -> None:
+        destination = tmp_path / "uploads"
+        destination.mkdir()
+        uset = make_set(destination, content_hash="sha256")
+        with tempfile.NamedTemporaryFile(dir=tmp_path) as stream:
+            stream.write(PAYLOAD)
+            stream.seek(0)
+            assert uset.save(FileStorage(stream, "report.pdf")) == NAME
+            assert os.path.samestat(
+                os.stat(uset.path(NAME)), os.fstat(stream.fileno()))
+
+    def test_save_many(
+        self, files: UploadSet, make_storage: MakeStorage
+    ) -> None:
+        results = files.save_many([
+            make_storage("report.PDF", PAYLOAD),
+            make_storage("report.pdf", PAYLOAD)])
+        assert [result.name for result in results] == [NAME, NAME]
@@ -0,0 +1,84 @@
+from collections.abc import Iterable
+from typing import cast
+
+import pytest
+from flask_uploads import ALL
+from flask_uploads import DEFAULTS
+from flask_uploads import IMAGES
+from flask_uploads import SCRIPTS
+from flask_uploads import AllExcept
+from flask_uploads import ExtensionPolicy
+from flask_uploads import UploadConfiguration
+from flask_uploads import UploadSet
+
+from .conftest import MakeApp
+
+
+class Odd:
+    """a custom container which cannot be compiled"""
+    def __contains__(self, item: str) -> bool:
+        return len(item) % 2 == 1
+
+
+EXTENSIONS = [
+    DEFAULTS,
+    list(IMAGES),
+    ALL,
+    AllExcept(SCRIPTS),
+    AllExcept("php"),
+    "png",
+    "",
+    cast(Iterable[str], Odd()),
+]
+CHECKED = ("txt", "jpg", "png", "php", "py", "exe", "", "p", "g")
+
+
+class TestExtensionPolicy:
+    @pytest.mark.parametrize("extensions", EXTENSIONS)
+    @pytest.mark.parametrize("allow,deny", [
+        ((), ()),
+        (("exe",), ("jpg", "py")),
+        (("php",), ("php", "txt")),
+    ])
+    def test_policy_matches_the_uncompiled_check(
+        self,
+        extensions: Iterable[str],
+        allow: tuple[str, ...],
+        deny: tuple[str, ...]
+    ) -> None:
+        policy = ExtensionPolicy(extensions, allow, deny)
+        for ext in CHECKED:
+            expected = (ext in allow) or (
+                ext in extensions and ext not in deny)
+            assert (ext in policy) is expected, ext
+
+    def test_configure_uploads_compiles_the_policy(
+        self, make_app: MakeApp
+    ) -> None:
+        photos = UploadSet("photos", IMAGES)
+        app = make_app(
+            photos, UPLOADED_PHOTOS_DEST="/uploads",
+            UPLOADED_PHOTOS_ALLOW=("tiff",))
+        config = app.upload_set_config["photos"]  # type: ignore
+        policy = config.policy
+        assert policy.extensions is IMAGES
+        assert "tiff" in policy
+        with app.app_context():
+            assert photos.extension_allowed("tiff")
+            assert not photos.extension_allowed("exe")
+        assert config.policy is policy
+
+    def test_policy_is_compiled_for_manual_configurations(self) -> None:
+        uset = UploadSet("files")
+        uset._config = UploadConfiguration("/uploads", deny=("txt",))
+        assert not uset.extension_allowed("txt")
+        policy = uset._config.policy
+        assert policy is not None
+        assert uset.extension_allowed("jpg")
+        assert uset._config.policy is policy
+
+        # a configuration shared with another set gets the right policy
+        photos = UploadSet("photos", IMAGES)
+        photos._config = uset._config
+        assert not photos.extension_allowed("pdf")
+        assert uset.extension_allowed("pdf")
@@ -0,0 +1,70 @@
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from flask_uploads import ALL
+from flask_uploads import UploadSet
+from flask_uploads import extension
+from flask_uploads import lowercase_ext
+from flask_uploads.caching import LRUCache
+from flask_uploads.filenames import Filename
+from flask_uploads.filenames import normalize_filename
+from werkzeug.utils import secure_filename
+
+from .conftest import MakeApp
+from .conftest import MakeStorage
+
+FILENAMES = [
+    "image.jpg", "IMAGE.JPG", "blob", "archive.tar.GZ", "My Photo.PNG",
+    "../../etc/passwd", ".bashrc", "photo.", "photo. ", "über.gif", "...",
+    "", "a..b", "._x.Txt", "C:\\Windows\\x.EXE", "name.v2.", "x/y/z.Md",
+]
+
+
+class TestFilenames:
+    @pytest.mark.parametrize("filename", FILENAMES)
+    def test_normalize_filename(self, filename: str) -> None:
+        normalized = normalize_filename(filename)
+        sanitized = secure_filename(filename)
+        assert normalized.name == sanitized
+        assert normalized.basename == lowercase_ext(sanitized)
+        assert normalized.ext == extension(lowercase_ext(sanitized))
+        assert normalized.dotted == filename.rstrip().endswith(".")
+
+    def test_parts(self) -> None:
+        assert normalize_filename("Archive.Tar.GZ") == Filename(
+            "Archive.Tar.GZ", "Archive.Tar", "gz", False)
+        assert normalize_filename("photo_123.") == Filename(
+            "photo_123", "photo_123", "", True)
+
+    def test_cache(self) -> None:
+        cache: LRUCache[Filename] = LRUCache(2)
+        first = normalize_filename("image.jpg", cache)
+        with patch("flask_uploads.filenames.secure_filename") as spy:
+            assert normalize_filename("image.jpg", cache) is first
+        assert spy.call_count == 0
+        normalize_filename("a.png", cache)
+        normalize_filename("b.png", cache)
+        assert "image.jpg" not in cache
+
+
+class TestSavingWithNames:
+    @pytest.mark.parametrize("name, saved", [
+        ("Photo.V2.", "Photo.V2.jpg"),
+        ("Photo.V2.TXT", "Photo.V2.txt"),
+        ("users/../Photo.", "users/Photo.jpg"),
+        # nothing is left of the name, so the name of the upload is used
+        ("users/...", "users/Holiday.jpg"),
+    ])
+    def test_save_with_names(
+        self,
+        tmp_path: Path,
+        name: str,
+        saved: str,
+        make_app: MakeApp,
+        make_storage: MakeStorage
+    ) -> None:
+        files = UploadSet("files", ALL)
+        app = make_app(files, UPLOADED_FILES_DEST=str(tmp_path))
+        storage = make_storage("Holiday.JPG")
+        assert files.bind(app).save(storage, name=name) == saved
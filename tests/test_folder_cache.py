@@ -0,0 +1,100 @@
+import os
+import shutil
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from flask_uploads import UploadConfiguration
+
+from .conftest import MakeSet
+from .conftest import MakeStorage
+
+
+class TestConfigurationCache:
+    def test_real_destination_is_cached(self, tmp_path: Path) -> None:
+        (tmp_path / "real").mkdir()
+        (tmp_path / "link").symlink_to(tmp_path / "real")
+        config = UploadConfiguration(str(tmp_path / "link"))
+        assert config.real_destination == str(tmp_path / "real")
+        with patch("os.path.realpath") as realpath:
+            assert config.real_destination == str(tmp_path / "real")
+        realpath.assert_not_called()
+
+        config.destination = str(tmp_path)
+        config.invalidate()
+        assert config.real_destination == os.path.realpath(tmp_path)
+
+    def test_invalidate_a_single_folder(self, tmp_path: Path) -> None:
+        config = UploadConfiguration(str(tmp_path))
+        config.ensure_folder(str(tmp_path / "a"))
+        config.ensure_folder(str(tmp_path / "b"))
+        config.invalidate(str(tmp_path / "a"))
+        with patch("os.makedirs") as makedirs:
+            config.ensure_folder(str(tmp_path / "b"))
+            makedirs.assert_not_called()
+            (tmp_path / "a").rmdir()
+            config.ensure_folder(str(tmp_path / "a"))
+            makedirs.assert_called_once_with(
+                str(tmp_path / "a"), exist_ok=True)
+
+
+class TestSavingToCachedFolders:
+    def test_folders_are_created_once(
+        self, tmp_path: Path, make_set: MakeSet, make_storage: MakeStorage
+    ) -> None:
+        uset = make_set(tmp_path / "uploads")
+        uset.save(make_storage(), folder="someguy")
+        folder = str(tmp_path / "uploads" / "someguy")
+        with patch("os.makedirs") as makedirs:
+            with patch("os.path.exists", return_value=False) as exists:
+                uset.save(make_storage("bar.txt"), folder="someguy")
+        makedirs.assert_not_called()
+        assert folder not in [call.args[0] for call in exists.call_args_list]
+
+    @pytest.mark.parametrize("options", [
+        {}, dict(atomic_save=True), dict(reserve_names=True),
+        dict(sharding="hash:2"),
+    ])
+    def test_removed_folders_are_recreated(
+        self,
+        tmp_path: Path,
+        make_set: MakeSet,
+        make_storage: MakeStorage,
+        options: dict[str, object]
+    ) -> None:
+        uset = make_set(tmp_path / "uploads", **options)
+        uset.save(make_storage(), folder="someguy")
+        shutil.rmtree(tmp_path / "uploads" / "someguy")
+
+        assert uset.save(make_storage(), folder="someguy") == (
+            "someguy/foo.txt")
+        assert uset.save(make_storage(), folder="someguy") == (
+            "someguy/foo_1.txt")
+        assert os.path.exists(uset.path("foo_1.txt", folder="someguy"))
+
+    def test_folders_removed_again_are_reported(
+        self, tmp_path: Path, make_set: MakeSet, make_storage: MakeStorage
+    ) -> None:
+        uset = make_set(tmp_path / "uploads")
+        uset.save(make_storage(), folder="someguy")
+        folder = str(tmp_path / "uploads" / "someguy")
+        # a third attempt would raise StopIteration instead of looping
+        errors = [FileNotFoundError(), FileNotFoundError()]
+        with patch.object(UploadConfiguration, "ensure_folder") as ensure:
+            with patch.object(uset, "_store", side_effect=errors) as store:
+                with pytest.raises(FileNotFoundError):
+                    uset.save(make_storage("bar.txt"), folder="someguy")
+        assert store.call_count == 2
+        assert ensure.call_args_list[-1].args == (folder,)
+
+    def test_unseekable_streams_are_not_saved_twice(
+        self, make_set: MakeSet, make_storage: MakeStorage
+    ) -> None:
+        uset = make_set()
+        upload = make_storage()
+        with patch.object(upload.stream, "seekable", return_value=False):
+            with patch.object(uset, "_store",
+                              side_effect=FileNotFoundError) as store:
+                with pytest.raises(FileNotFoundError):
+                    uset.save(upload, folder="someguy")
+        assert store.call_count == 1
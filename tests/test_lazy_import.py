@@ -0,0 +1,51 @@
+import os
+import subprocess  # nosec B404 - only runs this interpreter
+import sys
+
+import flask_uploads
+import pytest
+from flask import Blueprint
+from flask_uploads import chunked
+from flask_uploads import flask_uploads as core
+
+
+def imported_after(statement: str) -> set[str]:
+    """This returns the modules imported by `statement` in a new process."""
+    code = "import sys; %s; print(' '.join(sys.modules))" % statement
+    output = subprocess.run(  # nosec B603 - a fixed command without a shell
+        [sys.executable, "-c", code], check=True, capture_output=True,
+        text=True,
+        env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))).stdout
+    return set(output.split())
+
+
+def test_extension_sets_do_not_import_flask() -> None:
+    modules = imported_after("from flask_uploads import IMAGES")
+    assert "flask_uploads.extensions" in modules
+    assert "flask" not in modules
+    assert "werkzeug" not in modules
+
+
+def test_helpers_are_only_imported_when_used() -> None:
+    modules = imported_after(
+        "from flask_uploads import UploadSet, configure_uploads")
+    assert "flask" in modules
+    assert "flask_uploads.test_helper" not in modules
+    assert "flask_uploads.chunked" not in modules
+    assert "asyncio" not in modules
+
+
+def test_all_names_can_be_imported() -> None:
+    for name in flask_uploads.__all__:
+        assert getattr(flask_uploads, name) is not None
+    assert set(flask_uploads.__all__) <= set(dir(flask_uploads))
+    with pytest.raises(AttributeError):
+        flask_uploads.missing
+
+
+def test_blueprints_are_created_once() -> None:
+    assert isinstance(core.uploads_blueprint(), Blueprint)
+    assert core.uploads_mod is core.uploads_blueprint()
+    assert chunked.chunked_blueprint() is chunked.chunked_blueprint()
+    with pytest.raises(AttributeError):
+        core.missing
@@ -0,0 +1,106 @@
+import io
+import os
+import tempfile
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from flask_uploads import UploadConfiguration
+from flask_uploads import UploadNotAllowed
+from flask_uploads import UploadSet
+from werkzeug.datastructures import FileStorage
+
+from .conftest import MakeApp
+from .conftest import MakeSet
+
+PAYLOAD = os.urandom(100_000)
+
+
+class UnknownLength(io.BytesIO):
+    """a stream which does not tell its size up front"""
+
+
+class TestConfiguration:
+    def test_max_size_is_read_from_the_configuration(
+        self, make_app: MakeApp
+    ) -> None:
+        app = make_app(
+            UploadSet("files"), UPLOADED_FILES_DEST="/uploads",
+            UPLOADED_FILES_MAX_SIZE=1024)
+        assert app.upload_set_config["files"].max_size == 1024  # type: ignore
+
+    def test_max_size_must_not_be_negative(self) -> None:
+        with pytest.raises(ValueError):
+            UploadConfiguration("/uploads", max_size=-1)
+
+
+class TestMaxSize:
+    def test_uploads_within_the_limit_are_saved(
+        self, tmp_path: Path, make_set: MakeSet
+    ) -> None:
+        uset = make_set(max_size=len(PAYLOAD))
+        storage = FileStorage(UnknownLength(PAYLOAD), "a.bin")
+        assert uset.save(storage) == "a.bin"
+        assert (tmp_path / "a.bin").read_bytes() == PAYLOAD
+
+    def test_content_length_is_checked_up_front(
+        self, make_set: MakeSet
+    ) -> None:
+        uset = make_set(max_size=1000)
+        storage = FileStorage(
+            UnknownLength(PAYLOAD), "a.bin", content_length=len(PAYLOAD))
+        with patch("os.makedirs") as makedirs:
+            with pytest.raises(UploadNotAllowed, match="1000 bytes"):
+                uset.save(storage)
+        makedirs.assert_not_called()
+        assert storage.stream.tell() == 0
+
+    def test_files_on_disk_are_checked_up_front(
+        self, tmp_path: Path, make_set: MakeSet
+    ) -> None:
+        uset = make_set(tmp_path / "uploads", max_size=1000)
+        with tempfile.TemporaryFile() as stream:
+            stream.write(PAYLOAD)
+            stream.seek(0)
+            with pytest.raises(UploadNotAllowed):
+                uset.save(FileStorage(stream, "a.bin"))
+        assert not (tmp_path / "uploads").exists()
+
+    def test_copy_is_aborted_once_the_limit_is_exceeded(
+        self, tmp_path: Path, make_set: MakeSet
+    ) -> None:
+        uset = make_set(max_size=1000, reserve_names=True)
+        stream = UnknownLength(PAYLOAD)
+        with pytest.raises(UploadNotAllowed):
+            uset.save(FileStorage(stream, "a.bin"))
+        assert stream.tell() < len(PAYLOAD)
+        assert os.listdir(tmp_path) == []
+
+    def test_kernel_copy_is_aborted_once_the_limit_is_exceeded(
+        self, tmp_path: Path, make_set: MakeSet
+    ) -> None:
+        uset = make_set(max_size=1000)
+        with tempfile.TemporaryFile() as stream:
+            stream.write(PAYLOAD)
+            stream.seek(0)
+            storage = FileStorage(stream, "a.bin")
+            with patch("flask_uploads.flask_uploads.remaining_size",
+                       return_value=None):
+                with pytest.raises(UploadNotAllowed):
+                    uset.save(storage)
+        assert os.listdir(tmp_path) == []
+
+    def test_linked_files_are_checked(
+        self, tmp_path: Path, make_set: MakeSet
+    ) -> None:
+        destination = tmp_path / "uploads"
+        destination.mkdir()
+        uset = make_set(destination, max_size=1000)
+        with tempfile.NamedTemporaryFile(dir=tmp_path) as stream:
+            stream.write(PAYLOAD)
+            stream.seek(0)
+            with patch("flask_uploads.flask_uploads.remaining_size",
+                       return_value=None):
+                with pytest.raises(UploadNotAllowed):
+                    uset.save(FileStorage(stream, "a.bin"))
+        assert os.listdir(destination) == []
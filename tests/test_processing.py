@@ -0,0 +1,216 @@
+import functools
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+from flask import current_app
+from flask_uploads import ALL
+from flask_uploads import MemoryBackend
+from flask_uploads import UploadSet
+from flask_uploads.processing import ExecutorQueue
+from flask_uploads.processing import Job
+from flask_uploads.processing import ProcessingQueue
+from flask_uploads.processing import ThreadQueue
+from flask_uploads.processing import default_queue
+
+from .conftest import MakeApp
+from .conftest import MakeStorage
+
+DATA = b"x" * 100_000
+
+
+def checksum(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+@pytest.fixture
+def report(make_storage: MakeStorage) -> MakeStorage:
+    return functools.partial(make_storage, "report.pdf", DATA)
+
+
+class TestQueues:
+    def test_bounded_queue_blocks(self) -> None:
+        started = threading.Event()
+        release = threading.Event()
+
+        def block(path: str) -> bool:
+            started.set()
+            return release.wait(5)
+
+        queue = ThreadQueue(workers=1, maxsize=1)
+        futures = [queue.submit(block, "a")]
+        futures.append(queue.submit(lambda path: path, "b"))
+        assert started.wait(5)
+        submitted = threading.Event()
+
+        def submit() -> None:
+            futures.append(queue.submit(lambda path: path, "c"))
+            submitted.set()
+
+        thread = threading.Thread(target=submit)
+        thread.start()
+        # the worker is busy and the queue is full
+        assert not submitted.wait(0.2)
+        assert futures[1].cancel()
+        release.set()
+        thread.join(5)
+        assert futures[0].result(5) is True
+        assert futures[2].result(5) == "c"
+        assert Job("scan", "b", futures[1]).status == Job.CANCELLED
+        queue.shutdown()
+
+    @pytest.mark.filterwarnings(
+        "ignore::pytest.PytestUnhandledThreadExceptionWarning")
+    def test_workers_are_replaced_after_exiting(self) -> None:
+        def exit(path: str) -> None:
+            raise SystemExit(path)
+
+        queue = ThreadQueue(workers=1)
+        future = queue.submit(exit, "a")
+        assert isinstance(future.exception(5), SystemExit)
+        queue._threads[0].join(5)
+        assert queue.submit(lambda path: path, "b").result(5) == "b"
+        queue.shutdown()
+
+    def test_queue_interface(self) -> None:
+        with pytest.raises(NotImplementedError):
+            ProcessingQueue().submit(checksum, "a")
+        with pytest.raises(ValueError):
+            ThreadQueue(workers=0)
+
+
+class TestProcessing:
+    def test_processors_see_the_complete_file(
+        self, tmp_path: Path, make_app: MakeApp, report: MakeStorage
+    ) -> None:
+        queue = ThreadQueue()
+        files = UploadSet("files", ALL, processing_queue=queue)
+        files.processor(checksum)
+        app = make_app(files, UPLOADS_DEFAULT_DEST=str(tmp_path),
+                       UPLOADED_FILES_SHARDING="hash:2")
+        with app.app_context():
+            name = files.save(report(), folder="docs")
+            jobs = files.jobs(name)
+        assert [job.processor for job in jobs] == ["checksum"]
+        assert jobs[0].name == "docs/report.pdf"
+        assert jobs[0].result(5) == hashlib.sha256(DATA).hexdigest()
+        assert jobs[0].status == Job.DONE
+        queue.shutdown()
+
+    def test_save_does_not_wait_for_processors(
+        self, tmp_path: Path, make_app: MakeApp, report: MakeStorage
+    ) -> None:
+        started = threading.Event()
+        release = threading.Event()
+        files = UploadSet("files", ALL, processing_queue=ThreadQueue(1))
+
+        @files.processor
+        def slow(path: str) -> None:
+            started.set()
+            release.wait(5)
+
+        app = make_app(files, UPLOADS_DEFAULT_DEST=str(tmp_path))
+        with app.app_context():
+            first = files.save(report())
+            second = files.save(report())
+        running, = files.jobs(first)
+        pending, = files.jobs(second)
+        assert started.wait(5)
+        assert running.status == Job.RUNNING
+        assert pending.status == Job.PENDING
+        assert repr(pending) == "<Job slow 'report_1.pdf' pending>"
+        release.set()
+        pending.result(5)
+        assert running.status == pending.status == Job.DONE
+
+    def test_failed_jobs(
+        self, tmp_path: Path, make_app: MakeApp, report: MakeStorage
+    ) -> None:
+        queue = ThreadQueue()
+        files = UploadSet("files", ALL, processing_queue=queue)
+
+        @files.processor
+        def scan(path: str) -> None:
+            raise ValueError("virus found")
+
+        app = make_app(files, UPLOADS_DEFAULT_DEST=str(tmp_path))
+        with app.app_context():
+            job, = files.jobs(files.save(report()))
+        with pytest.raises(ValueError):
+            job.result(5)
+        assert job.status == Job.FAILED
+        queue.shutdown()
+
+    def test_processors_run_in_the_application_context(
+        self, tmp_path: Path, make_app: MakeApp, report: MakeStorage
+    ) -> None:
+        files = UploadSet("files", ALL, processing_queue=ThreadQueue())
+        files.processor(lambda path: current_app.name)
+        app = make_app(files, UPLOADS_DEFAULT_DEST=str(tmp_path))
+        with app.app_context():
+            job, = files.jobs(files.save(report()))
+        assert job.result(5) == app.name
+
+    def test_executor_queue(
+        self, tmp_path: Path, make_app: MakeApp, report: MakeStorage
+    ) -> None:
+        with ProcessPoolExecutor(1) as executor:
+            files = UploadSet(
+                "files", ALL, processing_queue=ExecutorQueue(executor))
+            files.processor(checksum)
+            app = make_app(files, UPLOADS_DEFAULT_DEST=str(tmp_path))
+            with app.app_context():
+                results = files.save_many([report(), report()])
+                names = [str(result.name) for result in results]
+                assert names == ["report.pdf", "report_1.pdf"]
+                for name in names:
+                    job, = files.jobs(name)
+                    assert job.result(30) == hashlib.sha256(DATA).hexdigest()
+
+    def test_process_again(
+        self, tmp_path: Path, make_app: MakeApp, report: MakeStorage
+    ) -> None:
+        with ThreadPoolExecutor(1) as executor:
+            files = UploadSet(
+                "files", ALL, processing_queue=ExecutorQueue(executor))
+            app = make_app(files, UPLOADS_DEFAULT_DEST=str(tmp_path))
+            with app.app_context():
+                name = files.save(report())
+                assert files.jobs(name) == []
+                files.processor(checksum)
+                files.processor(len)
+                jobs = files.process(name)
+                assert files.jobs(name) == jobs
+            assert [job.processor for job in jobs] == ["checksum", "len"]
+            assert jobs[1].result(5) == len(str(tmp_path / "files" / name))
+
+    def test_processors_need_local_files(
+        self, tmp_path: Path, make_app: MakeApp, report: MakeStorage
+    ) -> None:
+        files = UploadSet("files", ALL)
+        files.processor(checksum)
+        app = make_app(files, UPLOADS_DEFAULT_DEST=str(tmp_path),
+                       UPLOADED_FILES_BACKEND=MemoryBackend())
+        with app.app_context():
+            with pytest.raises(RuntimeError):
+                files.save(report())
+            with pytest.raises(RuntimeError):
+                files.save_many([report()])
+            with pytest.raises(RuntimeError):
+                files.process("report.pdf")
+            assert not files.exists("report.pdf")
+
+    def test_default_queue(
+        self, tmp_path: Path, make_app: MakeApp, report: MakeStorage
+    ) -> None:
+        files = UploadSet("files", ALL)
+        files.processor(checksum)
+        app = make_app(files, UPLOADS_DEFAULT_DEST=str(tmp_path))
+        with app.app_context():
+            job, = files.jobs(files.save(report()))
+        assert job.result(5) == hashlib.sha256(DATA).hexdigest()
+        assert default_queue() is default_queue()
@@ -0,0 +1,86 @@
+import os
+import threading
+from pathlib import Path
+
+import pytest
+from flask_uploads import ALL
+from flask_uploads import MemoryConflictIndex
+from flask_uploads import TestingFileStorage
+from flask_uploads import UploadConfiguration
+from flask_uploads import UploadSet
+
+from .conftest import MakeApp
+from .conftest import MakeSet
+from .conftest import MakeStorage
+
+
+@pytest.fixture
+def files(make_set: MakeSet) -> UploadSet:
+    return make_set(reserve_names=True)
+
+
+class TestConfiguration:
+    def test_reserve_names_is_read_from_the_configuration(
+        self, make_app: MakeApp
+    ) -> None:
+        app = make_app(
+            UploadSet("files"), UPLOADED_FILES_DEST="/uploads",
+            UPLOADED_FILES_RESERVE_NAMES=True)
+        assert app.upload_set_config["files"].reserve_names  # type: ignore
+
+    def test_reserve_names_is_off_by_default(self) -> None:
+        assert not UploadConfiguration("/uploads").reserve_names
+
+
+class TestReservation:
+    def test_reserve_name_claims_the_file(self, tmp_path: Path) -> None:
+        uset = UploadSet("files", ALL)
+        assert uset.reserve_name(str(tmp_path), "foo.txt") == "foo.txt"
+        assert (tmp_path / "foo.txt").exists()
+        assert uset.reserve_name(str(tmp_path), "foo.txt") == "foo_1.txt"
+        assert (tmp_path / "foo_1.txt").exists()
+
+    def test_save_with_reserved_names(
+        self, tmp_path: Path, make_storage: MakeStorage, files: UploadSet
+    ) -> None:
+        (tmp_path / "foo.txt").write_bytes(b"old")
+        assert files.save(make_storage(data=b"new")) == "foo_1.txt"
+        assert (tmp_path / "foo.txt").read_bytes() == b"old"
+        assert (tmp_path / "foo_1.txt").read_bytes() == b"new"
+
+    def test_failed_save_releases_the_name(
+        self, tmp_path: Path, files: UploadSet
+    ) -> None:
+        class BrokenStorage(TestingFileStorage):
+            def save(  # type: ignore
+                self, dst: str, buffer_size: int = 16384
+            ) -> None:
+                raise OSError("disk full")
+
+        with pytest.raises(OSError):
+            files.save(BrokenStorage(filename="foo.txt"))
+        assert os.listdir(tmp_path) == []
+
+    def test_concurrent_saves_never_overwrite_each_other(
+        self, tmp_path: Path, make_storage: MakeStorage
+    ) -> None:
+        uset = UploadSet("files", ALL, conflict_index=MemoryConflictIndex())
+        uset._config = UploadConfiguration(str(tmp_path), reserve_names=True)
+        barrier = threading.Barrier(8)
+        results = []
+
+        def upload(n: int) -> None:
+            storage = make_storage("photo.jpg", b"%d" % n)
+            barrier.wait()
+            results.append(uset.save(storage))
+
+        threads = [
+            threading.Thread(target=upload, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(set(results)) == 8
+        contents = {(tmp_path / name).read_bytes() for name in results}
+        assert contents == {b"%d" % n for n in range(8)}
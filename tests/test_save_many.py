@@ -0,0 +1,162 @@
+import io
+import os
+from pathlib import Path
+
+import pytest
+from flask_uploads import IMAGES
+from flask_uploads import MemoryConflictIndex
+from flask_uploads import SaveResult
+from flask_uploads import TestingFileStorage
+from flask_uploads import UploadConfiguration
+from flask_uploads import UploadNotAllowed
+from flask_uploads import UploadSet
+from werkzeug.datastructures import FileStorage
+
+from .conftest import MakeApp
+from .conftest import MakeSet
+from .conftest import MakeStorage
+
+
+@pytest.fixture
+def photos(make_set: MakeSet) -> UploadSet:
+    return make_set(extensions=IMAGES, name="photos")
+
+
+class TestSaveMany:
+    def test_save_many(
+        self, tmp_path: Path, photos: UploadSet, make_storage: MakeStorage
+    ) -> None:
+        results = photos.save_many(
+            [make_storage("a.jpg", b"a"), make_storage("b.png", b"b")],
+            folder="gallery")
+        assert [result.name for result in results] == [
+            "gallery/a.jpg", "gallery/b.png"]
+        assert all(result.ok for result in results)
+        assert (tmp_path / "gallery" / "a.jpg").read_bytes() == b"a"
+        assert (tmp_path / "gallery" / "b.png").read_bytes() == b"b"
+
+    def test_conflicts_are_resolved_within_the_batch(
+        self, tmp_path: Path, photos: UploadSet, make_storage: MakeStorage
+    ) -> None:
+        (tmp_path / "photo.jpg").write_bytes(b"old")
+        (tmp_path / "photo_2.jpg").write_bytes(b"old")
+        results = photos.save_many(
+            [make_storage("photo.jpg", b"%d" % n) for n in range(3)])
+        assert [result.name for result in results] == [
+            "photo_1.jpg", "photo_3.jpg", "photo_4.jpg"]
+        assert (tmp_path / "photo_4.jpg").read_bytes() == b"2"
+        assert (tmp_path / "photo.jpg").read_bytes() == b"old"
+
+    def test_conflicts_use_the_index(
+        self, tmp_path: Path, make_set: MakeSet, make_storage: MakeStorage
+    ) -> None:
+        uset = make_set(extensions=IMAGES)
+        uset.conflict_index = MemoryConflictIndex()
+        uset.save(make_storage("photo.jpg"))
+        uset.save(make_storage("photo.jpg"))
+        (tmp_path / "photo_1.jpg").unlink()
+        results = uset.save_many([make_storage("photo.jpg")])
+        assert results[0].name == "photo_2.jpg"
+        assert uset.save(make_storage("photo.jpg")) == "photo_3.jpg"
+
+    def test_conflicts_use_an_overridden_resolve_conflict(
+        self, tmp_path: Path, make_storage: MakeStorage
+    ) -> None:
+        class RenamingSet(UploadSet):
+            def resolve_conflict(
+                self, target_folder: str, basename: str
+            ) -> str:
+                stem, ext = os.path.splitext(basename)
+                return "%s-new%s" % (stem, ext)
+
+        uset = RenamingSet("photos", IMAGES)
+        uset._config = UploadConfiguration(str(tmp_path))
+        (tmp_path / "photo.jpg").write_bytes(b"old")
+        results = uset.save_many(
+            [make_storage("photo.jpg", b"%d" % n) for n in range(2)])
+        assert [result.name for result in results] == [
+            "photo-new.jpg", "photo-new_1.jpg"]
+
+    def test_checks_containment_of_sharded_files(
+        self, tmp_path: Path, make_set: MakeSet, make_storage: MakeStorage
+    ) -> None:
+        outside = tmp_path / "outside"
+        outside.mkdir()
+        destination = tmp_path / "uploads"
+        uset = make_set(destination, IMAGES, "photos", sharding="hash:2")
+        shard = os.path.dirname(uset.path("a.jpg"))
+        destination.mkdir()
+        os.symlink(outside, shard)
+        results = uset.save_many(
+            [make_storage("a.jpg"), make_storage("b.jpg")])
+        assert isinstance(results[0].error, ValueError)
+        assert results[1].name == "b.jpg"
+        assert list(outside.iterdir()) == []
+
+    def test_checks_containment(
+        self, tmp_path: Path, make_set: MakeSet, make_storage: MakeStorage
+    ) -> None:
+        outside = tmp_path / "outside"
+        outside.mkdir()
+        destination = tmp_path / "uploads"
+        destination.mkdir()
+        (destination / "link").symlink_to(outside)
+        uset = make_set(destination, IMAGES, "photos")
+        with pytest.raises(ValueError, match="Path traversal"):
+            uset.save_many([make_storage("a.jpg")], folder="link")
+
+    def test_in_app_context(
+        self, tmp_path: Path, make_app: MakeApp, make_storage: MakeStorage
+    ) -> None:
+        photos = UploadSet("photos", IMAGES)
+        app = make_app(photos, UPLOADED_PHOTOS_DEST=str(tmp_path))
+        with app.app_context():
+            results = photos.save_many([make_storage("a.jpg")])
+        assert results[0].name == "a.jpg"
+
+
+class TestSaveResults:
+    def test_errors_are_reported_per_file(
+        self, photos: UploadSet, make_storage: MakeStorage
+    ) -> None:
+        results = photos.save_many([
+            make_storage("virus.exe"),
+            TestingFileStorage(),
+            make_storage("ok.jpg"),
+        ])
+        assert isinstance(results[0].error, UploadNotAllowed)
+        assert isinstance(results[1].error, ValueError)
+        assert results[2].name == "ok.jpg"
+        assert [result.ok for result in results] == [False, False, True]
+        assert "virus.exe" in repr(results[0])
+
+    def test_write_errors_are_reported(
+        self, tmp_path: Path, make_set: MakeSet, make_storage: MakeStorage
+    ) -> None:
+        class BrokenStorage(FileStorage):
+            def save(  # type: ignore
+                self, dst: str, buffer_size: int = 16384
+            ) -> None:
+                raise OSError("disk full")
+
+        uset = make_set(extensions=IMAGES, reserve_names=True)
+        results = uset.save_many([
+            BrokenStorage(io.BytesIO(), filename="a.jpg"),
+            make_storage("b.jpg")])
+        assert isinstance(results[0].error, OSError)
+        assert results[1].name == "b.jpg"
+        assert sorted(p.name for p in tmp_path.iterdir()) == ["b.jpg"]
+
+    def test_nothing_is_touched_without_valid_files(
+        self, tmp_path: Path, make_set: MakeSet, make_storage: MakeStorage
+    ) -> None:
+        uset = make_set(tmp_path / "missing", IMAGES)
+        results = uset.save_many([make_storage("virus.exe")])
+        assert not results[0].ok
+        assert not (tmp_path / "missing").exists()
+
+    def test_defaults(self) -> None:
+        result = SaveResult(TestingFileStorage(filename="a.jpg"))
+        assert result.name is None
+        assert result.error is None
+        assert not result.ok
@@ -0,0 +1,180 @@
+import hashlib
+import io
+from collections.abc import Callable
+from pathlib import Path
+from typing import IO
+
+import pytest
+from flask.testing import FlaskClient
+from flask_uploads import ALL
+from flask_uploads import MemoryBackend
+from flask_uploads import UploadConfiguration
+from flask_uploads import UploadSet
+
+from .conftest import MakeApp
+from .conftest import MakeStorage
+
+DATA = bytes(range(256)) * 4
+MakeClient = Callable[..., FlaskClient]
+
+
+@pytest.fixture
+def media() -> UploadSet:
+    return UploadSet("media", ALL)
+
+
+@pytest.fixture
+def make_client(
+    tmp_path: Path, media: UploadSet, make_app: MakeApp
+) -> MakeClient:
+    """
+    This returns a factory for test clients of applications which serve
+    `media` with a clip in it.
+    """
+    def make_client(**config: object) -> FlaskClient:
+        app = make_app(
+            media, UPLOADS_AUTOSERVE=True, UPLOADED_MEDIA_DEST=str(tmp_path),
+            **config)
+        (tmp_path / "clip.mp4").write_bytes(DATA)
+        return app.test_client()
+    return make_client
+
+
+class TestConfiguration:
+    def test_serving_options_are_read_from_the_configuration(
+        self, make_app: MakeApp
+    ) -> None:
+        app = make_app(
+            UploadSet("files"), UPLOADED_FILES_DEST="/uploads",
+            UPLOADED_FILES_ACCEL_REDIRECT="/protected/",
+            UPLOADED_FILES_CACHE_MAX_AGE=60)
+        config = app.upload_set_config["files"]  # type: ignore
+        assert config.accel_redirect == "/protected/"
+        assert config.cache_max_age == 60
+        assert not config.sendfile
+        assert not config.plain_serving
+
+    @pytest.mark.parametrize("options", [
+        dict(sendfile=True, backend=MemoryBackend()),
+        dict(sendfile=True, accel_redirect="/protected/"),
+        dict(cache_max_age=-1),
+    ])
+    def test_invalid_serving_options(self, options: dict[str, object]) -> None:
+        with pytest.raises(ValueError):
+            UploadConfiguration("/uploads", **options)  # type: ignore
+
+    def test_plain_serving_by_default(self) -> None:
+        assert UploadConfiguration("/uploads").plain_serving
+
+
+class TestServing:
+    def test_strong_etags_and_ranges(self, make_client: MakeClient) -> None:
+        client = make_client(UPLOADED_MEDIA_CACHE_MAX_AGE=3600)
+        response = client.get("/_uploads/media/clip.mp4")
+        assert response.status_code == 200
+        assert response.data == DATA
+        assert response.mimetype == "video/mp4"
+        assert response.headers["Cache-Control"] == "public, max-age=3600"
+        etag, weak = response.get_etag()
+        assert etag and not weak
+
+        response = client.get(
+            "/_uploads/media/clip.mp4",
+            headers={"If-None-Match": '"%s"' % etag})
+        assert response.status_code == 304
+
+        response = client.get(
+            "/_uploads/media/clip.mp4", headers={"Range": "bytes=1000-"})
+        assert response.status_code == 206
+        assert response.data == DATA[1000:]
+        assert response.headers["Content-Range"] == "bytes 1000-1023/1024"
+
+        response = client.get(
+            "/_uploads/media/clip.mp4", headers={"Range": "bytes=5000-6000"})
+        assert response.status_code == 416
+
+        # the range is served, as werkzeug checks it before If-None-Match
+        response = client.get("/_uploads/media/clip.mp4", headers={
+            "If-None-Match": '"%s"' % etag, "Range": "bytes=0-1"})
+        assert response.status_code == 206
+        assert response.data == DATA[:2]
+        assert response.headers["Content-Range"] == "bytes 0-1/1024"
+
+    def test_no_cache_by_default(self, make_client: MakeClient) -> None:
+        client = make_client(UPLOADED_MEDIA_SENDFILE=True)
+        response = client.get("/_uploads/media/clip.mp4")
+        assert response.headers["Cache-Control"] == "no-cache"
+
+    @pytest.mark.parametrize("path", ["missing.mp4", "sub", "../clip.mp4"])
+    def test_missing_files(
+        self, tmp_path: Path, path: str, make_client: MakeClient
+    ) -> None:
+        client = make_client(UPLOADED_MEDIA_CACHE_MAX_AGE=60)
+        (tmp_path / "sub").mkdir()
+        assert client.get("/_uploads/media/" + path).status_code == 404
+
+    def test_accel_redirect(
+        self, tmp_path: Path, make_client: MakeClient
+    ) -> None:
+        client = make_client(
+            UPLOADED_MEDIA_ACCEL_REDIRECT="/protected/media/")
+        (tmp_path / "my clip.mp4").write_bytes(DATA)
+        response = client.get(
+            "/_uploads/media/my clip.mp4", headers={"Range": "bytes=0-9"})
+        # the range is left to nginx
+        assert response.status_code == 200
+        assert response.data == b""
+        assert response.headers["X-Accel-Redirect"] == (
+            "/protected/media/my%20clip.mp4")
+        assert response.mimetype == "video/mp4"
+
+        etag = response.get_etag()[0]
+        response = client.get(
+            "/_uploads/media/my clip.mp4",
+            headers={"If-None-Match": '"%s"' % etag})
+        assert response.status_code == 304
+        assert "X-Accel-Redirect" not in response.headers
+
+    def test_sendfile(self, tmp_path: Path, make_client: MakeClient) -> None:
+        client = make_client(
+            UPLOADED_MEDIA_SENDFILE=True, UPLOADED_MEDIA_SHARDING="hash:2")
+        digest = hashlib.md5(
+            b"clip.mp4", usedforsecurity=False).hexdigest()
+        (tmp_path / digest[:2]).mkdir()
+        (tmp_path / "clip.mp4").rename(tmp_path / digest[:2] / "clip.mp4")
+        response = client.get("/_uploads/media/clip.mp4")
+        assert response.status_code == 200
+        assert response.headers["X-Sendfile"] == str(
+            tmp_path / digest[:2] / "clip.mp4")
+        assert response.content_length == len(DATA)
+
+    def test_content_addressed_files_are_immutable(
+        self,
+        tmp_path: Path,
+        make_app: MakeApp,
+        make_storage: MakeStorage,
+        media: UploadSet
+    ) -> None:
+        app = make_app(
+            media, UPLOADS_AUTOSERVE=True, UPLOADED_MEDIA_DEST=str(tmp_path),
+            UPLOADED_MEDIA_CONTENT_HASH="sha256")
+        with app.app_context():
+            name = media.save(make_storage("clip.mp4", DATA))
+        with app.test_client() as client:
+            response = client.get("/_uploads/media/" + name)
+        assert response.data == DATA
+        assert response.get_etag() == (hashlib.sha256(DATA).hexdigest(), False)
+        assert response.cache_control.immutable
+        assert response.cache_control.max_age == 365 * 24 * 60 * 60
+
+    def test_files_removed_while_serving(
+        self, make_client: MakeClient
+    ) -> None:
+        class Racy(MemoryBackend):
+            def open(self, key: str) -> IO[bytes]:
+                raise FileNotFoundError(key)
+
+        backend = Racy()
+        backend.save("clip.mp4", io.BytesIO(DATA))
+        client = make_client(UPLOADED_MEDIA_BACKEND=backend)
+        assert client.get("/_uploads/media/clip.mp4").status_code == 404
@@ -0,0 +1,140 @@
+import hashlib
+from pathlib import Path
+
+import pytest
+from flask_uploads import ALL
+from flask_uploads import MemoryBackend
+from flask_uploads import UploadConfiguration
+from flask_uploads import UploadSet
+from flask_uploads.sharding import Sharding
+
+from .conftest import MakeApp
+from .conftest import MakeSet
+from .conftest import MakeStorage
+
+
+def shard(basename: str) -> str:
+    digest = hashlib.md5(
+        basename.encode(), usedforsecurity=False).hexdigest()
+    return "%s/%s" % (digest[:2], digest[2:4])
+
+
+@pytest.fixture
+def files(make_set: MakeSet) -> UploadSet:
+    return make_set(sharding="hash:2/2")
+
+
+class TestSharding:
+    def test_parse(self) -> None:
+        assert Sharding.parse("hash:2/2") == Sharding([2, 2])
+        assert Sharding.parse("hash:3").widths == (3,)
+        assert repr(Sharding([2, 1])) == "<Sharding hash:2/1>"
+        assert Sharding([2]) != (2,)
+
+    @pytest.mark.parametrize("spec", [
+        "hash", "hash:", "hash:0/2", "hash:a/b", "date:2", "hash:30/3",
+    ])
+    def test_parse_rejects_invalid_specifications(self, spec: str) -> None:
+        with pytest.raises(ValueError):
+            Sharding.parse(spec)
+
+    def test_key(self) -> None:
+        sharding = Sharding.parse("hash:2/2")
+        assert sharding.key("foo.txt") == shard("foo.txt") + "/foo.txt"
+        assert sharding.key("someguy/foo.txt") == (
+            "someguy/" + shard("foo.txt") + "/foo.txt")
+
+
+class TestConfiguration:
+    def test_sharding_is_read_from_the_configuration(
+        self, make_app: MakeApp
+    ) -> None:
+        app = make_app(
+            UploadSet("files"), UPLOADED_FILES_DEST="/uploads",
+            UPLOADED_FILES_SHARDING="hash:2/2")
+        config = app.upload_set_config["files"]  # type: ignore
+        assert config.sharding == Sharding([2, 2])
+
+    def test_sharding_and_content_hash_are_exclusive(self) -> None:
+        with pytest.raises(ValueError):
+            UploadConfiguration(
+                "/uploads", sharding="hash:2", content_hash="sha256")
+
+
+class TestShardedSaving:
+    def test_save_keeps_names_stable(
+        self, tmp_path: Path, files: UploadSet, make_storage: MakeStorage
+    ) -> None:
+        assert files.save(make_storage()) == "foo.txt"
+        assert files.save(make_storage(data=b"again")) == "foo_1.txt"
+        assert files.save(make_storage(), folder="someguy") == (
+            "someguy/foo.txt")
+        assert files.path("foo.txt") == str(
+            tmp_path / shard("foo.txt") / "foo.txt")
+        assert (tmp_path / shard("foo_1.txt") / "foo_1.txt").read_bytes() == (
+            b"again")
+        assert files.path("foo.txt", folder="someguy") == str(
+            tmp_path / "someguy" / shard("foo.txt") / "foo.txt")
+        assert files.path("someguy/foo.txt") == files.path(
+            "foo.txt", folder="someguy")
+        assert files.exists("someguy/foo.txt")
+
+    def test_reserve_names(
+        self, tmp_path: Path, make_set: MakeSet, make_storage: MakeStorage
+    ) -> None:
+        uset = make_set(sharding="hash:2/2", reserve_names=True)
+        assert uset.save(make_storage()) == "foo.txt"
+        assert uset._reserve(str(tmp_path), "foo.txt", uset._config) == (
+            "foo_1.txt")
+        assert uset.save(make_storage(data=b"again")) == "foo_2.txt"
+        with uset.open("foo_2.txt") as f:
+            assert f.read() == b"again"
+
+    def test_save_many(
+        self, files: UploadSet, make_storage: MakeStorage
+    ) -> None:
+        files.save(make_storage())
+        results = files.save_many(
+            [make_storage(), make_storage(), make_storage("bar.txt", b"")])
+        assert [r.name for r in results] == [
+            "foo_1.txt", "foo_2.txt", "bar.txt"]
+        assert files.exists("foo_2.txt")
+
+    def test_backends_are_sharded(self, make_storage: MakeStorage) -> None:
+        backend = MemoryBackend()
+        uset = UploadSet("files", ALL)
+        uset._config = UploadConfiguration(
+            "", backend=backend, sharding="hash:2")
+        assert uset.save(make_storage()) == "foo.txt"
+        assert uset.save(make_storage()) == "foo_1.txt"
+        assert uset.save_many([make_storage()])[0].name == "foo_2.txt"
+        assert sorted(backend.list()) == sorted(
+            "%s/%s" % (shard(name)[:2], name)
+            for name in ("foo.txt", "foo_1.txt", "foo_2.txt"))
+        uset.delete("foo.txt")
+        assert not uset.exists("foo.txt")
+
+    def test_urls_and_autoserve(
+        self, tmp_path: Path, make_app: MakeApp, make_storage: MakeStorage
+    ) -> None:
+        files = UploadSet("files", ALL)
+        photos = UploadSet("photos", ALL)
+        app = make_app(
+            files, photos,
+            UPLOADS_AUTOSERVE=True,
+            UPLOADED_FILES_DEST=str(tmp_path),
+            UPLOADED_FILES_SHARDING="hash:2/2",
+            UPLOADED_PHOTOS_DEST=str(tmp_path),
+            UPLOADED_PHOTOS_URL="http://example.com/photos/",
+            UPLOADED_PHOTOS_SHARDING="hash:2/2")
+        with app.test_request_context():
+            name = files.save(make_storage(data=b"hello"))
+            assert files.url(name) == (
+                "http://localhost/_uploads/files/foo.txt")
+            assert photos.url(name) == (
+                "http://example.com/photos/%s/foo.txt" % shard("foo.txt"))
+        with app.test_client() as client:
+            response = client.get("/_uploads/files/foo.txt")
+            assert response.status_code == 200
+            assert response.data == b"hello"
+            response.close()
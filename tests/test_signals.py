@@ -0,0 +1,187 @@
+import io
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+
+import pytest
+from blinker import NamedSignal
+from flask import Flask
+from flask_uploads import ALL
+from flask_uploads import IMAGES
+from flask_uploads import MemoryBackend
+from flask_uploads import UploadNotAllowed
+from flask_uploads import UploadSet
+from flask_uploads import upload_rejected
+from flask_uploads import upload_saved
+from flask_uploads import upload_served
+from flask_uploads.signals import Measurement
+from flask_uploads.signals import measure
+
+from .conftest import MakeApp
+from .conftest import MakeStorage
+
+Call = tuple[Any, dict[str, Any]]
+
+
+@contextmanager
+def captured(signal: NamedSignal) -> Iterator[list[Call]]:
+    calls: list[Call] = []
+
+    def receiver(sender: Any, **kwargs: Any) -> None:
+        calls.append((sender, kwargs))
+
+    with signal.connected_to(receiver):
+        yield calls
+
+
+@pytest.fixture
+def photos() -> UploadSet:
+    return UploadSet("photos", IMAGES)
+
+
+@pytest.fixture
+def app(tmp_path: Path, photos: UploadSet, make_app: MakeApp) -> Flask:
+    return make_app(
+        photos, UPLOADS_AUTOSERVE=True, UPLOADED_PHOTOS_DEST=str(tmp_path))
+
+
+class TestMeasurement:
+    def test_nothing_is_measured_without_receivers(self) -> None:
+        assert measure(upload_saved, upload_rejected) is None
+        with captured(upload_rejected):
+            assert isinstance(
+                measure(upload_saved, upload_rejected), Measurement)
+
+    def test_measurement(self) -> None:
+        measurement = Measurement()
+        measurement.lap("a")
+        measurement.lap("b")
+        measurement.lap("a")
+        assert list(measurement.timings) == ["a", "b"]
+        assert measurement.duration >= sum(measurement.timings.values())
+
+
+class TestSignals:
+    def test_saved(
+        self,
+        tmp_path: Path,
+        app: Flask,
+        photos: UploadSet,
+        make_storage: MakeStorage
+    ) -> None:
+        (tmp_path / "snow.png").write_bytes(b"old")
+        (tmp_path / "snow_1.png").write_bytes(b"old")
+        with app.app_context(), captured(upload_saved) as calls:
+            name = photos.save(make_storage("snow.png", b"snow"))
+        assert name == "snow_2.png"
+        (sender, kwargs), = calls
+        assert sender is photos
+        assert kwargs["name"] == "snow_2.png"
+        assert kwargs["size"] == 4
+        assert kwargs["conflicts"] == 2
+        assert list(kwargs["timings"]) == [
+            "validate", "folder", "resolve", "write"]
+        assert kwargs["duration"] >= sum(kwargs["timings"].values())
+
+        # conflicts are only counted while saving
+        photos.resolve_conflict(str(tmp_path), "snow.png")
+        with app.app_context(), captured(upload_saved) as calls:
+            photos.save(make_storage("rain.png"))
+        assert calls[0][1]["conflicts"] == 0
+
+    def test_saved_to_a_backend(
+        self,
+        photos: UploadSet,
+        make_app: MakeApp,
+        make_storage: MakeStorage
+    ) -> None:
+        backend = MemoryBackend()
+        backend.save("snow.png", io.BytesIO(b"old"))
+        app = make_app(photos, UPLOADED_PHOTOS_BACKEND=backend)
+        with app.app_context(), captured(upload_saved) as calls:
+            assert photos.save(
+                make_storage("snow.png", b"fresh snow")) == "snow_1.png"
+        kwargs = calls[0][1]
+        assert kwargs["size"] == 10
+        assert kwargs["conflicts"] == 1
+        assert list(kwargs["timings"]) == ["validate", "resolve", "write"]
+
+    @pytest.mark.parametrize("filename, size, name, error", [
+        ("virus.exe", 1, None, UploadNotAllowed),
+        ("snow.png", 1, "...", ValueError),
+        ("snow.png", 100, None, UploadNotAllowed),
+    ])
+    def test_rejected(
+        self,
+        tmp_path: Path,
+        photos: UploadSet,
+        make_app: MakeApp,
+        make_storage: MakeStorage,
+        filename: str,
+        size: int,
+        name: str | None,
+        error: type[Exception]
+    ) -> None:
+        app = make_app(photos, UPLOADED_PHOTOS_DEST=str(tmp_path),
+                       UPLOADED_PHOTOS_MAX_SIZE=10)
+        with app.app_context(), captured(upload_rejected) as calls:
+            with captured(upload_saved) as saved, pytest.raises(error):
+                photos.save(make_storage(filename, b"x" * size), name=name)
+        assert saved == []
+        (sender, kwargs), = calls
+        assert sender is photos
+        assert kwargs["filename"] == filename
+        assert isinstance(kwargs["error"], error)
+
+    def test_bound_upload_sets_send_as_the_upload_set(
+        self, app: Flask, photos: UploadSet, make_storage: MakeStorage
+    ) -> None:
+        saved: list[str] = []
+        rejected: list[str] = []
+
+        def on_saved(sender: UploadSet, name: str, **kwargs: Any) -> None:
+            saved.append(name)
+
+        def on_rejected(
+            sender: UploadSet, filename: str, **kwargs: Any
+        ) -> None:
+            rejected.append(filename)
+
+        bound = photos.bind(app).bind(app)
+        with upload_saved.connected_to(on_saved, sender=photos), \
+                upload_rejected.connected_to(on_rejected, sender=photos):
+            bound.save(make_storage("snow.png"))
+            with pytest.raises(UploadNotAllowed):
+                bound.save(make_storage("virus.exe"))
+        assert saved == ["snow.png"]
+        assert rejected == ["virus.exe"]
+
+    def test_served(self, tmp_path: Path, app: Flask) -> None:
+        (tmp_path / "snow.png").write_bytes(b"snow")
+        client = app.test_client()
+        with captured(upload_served) as calls:
+            assert client.get("/_uploads/photos/snow.png").status_code == 200
+            assert client.get("/_uploads/photos/rain.png").status_code == 404
+            assert client.get("/_uploads/other/snow.png").status_code == 404
+        assert [(sender, kwargs["setname"], kwargs["status"])
+                for sender, kwargs in calls] == [
+            (app, "photos", 200), (app, "photos", 404), (app, "other", 404)]
+        assert calls[0][1]["filename"] == "snow.png"
+        assert calls[0][1]["variant"] is None
+        assert calls[0][1]["duration"] > 0
+
+    def test_served_with_errors(self, make_app: MakeApp) -> None:
+        backend = MemoryBackend()
+        app = make_app(UploadSet("files", ALL), UPLOADS_AUTOSERVE=True,
+                       UPLOADED_FILES_BACKEND=backend)
+        app.testing = True
+
+        def broken(key: str) -> Any:
+            raise RuntimeError("storage is down")
+
+        backend.stat = broken  # type: ignore
+        with captured(upload_served) as calls:
+            with pytest.raises(RuntimeError):
+                app.test_client().get("/_uploads/files/a.txt")
+        assert calls[0][1]["status"] == 500
@@ -0,0 +1,136 @@
+import io
+import os
+from pathlib import Path
+
+import pytest
+from flask_uploads import ARCHIVES
+from flask_uploads import AUDIO
+from flask_uploads import DOCUMENTS
+from flask_uploads import IMAGES
+from flask_uploads import UploadNotAllowed
+from flask_uploads import UploadSet
+from flask_uploads.signatures import SIGNATURES
+from flask_uploads.signatures import content_matches
+from flask_uploads.signatures import peek
+
+from .conftest import MakeApp
+from .conftest import MakeSet
+from .conftest import MakeStorage
+
+PNG = b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR"
+ZIP = b"PK\x03\x04\x14\x00"
+OLE2 = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1\x00"
+SAMPLES = {
+    "jpg": b"\xff\xd8\xff\xe0\x00\x10JFIF",
+    "jpe": b"\xff\xd8\xff\xe1",
+    "jpeg": b"\xff\xd8\xff\xdb",
+    "png": PNG,
+    "gif": b"GIF89a\x01\x00",
+    "svg": b'\xef\xbb\xbf <?xml version="1.0"?>\n<SVG xmlns="...">',
+    "bmp": b"BM6\x00\x00\x00",
+    "webp": b"RIFF\x00\x00\x00\x00WEBPVP8 ",
+    "rtf": b"{\\rtf1\\ansi",
+    "odf": ZIP,
+    "ods": ZIP,
+    "gnumeric": b"\x1f\x8b\x08\x00",
+    "abw": b'<?xml version="1.0"?>\n<abiword>',
+    "doc": OLE2,
+    "docx": ZIP,
+    "xls": OLE2,
+    "xlsx": ZIP,
+    "pdf": b"\n%PDF-1.7\n",
+    "gz": b"\x1f\x8b\x08\x00",
+    "bz2": b"BZh91AY&SY",
+    "zip": b"PK\x05\x06" + b"\x00" * 18,
+    "tar": b"\x00" * 257 + b"ustar\x0000",
+    "tgz": b"\x1f\x8b\x08\x00",
+    "txz": b"\xfd7zXZ\x00\x00",
+    "7z": b"7z\xbc\xaf'\x1c\x00\x04",
+    "wav": b"RIFF\x24\x00\x00\x00WAVEfmt ",
+    "mp3": b"\xff\xfb\x90\x64",
+    "aac": b"\xff\xf1\x50\x80",
+    "ogg": b"OggS\x00\x02",
+    "oga": b"OggS\x00\x02",
+    "flac": b"fLaC\x00\x00\x00\x22",
+}
+
+
+@pytest.fixture
+def files(make_set: MakeSet) -> UploadSet:
+    return make_set(sniff=True)
+
+
+class TestSignatures:
+    def test_every_preset_has_a_signature(self) -> None:
+        assert set(SIGNATURES) == set(IMAGES + DOCUMENTS + ARCHIVES + AUDIO)
+        assert set(SAMPLES) == set(SIGNATURES)
+
+    @pytest.mark.parametrize("ext", sorted(SAMPLES))
+    def test_signatures(self, ext: str) -> None:
+        assert content_matches(io.BytesIO(SAMPLES[ext]), ext)
+        assert not content_matches(io.BytesIO(b"#!/bin/sh\nrm -rf /"), ext)
+        assert not content_matches(io.BytesIO(b""), ext)
+
+    def test_alternative_signatures(self) -> None:
+        assert content_matches(io.BytesIO(b"ID3\x04\x00"), "mp3")
+        assert content_matches(io.BytesIO(b"ADIF\x00"), "aac")
+        assert content_matches(io.BytesIO(b"<?xml?><gnumeric:Workbook>"),
+                               "gnumeric")
+        assert not content_matches(io.BytesIO(b"<html><body>"), "svg")
+
+    def test_unknown_extensions_always_match(self) -> None:
+        assert content_matches(io.BytesIO(b"anything"), "txt")
+
+    def test_peek_rewinds_the_stream(self) -> None:
+        stream = io.BytesIO(b"0123456789")
+        stream.seek(2)
+        assert peek(stream, 4) == b"2345"
+        assert stream.tell() == 2
+
+    def test_unseekable_streams_cannot_be_sniffed(self) -> None:
+        class Unseekable(io.BytesIO):
+            def seekable(self) -> bool:
+                return False
+
+        assert peek(Unseekable(PNG)) is None
+        assert not content_matches(Unseekable(PNG), "png")
+        assert content_matches(Unseekable(b"text"), "txt")
+
+        closed = io.BytesIO(PNG)
+        closed.close()
+        assert peek(closed) is None
+
+
+class TestSniffing:
+    def test_sniff_is_read_from_the_configuration(
+        self, make_app: MakeApp
+    ) -> None:
+        app = make_app(
+            UploadSet("files"), UPLOADED_FILES_DEST="/uploads",
+            UPLOADED_FILES_SNIFF=True)
+        assert app.upload_set_config["files"].sniff  # type: ignore
+
+    def test_save_checks_the_content(
+        self, tmp_path: Path, files: UploadSet, make_storage: MakeStorage
+    ) -> None:
+        data = PNG + os.urandom(10_000)
+        assert files.save(make_storage("a.png", data)) == "a.png"
+        assert (tmp_path / "a.png").read_bytes() == data
+
+        fake = make_storage("b.png", b"<?php system($_GET['c']);")
+        with pytest.raises(UploadNotAllowed, match="content"):
+            files.save(fake)
+        assert not (tmp_path / "b.png").exists()
+
+    def test_save_checks_the_content_against_the_final_name(
+        self, files: UploadSet, make_storage: MakeStorage
+    ) -> None:
+        storage = make_storage("a.png", PNG)
+        with pytest.raises(UploadNotAllowed):
+            files.save(storage, name="a.pdf")
+        assert files.save(storage, name="b.") == "b.png"
+
+    def test_sniffing_is_off_by_default(
+        self, make_set: MakeSet, make_storage: MakeStorage
+    ) -> None:
+        assert make_set().save(make_storage("a.png", b"fake")) == "a.png"
@@ -0,0 +1,200 @@
+import functools
+import os
+from pathlib import Path
+from typing import IO
+from unittest.mock import patch
+
+import pytest
+from flask import Flask
+from flask_uploads import ALL
+from flask_uploads import MemoryBackend
+from flask_uploads import UploadConfiguration
+from flask_uploads import UploadSet
+from flask_uploads.backends import StoredFile
+from flask_uploads.caching import LRUCache
+
+from .conftest import MakeApp
+from .conftest import MakeStorage
+
+
+class CountingBackend(MemoryBackend):
+    def __init__(self) -> None:
+        super().__init__()
+        self.calls: list[str] = []
+
+    def stat(self, key: str) -> StoredFile:
+        self.calls.append("stat")
+        return super().stat(key)
+
+    def open(self, key: str) -> IO[bytes]:
+        self.calls.append("open")
+        return super().open(key)
+
+
+@pytest.fixture
+def backend() -> CountingBackend:
+    return CountingBackend()
+
+
+@pytest.fixture
+def avatars() -> UploadSet:
+    return UploadSet("avatars", ALL)
+
+
+@pytest.fixture
+def app(
+    backend: CountingBackend, avatars: UploadSet, make_app: MakeApp
+) -> Flask:
+    return make_app(
+        avatars, UPLOADS_AUTOSERVE=True, UPLOADED_AVATARS_BACKEND=backend,
+        UPLOADED_AVATARS_STAT_CACHE_TTL=60)
+
+
+@pytest.fixture
+def avatar(make_storage: MakeStorage) -> MakeStorage:
+    return functools.partial(make_storage, "me.png", data=b"avatar")
+
+
+class TestLRUCache:
+    def test_ttl(self) -> None:
+        cache: LRUCache[int] = LRUCache(10, ttl=5)
+        with patch("time.monotonic", return_value=100):
+            cache.set("a", 1)
+            cache.set("b", 2)
+        with patch("time.monotonic", return_value=104.9):
+            assert cache.get("a") == 1
+        with patch("time.monotonic", return_value=105):
+            assert cache.get("a") is None
+            assert "b" not in cache
+            assert cache.pop("b") is None
+        assert len(cache) == 0
+
+    def test_ttl_must_be_positive(self) -> None:
+        with pytest.raises(ValueError):
+            LRUCache(10, ttl=0)
+
+
+class TestConfiguration:
+    def test_stat_cache_is_read_from_the_configuration(
+        self, make_app: MakeApp
+    ) -> None:
+        app = make_app(
+            UploadSet("files"), UPLOADED_FILES_DEST="/uploads",
+            UPLOADED_FILES_STAT_CACHE_TTL=30,
+            UPLOADED_FILES_STAT_CACHE_SIZE=10)
+        config = app.upload_set_config["files"]  # type: ignore
+        assert config.stat_cache.ttl == 30
+        assert config.stat_cache.maxsize == 10
+        assert not config.plain_serving
+
+    def test_no_stat_cache_by_default(self) -> None:
+        assert UploadConfiguration("/uploads").stat_cache is None
+
+
+class TestStatCache:
+    def test_conditional_and_head_requests_use_the_cache(
+        self,
+        app: Flask,
+        backend: CountingBackend,
+        avatars: UploadSet,
+        avatar: MakeStorage
+    ) -> None:
+        client = app.test_client()
+        with app.app_context():
+            avatars.save(avatar())
+
+        response = client.get("/_uploads/avatars/me.png")
+        assert response.data == b"avatar"
+        assert backend.calls == ["stat", "open"]
+        etag = response.get_etag()[0]
+
+        backend.calls.clear()
+        response = client.get(
+            "/_uploads/avatars/me.png",
+            headers={"If-None-Match": '"%s"' % etag})
+        assert response.status_code == 304
+        response = client.head("/_uploads/avatars/me.png")
+        assert response.status_code == 200
+        assert response.content_length == 6
+        assert response.mimetype == "image/png"
+        assert backend.calls == []
+
+        # the cached information is checked when the content is sent
+        response = client.get("/_uploads/avatars/me.png")
+        assert response.data == b"avatar"
+        assert backend.calls == ["open", "stat"]
+
+    def test_saving_and_deleting_update_the_cache(
+        self,
+        app: Flask,
+        backend: CountingBackend,
+        avatars: UploadSet,
+        avatar: MakeStorage
+    ) -> None:
+        client = app.test_client()
+        with app.app_context():
+            avatars.save(avatar())
+        assert client.get("/_uploads/avatars/me.png").status_code == 200
+
+        with app.app_context():
+            avatars.delete("me.png")
+        assert client.get("/_uploads/avatars/me.png").status_code == 404
+
+        # removed behind the back of the upload set
+        with app.app_context():
+            avatars.save(avatar(data=b"new avatar"))
+            assert client.head("/_uploads/avatars/me.png").content_length == 10
+            backend.files.clear()
+        assert client.get("/_uploads/avatars/me.png").status_code == 404
+        assert client.head("/_uploads/avatars/me.png").status_code == 404
+
+    def test_files_replaced_behind_the_cache_are_described_correctly(
+        self, tmp_path: Path, make_app: MakeApp
+    ) -> None:
+        app = make_app(
+            UploadSet("avatars", ALL), UPLOADS_AUTOSERVE=True,
+            UPLOADED_AVATARS_DEST=str(tmp_path),
+            UPLOADED_AVATARS_STAT_CACHE_TTL=60)
+        client = app.test_client()
+        (tmp_path / "a.txt").write_bytes(b"first")
+        response = client.get("/_uploads/avatars/a.txt")
+        etag = response.get_etag()[0]
+        response.close()
+
+        # as if written by another worker
+        (tmp_path / "a.txt").write_bytes(b"a much longer content")
+        os.utime(tmp_path / "a.txt", (0, 0))
+        response = client.get("/_uploads/avatars/a.txt")
+        assert response.data == b"a much longer content"
+        assert response.content_length == 21
+        assert response.get_etag()[0] != etag
+        response.close()
+        assert client.head("/_uploads/avatars/a.txt").content_length == 21
+
+    def test_files_removed_while_sending_are_not_found(
+        self,
+        app: Flask,
+        backend: CountingBackend,
+        avatars: UploadSet,
+        avatar: MakeStorage
+    ) -> None:
+        client = app.test_client()
+        with app.app_context():
+            avatars.save(avatar())
+        assert client.head("/_uploads/avatars/me.png").status_code == 200
+        with patch.object(backend, "stat", side_effect=FileNotFoundError):
+            assert client.get("/_uploads/avatars/me.png").status_code == 404
+        assert client.head("/_uploads/avatars/me.png").status_code == 200
+        assert backend.calls == ["stat", "open", "stat"]
+
+    def test_save_many_and_invalidate_update_the_cache(
+        self, app: Flask, avatars: UploadSet, avatar: MakeStorage
+    ) -> None:
+        client = app.test_client()
+        with app.app_context():
+            avatars.save_many([avatar()])
+            config = avatars.config
+        assert client.head("/_uploads/avatars/me.png").status_code == 200
+        assert config.stat_cache is not None and len(config.stat_cache) == 1
+        config.invalidate()
+        assert len(config.stat_cache) == 0
@@ -0,0 +1,328 @@
+import errno
+import io
+import os
+import stat
+import tempfile
+from collections.abc import Callable
+from pathlib import Path
+from typing import IO
+from typing import Any
+from unittest.mock import patch
+
+import pytest
+from flask import Request
+from flask import request
+from flask_uploads import ALL
+from flask_uploads import TestingFileStorage
+from flask_uploads import UploadConfiguration
+from flask_uploads import UploadSet
+from flask_uploads.streaming import anonymous_file
+from flask_uploads.streaming import copy_stream
+from flask_uploads.streaming import current_umask
+from flask_uploads.streaming import linkable_path
+from flask_uploads.streaming import private_folder
+from flask_uploads.streaming import real_file
+from werkzeug.datastructures import FileStorage
+
+from .conftest import MakeApp
+from .conftest import MakeSet
+from .conftest import MakeStorage
+
+PAYLOAD = os.urandom(200_000)
+
+
+@pytest.fixture
+def files(make_set: MakeSet) -> UploadSet:
+    return make_set(atomic_save=True)
+
+
+def named_upload(tmp_path: Path) -> IO[bytes]:
+    stream = tempfile.NamedTemporaryFile(dir=tmp_path)
+    stream.write(PAYLOAD)
+    stream.seek(0)
+    return stream
+
+
+def anonymous_upload(tmp_path: Path) -> IO[bytes]:
+    stream = anonymous_file(str(tmp_path))
+    stream.write(PAYLOAD)
+    stream.seek(0)
+    return stream
+
+
+class TestConfiguration:
+    def test_options_are_read_from_the_configuration(
+        self, make_app: MakeApp
+    ) -> None:
+        app = make_app(
+            UploadSet("files"), UPLOADED_FILES_DEST="/uploads",
+            UPLOADED_FILES_ATOMIC_SAVE=True,
+            UPLOADED_FILES_BUFFER_SIZE=1 << 20)
+        config = app.upload_set_config["files"]  # type: ignore
+        assert config.atomic_save
+        assert config.buffer_size == 1 << 20
+
+    def test_buffer_size_must_be_positive(self) -> None:
+        with pytest.raises(ValueError):
+            UploadConfiguration("/uploads", buffer_size=0)
+
+    def test_buffer_size_is_passed_to_regular_saves(
+        self, make_set: MakeSet
+    ) -> None:
+        sizes = []
+
+        class RecordingStorage(TestingFileStorage):
+            def save(  # type: ignore
+                self, dst: str, buffer_size: int = 16384
+            ) -> None:
+                sizes.append(buffer_size)
+
+        uset = make_set(buffer_size=4096)
+        uset.save(RecordingStorage(filename="foo.txt"))
+        assert sizes == [4096]
+
+
+class TestAtomicSave:
+    def test_atomic_save_from_memory(
+        self, tmp_path: Path, make_set: MakeSet, make_storage: MakeStorage
+    ) -> None:
+        uset = make_set(atomic_save=True, buffer_size=1000)
+        assert uset.save(make_storage("foo.bin", PAYLOAD)) == "foo.bin"
+        assert (tmp_path / "foo.bin").read_bytes() == PAYLOAD
+        assert os.listdir(tmp_path) == ["foo.bin"]
+
+    @pytest.mark.parametrize("stream_factory", [
+        lambda: tempfile.TemporaryFile(),
+        lambda: tempfile.SpooledTemporaryFile(max_size=10),
+    ])
+    def test_atomic_save_from_disk(
+        self,
+        tmp_path: Path,
+        stream_factory: Callable[[], IO[bytes]],
+        files: UploadSet
+    ) -> None:
+        stream = stream_factory()
+        stream.write(PAYLOAD)
+        stream.seek(0)
+        assert files.save(FileStorage(stream, filename="foo.bin")) == "foo.bin"
+        assert (tmp_path / "foo.bin").read_bytes() == PAYLOAD
+        assert stream.read() == b""
+
+    def test_atomic_save_with_reserved_names(
+        self, tmp_path: Path, make_set: MakeSet, make_storage: MakeStorage
+    ) -> None:
+        uset = make_set(atomic_save=True, reserve_names=True)
+        (tmp_path / "foo.bin").write_bytes(b"old")
+        assert uset.save(make_storage("foo.bin", PAYLOAD)) == "foo_1.bin"
+        assert (tmp_path / "foo_1.bin").read_bytes() == PAYLOAD
+        assert sorted(os.listdir(tmp_path)) == ["foo.bin", "foo_1.bin"]
+
+    def test_failed_atomic_save_leaves_nothing_behind(
+        self, tmp_path: Path, files: UploadSet
+    ) -> None:
+        class BrokenStream(io.BytesIO):
+            def read(self, size: int | None = -1) -> bytes:
+                raise OSError("connection reset")
+
+        with pytest.raises(OSError):
+            files.save(FileStorage(BrokenStream(), filename="foo.bin"))
+        assert os.listdir(tmp_path) == []
+
+
+class TestKernelCopy:
+    def test_real_file(self) -> None:
+        assert real_file(io.BytesIO()) is None
+        spooled = tempfile.SpooledTemporaryFile(max_size=10)
+        assert real_file(spooled) is None
+        spooled.write(b"x" * 20)
+        assert real_file(spooled) is not None
+
+    def test_kernel_copy_falls_back_to_user_space(
+        self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        def unsupported(*args: object) -> int:
+            raise OSError(errno.EXDEV, "cross-device")
+
+        monkeypatch.setattr(os, "copy_file_range", unsupported, raising=False)
+        monkeypatch.setattr(os, "sendfile", unsupported, raising=False)
+        with tempfile.TemporaryFile() as source:
+            source.write(PAYLOAD)
+            source.seek(0)
+            with open(tmp_path / "copy", "wb") as dst:
+                assert copy_stream(source, dst) == len(PAYLOAD)
+        assert (tmp_path / "copy").read_bytes() == PAYLOAD
+
+    def test_kernel_copy_reraises_real_errors(
+        self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        def no_space(*args: object) -> int:
+            raise OSError(errno.ENOSPC, "no space left")
+
+        monkeypatch.setattr(os, "copy_file_range", no_space, raising=False)
+        with tempfile.TemporaryFile() as source:
+            source.write(PAYLOAD)
+            source.seek(0)
+            with open(tmp_path / "copy", "wb") as dst:
+                with pytest.raises(OSError):
+                    copy_stream(source, dst)
+
+
+class TestLinking:
+    def test_named_temporary_files_are_linked(
+        self, tmp_path: Path, make_set: MakeSet
+    ) -> None:
+        destination = tmp_path / "uploads"
+        destination.mkdir()
+        uset = make_set(destination, atomic_save=True)
+        with named_upload(tmp_path) as stream:
+            assert uset.save(
+                FileStorage(stream, filename="foo.bin")) == "foo.bin"
+            saved = destination / "foo.bin"
+            assert os.path.samestat(os.stat(saved), os.fstat(stream.fileno()))
+            assert stream.read() == b""
+        assert saved.read_bytes() == PAYLOAD
+        assert os.listdir(destination) == ["foo.bin"]
+        assert stat.S_IMODE(os.stat(saved).st_mode) == 0o666 & ~current_umask()
+
+    def test_partially_read_temporary_files_are_copied(
+        self, tmp_path: Path, make_set: MakeSet
+    ) -> None:
+        uset = make_set(tmp_path / "uploads", atomic_save=True)
+        (tmp_path / "uploads").mkdir()
+        with named_upload(tmp_path) as stream:
+            stream.seek(100)
+            uset.save(FileStorage(stream, filename="foo.bin"))
+            saved = tmp_path / "uploads" / "foo.bin"
+            assert not os.path.samestat(
+                os.stat(saved), os.fstat(stream.fileno()))
+        assert saved.read_bytes() == PAYLOAD[100:]
+
+    def test_temporary_files_on_other_filesystems_are_copied(
+        self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch, files: UploadSet
+    ) -> None:
+        def cross_device(src: str, dst: str) -> None:
+            raise OSError(errno.EXDEV, "cross-device link")
+
+        monkeypatch.setattr(os, "link", cross_device)
+        with named_upload(tmp_path) as stream:
+            files.save(FileStorage(stream, filename="foo.bin"))
+        assert (tmp_path / "foo.bin").read_bytes() == PAYLOAD
+
+    def test_anonymous_files_are_linked(
+        self, tmp_path: Path, make_set: MakeSet
+    ) -> None:
+        destination = tmp_path / "uploads"
+        uset = make_set(destination)
+        with anonymous_upload(tmp_path) as stream:
+            with patch("flask_uploads.streaming.copy_stream",
+                       side_effect=AssertionError):
+                assert uset.save(
+                    FileStorage(stream, filename="foo.bin")) == "foo.bin"
+            saved = destination / "foo.bin"
+            assert os.path.samestat(os.stat(saved), os.fstat(stream.fileno()))
+        assert saved.read_bytes() == PAYLOAD
+        assert os.listdir(destination) == ["foo.bin"]
+        assert stat.S_IMODE(os.stat(saved).st_mode) == 0o666 & ~current_umask()
+
+    def test_request_bodies_spooled_to_anonymous_files_are_linked(
+        self, tmp_path: Path, make_app: MakeApp, files: UploadSet
+    ) -> None:
+        class UploadRequest(Request):
+            def _get_file_stream(self, *args: Any, **kwargs: Any) -> IO[bytes]:
+                return anonymous_file(str(tmp_path))
+
+        files = UploadSet("files", ALL)
+        app = make_app(files, UPLOADED_FILES_DEST=str(tmp_path / "uploads"))
+        app.request_class = UploadRequest
+
+        @app.post("/upload")
+        def upload() -> str:
+            stream = request.files["file"].stream
+            with patch("flask_uploads.streaming.copy_stream",
+                       side_effect=AssertionError):
+                name = files.save(request.files["file"])
+            saved = os.stat(files.path(name))
+            return str(os.path.samestat(saved, os.fstat(stream.fileno())))
+
+        response = app.test_client().post("/upload", data=dict(
+            file=(io.BytesIO(PAYLOAD), "large.bin")))
+        assert response.text == "True"
+        assert (tmp_path / "uploads" / "large.bin").read_bytes() == PAYLOAD
+
+    def test_anonymous_files_without_o_tmpfile(
+        self, tmp_path: Path, make_set: MakeSet
+    ) -> None:
+        real_open = os.open
+
+        def unsupported(path: str, flags: int, *args: Any) -> int:
+            if flags & os.O_TMPFILE == os.O_TMPFILE:
+                raise OSError(errno.EOPNOTSUPP, "")
+            return real_open(path, flags, *args)
+
+        uset = make_set(tmp_path / "uploads", atomic_save=True)
+        (tmp_path / "uploads").mkdir()
+        with patch("os.open", unsupported):
+            stream = anonymous_file(str(tmp_path))
+        with stream:
+            stream.write(PAYLOAD)
+            stream.seek(0)
+            # the fallback cannot be linked, so it is copied
+            uset.save(FileStorage(stream, filename="foo.bin"))
+        assert (tmp_path / "uploads" / "foo.bin").read_bytes() == PAYLOAD
+        assert os.listdir(tmp_path) == ["uploads"]
+        # by default in the temporary directory
+        with anonymous_file() as stream:
+            assert os.path.samestat(
+                os.stat(tempfile.gettempdir()),
+                os.stat(os.path.dirname(os.readlink(
+                    "/proc/self/fd/%d" % stream.fileno()))))
+
+    @pytest.mark.parametrize("factory", [
+        # werkzeug's default, whose files are created with O_EXCL
+        lambda: tempfile.SpooledTemporaryFile(max_size=1000),
+        # in memory, and not rolled over yet
+        lambda: tempfile.SpooledTemporaryFile(),
+        # a file which still has a name
+        lambda: open(tempfile.mkstemp()[0], "rb+"),
+    ])
+    def test_anonymous_files_which_are_copied(
+        self,
+        tmp_path: Path,
+        factory: Callable[[], IO[bytes]],
+        files: UploadSet
+    ) -> None:
+        with factory() as stream:
+            stream.write(PAYLOAD)
+            stream.seek(0)
+            files.save(FileStorage(stream, filename="foo.bin"))
+            saved = os.stat(tmp_path / "foo.bin")
+            fd = stream.fileno()
+            assert not os.path.samestat(saved, os.fstat(fd))
+        assert (tmp_path / "foo.bin").read_bytes() == PAYLOAD
+
+    def test_anonymous_files_need_proc(
+        self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        monkeypatch.setattr("flask_uploads.streaming._PROC_FDS", "/missing")
+        with anonymous_upload(tmp_path) as stream:
+            assert linkable_path(stream) is None
+
+    def test_closed_temporary_files_are_not_linkable(
+        self, tmp_path: Path
+    ) -> None:
+        stream = named_upload(tmp_path)
+        stream.close()
+        assert linkable_path(stream) is None
+        assert linkable_path(io.BytesIO()) is None
+
+
+class TestPrivateFolder:
+    def test_private_folder(self, tmp_path: Path) -> None:
+        folder = str(tmp_path / "state")
+        assert private_folder(folder) == folder
+        assert private_folder(folder) == folder
+        assert os.stat(folder).st_mode & 0o777 == 0o700
+        # a link planted in place of the folder
+        (tmp_path / "link").symlink_to(folder)
+        with pytest.raises(PermissionError):
+            private_folder(str(tmp_path / "link"))
@@ -0,0 +1,65 @@
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from flask_uploads import IMAGES
+from flask_uploads import UploadSet
+from flask_uploads import ValidatedNames
+from flask_uploads.filenames import normalize_filename
+
+from .conftest import MakeApp
+
+
+@pytest.fixture
+def photos(tmp_path: Path, make_app: MakeApp) -> UploadSet:
+    photos = UploadSet("photos", IMAGES)
+    app = make_app(photos, UPLOADED_PHOTOS_DEST=str(tmp_path))
+    return photos.bind(app)
+
+
+class TestValidateNames:
+    def test_validate_names(self, photos: UploadSet) -> None:
+        result = photos.validate_names([
+            "Holiday.JPG", "../../etc/passwd", "virus.exe", "holiday.jpg",
+            "../holiday.jpg", "snow.png", "...",
+        ])
+        assert result.names == [
+            "Holiday.jpg", "etc_passwd", "virus.exe", "holiday.jpg",
+            "holiday.jpg", "snow.png", "",
+        ]
+        assert result.rejected == [1, 2, 6]
+        assert result.duplicates == [4]
+        assert not result.ok
+        assert len(result) == 7
+        assert repr(result) == (
+            "<ValidatedNames 7 names, 3 rejected, 1 duplicates>")
+
+    def test_valid_names(self, photos: UploadSet) -> None:
+        result = photos.validate_names(iter(["a.png", "b.png"]))
+        assert result.ok
+        assert photos.validate_names([]).ok
+
+    def test_names_agree_with_get_basename(self, photos: UploadSet) -> None:
+        filenames = ["My Photo.PNG", "über.gif", "a/b/c.JPEG", " x .jpg"]
+        result = photos.validate_names(filenames)
+        assert result.names == [photos.get_basename(f) for f in filenames]
+
+    def test_repeated_names_are_checked_once(self, photos: UploadSet) -> None:
+        filenames = ["image.jpg", "blob", "image.jpg", "photo.jpg"] * 1000
+        with patch("flask_uploads.flask_uploads.normalize_filename",
+                   wraps=normalize_filename) as spy:
+            result = photos.validate_names(filenames)
+        assert spy.call_count == 3
+        assert isinstance(result, ValidatedNames)
+        assert result.rejected == list(range(1, 4000, 4))
+        assert len(result.duplicates) == 4000 - 1000 - 2
+
+    def test_overridden_extension_checks_are_used(
+        self, photos: UploadSet
+    ) -> None:
+        class NoGifs(UploadSet):
+            def extension_allowed(self, ext: str) -> bool:
+                return ext != "gif" and super().extension_allowed(ext)
+
+        no_gifs = NoGifs("photos", IMAGES).bind(photos.config)
+        assert no_gifs.validate_names(["a.gif", "a.png"]).rejected == [0]
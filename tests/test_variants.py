@@ -0,0 +1,307 @@
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import IO
+from unittest.mock import patch
+
+import pytest
+from flask import Flask
+from flask_uploads import IMAGES
+from flask_uploads import MemoryBackend
+from flask_uploads import UploadConfiguration
+from flask_uploads import UploadSet
+from flask_uploads import configure_uploads
+from flask_uploads.variants import Variant
+from flask_uploads.variants import VariantCache
+from flask_uploads.variants import render
+from werkzeug.datastructures import FileStorage
+
+from .conftest import MakeApp
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def image(size: tuple[int, int], fmt: str = "PNG", **options: object) -> bytes:
+    f = io.BytesIO()
+    Image.new("RGB", size, "red").save(f, format=fmt, **options)
+    return f.getvalue()
+
+
+def size_of(data: bytes) -> tuple[int, int]:
+    with Image.open(io.BytesIO(data)) as img:
+        return tuple(img.size)
+
+
+@pytest.fixture
+def photos() -> UploadSet:
+    return UploadSet("photos", IMAGES)
+
+
+@pytest.fixture
+def make_variants_app(
+    tmp_path: Path, photos: UploadSet, make_app: MakeApp
+) -> MakeApp:
+    """
+    This returns a factory for applications which serve variants of
+    `photos`.
+    """
+    def make_variants_app(**config: object) -> Flask:
+        return make_app(
+            photos,
+            UPLOADS_AUTOSERVE=True,
+            UPLOADED_PHOTOS_DEST=str(tmp_path / "photos"),
+            UPLOADED_PHOTOS_VARIANTS=["w320", "h100", "64x64"],
+            UPLOADED_PHOTOS_VARIANTS_DEST=str(tmp_path / "variants"),
+            **config)
+    return make_variants_app
+
+
+def save(app: Flask, photos: UploadSet, data: bytes, name: str) -> str:
+    with app.app_context():
+        return photos.save(FileStorage(io.BytesIO(data), filename=name))
+
+
+class TestVariant:
+    @pytest.mark.parametrize("spec, width, height", [
+        ("w320", 320, None),
+        ("h240", None, 240),
+        ("320x240", 320, 240),
+    ])
+    def test_parse(
+        self, spec: str, width: int | None, height: int | None
+    ) -> None:
+        assert Variant.parse(spec) == Variant(spec, width, height)
+
+    @pytest.mark.parametrize("spec", ["", "w", "w-1", "w0", "320x", "x240"])
+    def test_invalid_specifications(self, spec: str) -> None:
+        with pytest.raises(ValueError):
+            Variant.parse(spec)
+
+    def test_variant(self) -> None:
+        with pytest.raises(ValueError):
+            Variant("any")
+        assert repr(Variant.parse("w320")) == "<Variant w320 320xNone>"
+        assert Variant.parse("w320") != "w320"
+        assert Variant.parse("64x32").box(transposed=True) == (32, 64)
+
+
+class TestConfiguration:
+    def test_variants_are_read_from_the_configuration(
+        self,
+        tmp_path: Path,
+        make_variants_app: MakeApp,
+        make_app: MakeApp,
+        photos: UploadSet
+    ) -> None:
+        app = make_variants_app(UPLOADED_PHOTOS_VARIANTS_MAX_SIZE=1000)
+        cache = app.upload_set_config["photos"].variant_cache  # type: ignore
+        assert list(cache.variants) == ["w320", "h100", "64x64"]
+        assert cache.folder == str(tmp_path / "variants")
+        assert cache.max_size == 1000
+
+        with patch("tempfile.gettempdir", return_value=str(tmp_path)):
+            app = make_app(
+                photos, UPLOADED_PHOTOS_DEST=str(tmp_path),
+                UPLOADED_PHOTOS_VARIANTS=[Variant("thumb", 100, 100)])
+        cache = app.upload_set_config["photos"].variant_cache  # type: ignore
+        assert cache.variants == dict(thumb=Variant("thumb", 100, 100))
+        default = tmp_path / "flask-uploads-variants"
+        assert cache.folder == str(default / "photos")
+        assert os.stat(default).st_mode & 0o777 == 0o700
+
+        # another user may have created the default folder
+        default.chmod(0o777)
+        with patch("tempfile.gettempdir", return_value=str(tmp_path)):
+            with pytest.raises(PermissionError):
+                configure_uploads(app, photos)
+
+    def test_invalid_configurations(self) -> None:
+        assert UploadConfiguration("/uploads").variant_cache is None
+        with pytest.raises(ValueError):
+            UploadConfiguration("/uploads", variants=["w320"])
+        with pytest.raises(ValueError):
+            VariantCache("/variants", {}, max_size=0)
+        with patch("flask_uploads.flask_uploads.pillow_available",
+                   return_value=False):
+            with pytest.raises(RuntimeError):
+                UploadConfiguration(
+                    "/uploads", variants=["w320"], variants_dest="/variants")
+
+    def test_url(self, make_variants_app: MakeApp, photos: UploadSet) -> None:
+        app = make_variants_app(
+            UPLOADED_PHOTOS_URL="https://cdn.example.com/photos/")
+        # variants are served by the blueprint even with a base url
+        assert "_uploads" in app.blueprints
+        with app.test_request_context():
+            assert photos.url("a.png") == (
+                "https://cdn.example.com/photos/a.png")
+            assert photos.url("a.png", variant="w320") == (
+                "http://localhost/_uploads/photos/a.png?variant=w320")
+            with pytest.raises(ValueError):
+                photos.url("a.png", variant="w1000")
+
+
+class TestServingVariants:
+    def test_variants_are_created_on_demand(
+        self, tmp_path: Path, make_variants_app: MakeApp, photos: UploadSet
+    ) -> None:
+        app = make_variants_app()
+        name = save(app, photos, image((800, 600)), "holiday.png")
+        client = app.test_client()
+        with patch("flask_uploads.variants.render", wraps=render) as spy:
+            for _ in range(2):
+                response = client.get(
+                    "/_uploads/photos/holiday.png?variant=w320")
+                assert response.status_code == 200
+                assert response.mimetype == "image/png"
+                assert size_of(response.data) == (320, 240)
+        assert spy.call_count == 1
+        assert (tmp_path / "variants" / "w320" / name).exists()
+
+        response = client.get("/_uploads/photos/holiday.png?variant=h100")
+        assert size_of(response.data) == (133, 100)
+        # images are never scaled up
+        name = save(app, photos, image((40, 20)), "icon.png")
+        response = client.get("/_uploads/photos/icon.png?variant=64x64")
+        assert size_of(response.data) == (40, 20)
+
+    @pytest.mark.parametrize("url", [
+        "/_uploads/photos/holiday.png?variant=w1000",
+        "/_uploads/photos/missing.png?variant=w320",
+        "/_uploads/photos/broken.png?variant=w320",
+        "/_uploads/others/holiday.png?variant=w320",
+    ])
+    def test_unavailable_variants(
+        self,
+        tmp_path: Path,
+        url: str,
+        make_variants_app: MakeApp,
+        photos: UploadSet
+    ) -> None:
+        app = make_variants_app()
+        save(app, photos, image((800, 600)), "holiday.png")
+        save(app, photos, b"not an image", "broken.png")
+        app.config["UPLOADED_OTHERS_DEST"] = str(tmp_path / "others")
+        configure_uploads(app, UploadSet("others", IMAGES))
+        (tmp_path / "others").mkdir()
+        (tmp_path / "others" / "holiday.png").write_bytes(image((800, 600)))
+        assert app.test_client().get(url).status_code == 404
+        assert list((tmp_path / "variants").rglob(".*")) == []
+
+    def test_exif_orientation(
+        self, make_variants_app: MakeApp, photos: UploadSet
+    ) -> None:
+        exif = Image.Exif()
+        exif[0x0112] = 6  # rotated by 90 degrees
+        data = image((400, 200), "JPEG", exif=exif)
+        app = make_variants_app()
+        save(app, photos, data, "portrait.jpg")
+        response = app.test_client().get(
+            "/_uploads/photos/portrait.jpg?variant=w320")
+        assert response.mimetype == "image/jpeg"
+        assert size_of(response.data) == (200, 400)
+        response = app.test_client().get(
+            "/_uploads/photos/portrait.jpg?variant=h100")
+        assert size_of(response.data) == (50, 100)
+
+    def test_concurrent_requests_create_a_variant_once(
+        self, make_variants_app: MakeApp, photos: UploadSet
+    ) -> None:
+        app = make_variants_app()
+        save(app, photos, image((800, 600)), "holiday.png")
+        calls = []
+
+        def slow(source: IO[bytes], path: str, variant: Variant) -> None:
+            calls.append(path)
+            time.sleep(0.1)
+            render(source, path, variant)
+
+        def get(_: int) -> bytes:
+            with app.test_client() as client:
+                response = client.get(
+                    "/_uploads/photos/holiday.png?variant=w320")
+                return bytes(response.data)
+
+        with patch("flask_uploads.variants.render", side_effect=slow):
+            with ThreadPoolExecutor(8) as pool:
+                results = list(pool.map(get, range(8)))
+        assert len(calls) == 1
+        assert all(size_of(data) == (320, 240) for data in results)
+
+    def test_least_recently_used_variants_are_evicted(
+        self, tmp_path: Path, make_variants_app: MakeApp, photos: UploadSet
+    ) -> None:
+        app = make_variants_app(UPLOADED_PHOTOS_VARIANTS_MAX_SIZE=1)
+        client = app.test_client()
+        for name in ["a.png", "b.png"]:
+            save(app, photos, image((800, 600)), name)
+            assert client.get(
+                "/_uploads/photos/%s?variant=w320" % name).status_code == 200
+        assert os.listdir(tmp_path / "variants" / "w320") == ["b.png"]
+        cache = app.upload_set_config["photos"].variant_cache  # type: ignore
+        assert cache.size == os.path.getsize(tmp_path / "variants/w320/b.png")
+        os.remove(tmp_path / "variants/w320/b.png")
+        # evicting a file another process removed already
+        assert client.get(
+            "/_uploads/photos/a.png?variant=w320").status_code == 200
+
+    def test_existing_variants_are_picked_up(
+        self, tmp_path: Path, make_variants_app: MakeApp, photos: UploadSet
+    ) -> None:
+        app = make_variants_app()
+        save(app, photos, image((800, 600)), "a.png")
+        app.test_client().get("/_uploads/photos/a.png?variant=w320")
+        (tmp_path / "variants" / ".tmp").write_bytes(b"partial")
+        cache = VariantCache(
+            str(tmp_path / "variants"), dict(w320=Variant.parse("w320")))
+        assert cache.size == os.path.getsize(tmp_path / "variants/w320/a.png")
+
+    def test_saving_and_deleting_remove_variants(
+        self, tmp_path: Path, make_variants_app: MakeApp, photos: UploadSet
+    ) -> None:
+        app = make_variants_app()
+        client = app.test_client()
+        save(app, photos, image((800, 600)), "a.png")
+        client.get("/_uploads/photos/a.png?variant=w320")
+        client.get("/_uploads/photos/a.png?variant=h100")
+        cache = app.upload_set_config["photos"].variant_cache  # type: ignore
+        assert cache.size > 0
+        with app.app_context():
+            photos.delete("a.png")
+        assert not (tmp_path / "variants" / "w320" / "a.png").exists()
+        assert cache.size == 0
+
+        save(app, photos, image((100, 100)), "a.png")
+        response = client.get("/_uploads/photos/a.png?variant=w320")
+        assert size_of(response.data) == (100, 100)
+
+    def test_variants_of_files_in_a_backend(
+        self, make_variants_app: MakeApp, photos: UploadSet
+    ) -> None:
+        app = make_variants_app(
+            UPLOADED_PHOTOS_BACKEND=MemoryBackend(),
+            UPLOADED_PHOTOS_SHARDING="hash:2",
+            UPLOADED_PHOTOS_CACHE_MAX_AGE=60)
+        name = save(app, photos, image((800, 600)), "holiday.png")
+        response = app.test_client().get(
+            "/_uploads/photos/%s?variant=w320" % name)
+        assert size_of(response.data) == (320, 240)
+        assert response.cache_control.max_age == 60
+
+
+class TestVariantCache:
+    def test_failed_renders_leave_no_files(self, tmp_path: Path) -> None:
+        variant = Variant.parse("w10")
+        data = image((20, 20))
+        with patch("PIL.Image.Image.save", side_effect=OSError("disk full")):
+            with pytest.raises(OSError):
+                render(io.BytesIO(data), str(tmp_path / "a.png"), variant)
+        assert os.listdir(tmp_path) == []
+
+    def test_lock_is_released(self, tmp_path: Path) -> None:
+        cache = VariantCache(str(tmp_path), dict(w10=Variant.parse("w10")))
+        with pytest.raises(FileNotFoundError):
+            cache.get("w10", "a.png", lambda key: open(tmp_path / key, "rb"))
+        assert cache._locks == {}